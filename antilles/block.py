@@ -1,16 +1,34 @@
 import json
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
-from os.path import join, dirname, basename
-from typing import List, Dict, Any
-
+from os.path import join
+from typing import (
+    List,
+    Dict,
+    Any,
+    Optional,
+    Union,
+    Callable,
+    Iterator,
+    Iterable,
+    Tuple,
+    Collection,
+)
+
+import numpy
 import pandas
-from PIL import Image
 
-from .utils import upsert
-from .utils.image import get_slide_dims
-from .utils.io import DAO, get_sample_prefix
+from .utils import upsert, select
+from .utils.slides import get_slide_dims, get_image_size
+from .utils.arrays import RegionStore
+from .utils.index import FileIndex
+from .utils.regions import RegionReader, FileReader
+from .utils.spatial import ObjectIndex
+from .utils.io import DAO, get_sample_prefix, get_config, init_worker
+from .utils.store import CsvStore, SqliteStore, get_store
 from .utils.math import init_arrow_coords
+from .utils.tissue import init_section_coords
 from .wholeslideimage import WholeSlideImage
 
 
@@ -23,6 +41,11 @@ class Field(Enum):
     REGIONS_COORDS_BOW = "REGIONS_COORDS_BOW"  # REGIONS_COORDS_BOW
     CELLPROFILER_REGION_INPUT = "CELLPROFILER_REGION_INPUT"
 
+    REGIONS_MANIFEST = "REGIONS_MANIFEST"
+    PROFILES = "PROFILES"
+    OBJECTS = "OBJECTS"
+    REGISTRATION = "REGISTRATION"
+
 
 class Step(Enum):
     S0 = "0_slides"
@@ -47,7 +70,202 @@ columns_upsert = {
     Field.ANGLES_COARSE: ["sample"],
     Field.IMAGES_COORDS_BOW: [],
     Field.REGIONS_COORDS_BOW: ["project", "block", "panel", "level", "sample", "drug"],
+    Field.REGIONS_MANIFEST: [],
+    Field.PROFILES: ["relpath", "distance", "angle"],
+    Field.OBJECTS: ["relpath", "object"],
+    Field.REGISTRATION: [],
+}
+
+dtypes_bow = {
+    "relpath": "str",
+    "project": "category",
+    "block": "category",
+    "panel": "category",
+    "level": "int32",
+    "sample": "category",
+    "cohorts": "str",
+    "drug": "category",
+    "origin_x": "int32",
+    "origin_y": "int32",
+    "center_x": "int32",
+    "center_y": "int32",
+    "well_x": "int32",
+    "well_y": "int32",
+    "mpp": "float32",
+    "metadata": "str",
 }
+# where a virtual region is in its source slide, in level 0 pixels
+dtypes_manifest = {
+    "relpath": "str",
+    "src": "str",
+    "level": "int32",
+    "origin_x": "int32",
+    "origin_y": "int32",
+    "width": "int32",
+    "height": "int32",
+    "center_x": "int32",
+    "center_y": "int32",
+    "angle": "float64",
+    "span": "float64",
+    "radius_inner": "float64",
+    "radius_outer": "float64",
+    "mpp": "float32",
+}
+columns_manifest = list(dtypes_manifest.keys())
+
+# mean measurements in bins of distance (microns) from the well and angle
+dtypes_profiles = {
+    "relpath": "str",
+    "project": "category",
+    "block": "category",
+    "panel": "category",
+    "level": "int32",
+    "sample": "category",
+    "drug": "category",
+    "distance": "float32",
+    "angle": "float32",
+    "n_pixels": "int64",
+}
+
+# objects detected in regions: centroids and areas in region pixels, and mean
+# stain densities
+dtypes_objects = {
+    "relpath": "str",
+    "project": "category",
+    "block": "category",
+    "panel": "category",
+    "level": "int32",
+    "sample": "category",
+    "drug": "category",
+    "object": "int32",
+    "x": "float32",
+    "y": "float32",
+    "area": "int32",
+    "intensity": "float32",
+}
+
+# rigid transforms from level 0 of a reference slide to level 0 of each slide,
+# as the first two rows of a 3 x 3 matrix, and the quality of each alignment
+dtypes_registration = {
+    "relpath": "str",
+    "reference": "str",
+    "m00": "float64",
+    "m01": "float64",
+    "m02": "float64",
+    "m10": "float64",
+    "m11": "float64",
+    "m12": "float64",
+    "rotation": "float64",
+    "quality": "float32",
+    "flagged": "bool",
+}
+
+columns_dtypes = {
+    Field.IMAGES_COORDS: {
+        "relpath": "str",
+        "project": "category",
+        "block": "category",
+        "level": "int32",
+        "sample": "category",
+        "cohorts": "str",
+        "panel": "category",
+        "center_x": "int32",
+        "center_y": "int32",
+    },
+    Field.ANGLES_COARSE: {"sample": "category", "angle": "float64"},
+    Field.IMAGES_COORDS_BOW: dtypes_bow,
+    Field.REGIONS_COORDS_BOW: dtypes_bow,
+    Field.REGIONS_MANIFEST: dtypes_manifest,
+    Field.PROFILES: dtypes_profiles,
+    Field.OBJECTS: dtypes_objects,
+    Field.REGISTRATION: dtypes_registration,
+}
+
+
+def columns_key(field: Field) -> List[str]:
+    # regions are uniquely identified by their paths when no other key is set
+    return columns_upsert[field] or ["relpath"]
+
+
+# CellProfiler only reads csv files
+fields_csv = [Field.CELLPROFILER_IMAGE_INPUT, Field.CELLPROFILER_REGION_INPUT]
+
+
+def cast(df: pandas.DataFrame, field: Field) -> pandas.DataFrame:
+    """
+    A copy of an annotation frame with its columns coerced to the fixed schema
+    of its field; the frame passed in is left as it is. Categories are built
+    from strings, so that samples named with digits only are not read back as
+    integers.
+    """
+    df = df.copy()
+    for column, dtype in columns_dtypes.get(field, {}).items():
+        if column not in df.columns:
+            continue
+
+        if dtype == "category":
+            if not isinstance(df[column].dtype, pandas.CategoricalDtype):
+                df[column] = df[column].astype(str).astype(dtype)
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+class MergeConflict(RuntimeError):
+    """
+    Rows changed both by this session and by another writer since this
+    session read them. `keys` are the key values of those rows.
+    """
+
+    def __init__(self, name: str, keys: List[Tuple[Any, ...]]):
+        super().__init__(f"{name} rows changed by another writer: {keys}")
+        self.keys = keys
+
+
+def changed_rows(
+    df: pandas.DataFrame, base: pandas.DataFrame, keys: List[str]
+) -> numpy.ndarray:
+    """
+    Whether each row of `df` is missing from `base`, by key, or differs from
+    the row of `base` with its key in any of the columns they share.
+    """
+    columns = [c for c in df.columns if c in base.columns]
+    # values are compared as text, so that dtypes of the two do not matter
+    left = df[columns].astype(str).reset_index(drop=True)
+    right = base[columns].astype(str).drop_duplicates(subset=keys, keep="last")
+
+    merged = left.merge(
+        right, on=keys, how="left", suffixes=("", "_base"), indicator=True
+    )
+    changed = (merged["_merge"] == "left_only").to_numpy(copy=True)
+    for column in columns:
+        if column not in keys:
+            changed |= (merged[column] != merged[column + "_base"]).to_numpy()
+    return changed
+
+
+def merge_changes(
+    df: pandas.DataFrame,
+    snapshot: pandas.DataFrame,
+    stored: pandas.DataFrame,
+    keys: List[str],
+    name: str = "",
+) -> pandas.DataFrame:
+    """
+    The rows of `df` that this session changed since it read `snapshot`, to be
+    upserted into `stored`, which another writer has changed since. Raises
+    MergeConflict if the other writer changed any of those rows differently.
+    """
+    mine = df[changed_rows(df, snapshot, keys)]
+    theirs = stored[changed_rows(stored, snapshot, keys)]
+
+    both = pandas.MultiIndex.from_frame(mine[keys].astype(str)).isin(
+        pandas.MultiIndex.from_frame(theirs[keys].astype(str))
+    )
+    clashes = mine[both][changed_rows(mine[both], theirs, keys)]
+    if len(clashes) > 0:
+        raise MergeConflict(name, list(clashes[keys].itertuples(index=False)))
+    return mine
 
 
 def unpack(block: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -106,13 +324,60 @@ def unpack(block: Dict[str, Any]) -> List[Dict[str, Any]]:
     return samples
 
 
-def init_coords_slides(
+def init_coords_grid(
     slides: List[WholeSlideImage], samples: List[Dict[str, Any]]
+) -> List[List[Tuple[int, int]]]:
+    return [
+        list(init_arrow_coords(get_slide_dims(slide.relpath), len(samples)))
+        for slide in slides
+    ]
+
+
+def init_coords_tissue(
+    slides: List[WholeSlideImage],
+    samples: List[Dict[str, Any]],
+    params: Dict[str, Any],
+) -> List[List[Tuple[int, int]]]:
+    # thumbnails are read and segmented a slide per worker process
+    relpaths = [slide.relpath for slide in slides]
+    with ProcessPoolExecutor(
+        max_workers=params["max_workers"],
+        initializer=init_worker,
+        initargs=(get_config().to_dict(),),
+    ) as pool:
+        return list(
+            pool.map(
+                init_section_coords,
+                relpaths,
+                [len(samples)] * len(relpaths),
+                [params] * len(relpaths),
+            )
+        )
+
+
+def init_coords_slides(
+    slides: List[WholeSlideImage],
+    samples: List[Dict[str, Any]],
+    params: Optional[Dict[str, Any]] = None,
+    placed: Collection[str] = (),
 ) -> pandas.DataFrame:
+    """
+    Initial arrow coordinates of every sample on every slide: on an even grid,
+    or, if the method of `params` (see arrow_init_defaults) is "tissue", at the
+    centroids of the tissue sections of each slide. Slides whose relpaths are
+    `placed`, e.g. as their arrows are stored already, are left on the grid
+    rather than segmented again.
+    """
+    coords_slides = init_coords_grid(slides, samples)
+    if params is not None and params["method"] == "tissue":
+        todo = [i for i, slide in enumerate(slides) if slide.relpath not in placed]
+        if len(todo) > 0:
+            found = init_coords_tissue([slides[i] for i in todo], samples, params)
+            for i, coords in zip(todo, found):
+                coords_slides[i] = coords
+
     df = []
-    for slide in slides:
-        dims = get_slide_dims(slide.relpath)
-        coords = list(init_arrow_coords(dims, len(samples)))
+    for slide, coords in zip(slides, coords_slides):
         for i, sample in enumerate(samples):
             df.append(
                 {
@@ -162,26 +427,48 @@ def init_coords_bows(
         "metadata",
     ]
 
-    for region in regions:
-        with Image.open(DAO.abs(region["relpath"])) as obj:
-            x, y = obj.size
-        region["origin_x"] = 0
-        region["origin_y"] = 0
-        region["center_x"] = int(round(x / 2))
-        region["center_y"] = int(round(y / 2))
-        region["well_x"] = int(round(x / 2 + x / 10))
-        region["well_y"] = int(round(y / 2))
-        region["mpp"] = 0.0
-        region["metadata"] = json.dumps({})
-
-        cohorts = next(s["cohorts"] for s in samples if s["name"] == region["sample"])
-        region["cohorts"] = json.dumps(cohorts)
-
-    df = pandas.DataFrame(regions, columns=columns)
+    if len(regions) == 0:
+        return pandas.DataFrame(columns=columns)
+
+    cohorts = {s["name"]: json.dumps(s["cohorts"]) for s in samples}
+
+    df = pandas.DataFrame(regions)
+    x, y = df["width"].to_numpy(), df["height"].to_numpy()
+    df["origin_x"] = 0
+    df["origin_y"] = 0
+    df["center_x"] = numpy.round(x / 2).astype(int)
+    df["center_y"] = numpy.round(y / 2).astype(int)
+    df["well_x"] = numpy.round(x / 2 + x / 10).astype(int)
+    df["well_y"] = numpy.round(y / 2).astype(int)
+    df["mpp"] = 0.0
+    df["metadata"] = json.dumps({})
+    df["cohorts"] = df["sample"].map(cohorts)
+
+    df = df[columns]
     df = df.sort_values(by=["project", "block", "panel", "level", "sample", "drug"])
     return df
 
 
+# where arrows are first put on each slide; see init_coords_slides
+arrow_init_defaults = {
+    "method": "grid",  # or "tissue"
+    "label_side": "left",  # of the slide thumbnails
+    "max_size": 1024,  # pixels, of the thumbnails
+    "min_saturation": 0.05,
+    "min_size": 64,  # thumbnail pixels, of the smallest section
+    "max_workers": None,
+}
+
+# stain densities of each region, written alongside or instead of its pixels
+stain_output_defaults = {
+    "stains": "hed",
+    "dtype": "uint8",  # or float16
+    "od_max": 2.0,  # optical density scaled to 255 in uint8
+    "chunk_rows": 256,
+    "max_workers": None,
+}
+
+
 def get_step_dir(step: Step, **kwargs) -> str:
     assert step.name in Step.__members__.keys()
     if step == Step.S1:
@@ -209,128 +496,339 @@ class Block:
         self.samples = unpack(block)
         self.project = project
 
+        # versions of the stored annotations when last read, to detect writes
+        # by other processes, and the rows read, to tell which rows were changed
+        self.versions: Dict[Field, Any] = {}
+        self.snapshots: Dict[Field, pandas.DataFrame] = {}
+
+        self.images_index = FileIndex(join(self.relpath, Step.S0.value))
+        self.regions_index = FileIndex(join(self.relpath, "0_regions"), recursive=True)
+
         sample_names = (s["name"] for s in self.samples)
         self.log.info(f"Samples in block {self.name}: " + ", ".join(sample_names))
 
+    def update(self, block: Dict[str, Any]) -> None:
+        """
+        Takes up a changed configuration of this block, keeping what was read.
+        """
+        self.samples = unpack(block)
+
     @property
     def relpath(self) -> str:
         return join(self.project.relpath, self.name)
 
     @property
     def images(self) -> List[WholeSlideImage]:
-        dirpath = join(self.relpath, Step.S0.value)
-        regex = self.project.image_regex
-
-        images = []
-        for filename in DAO.list_files(dirpath):
-            match = regex.fullmatch(filename)
-            if match:
-                image = WholeSlideImage(**match.groupdict())
-                image.relpath = join(dirpath, filename)
-                images.append(image)
-        return images
+        return self.find_images()
 
     @property
     def regions(self) -> List[Dict[str, Any]]:
-        dirpath = join(self.relpath, "0_regions")
-        regex = self.project.region_regex
+        return self.find_regions()
 
+    def find_images(self, **fields) -> List[WholeSlideImage]:
         images = []
-        for relpath in DAO.list_files_recursively(dirpath):
-            filename = basename(relpath)
-            match = regex.fullmatch(filename)
-            if match:
-                image = match.groupdict()
-                image["relpath"] = relpath
-                images.append(image)
+        for entry in self.images_index.find(self.project.image_regex, **fields):
+            image = WholeSlideImage(**entry["fields"])
+            image.relpath = entry["file"]["relpath"]
+            images.append(image)
         return images
 
+    def find_regions(self, **fields) -> List[Dict[str, Any]]:
+        entries = self.regions_index.find(self.project.region_regex, **fields)
+
+        # sizes are read from the image headers once per file, in parallel
+        files = [entry["file"] for entry in entries]
+        sizes = self.regions_index.memoize(files, "size_px", get_image_size)
+
+        return [
+            {
+                **entry["fields"],
+                "relpath": entry["file"]["relpath"],
+                "width": size[0],
+                "height": size[1],
+            }
+            for entry, size in zip(entries, sizes)
+        ]
+
     def init(self, field: Field) -> pandas.DataFrame:
         if field == Field.IMAGES_COORDS:
-            return init_coords_slides(self.images, self.samples)
+            return init_coords_slides(self.images, self.samples, self.arrow_init)
         elif field == Field.ANGLES_COARSE:
             return init_angles_coarse(self.samples)
         else:
             return pandas.DataFrame()
 
-    def get(self, field: Field) -> pandas.DataFrame:
-        filename = join("annotations", f"{field.value}.csv")
-        filepath = join(self.relpath, filename)
+    @property
+    def backend(self) -> str:
+        return self.project.config.get("storage", "csv")
+
+    def store(self, field: Field) -> Union[CsvStore, SqliteStore]:
+        dirpath = join(self.relpath, "annotations")
+        if field in fields_csv:
+            return CsvStore(dirpath)
+        elif self.backend == "sqlite":
+            path = join(self.project.relpath, "annotations.sqlite")
+            return SqliteStore(path, block=self.name, keys=columns_key(field))
+        else:
+            return get_store(self.backend, dirpath)
+
+    @staticmethod
+    def schema(field: Field) -> Callable[[pandas.DataFrame], pandas.DataFrame]:
+        return lambda df: cast(df, field)
+
+    def read(
+        self, field: Field, where: Dict[str, Any] = None
+    ) -> Optional[pandas.DataFrame]:
+        store = self.store(field)
+        self.versions[field] = store.version(field.value)
+
+        if not store.exists(field.value):
+            # annotations written before switching backends are still csv files
+            store = CsvStore(join(self.relpath, "annotations"))
+            if not store.exists(field.value):
+                return None
+
+        df = cast(store.read(field.value, where=where), field)
+        # a copy, as callers change the rows they are given in place
+        self.snapshots[field] = df.copy()
+        return df
+
+    def read_chunks(
+        self,
+        field: Field,
+        chunksize: int,
+        where: Dict[str, Any] = None,
+        columns: List[str] = None,
+    ) -> Iterator[pandas.DataFrame]:
+        """
+        Stored annotations for a field, a chunk of rows at a time, so that
+        large fields are not loaded at once. Defaults for rows that are not
+        stored yet are not added; see `get`. `columns` limits the columns read.
+        """
+        store = self.store(field)
+        if not store.exists(field.value):
+            store = CsvStore(join(self.relpath, "annotations"))
+            if not store.exists(field.value):
+                return
+
+        chunks = store.read_chunks(field.value, chunksize, where=where, columns=columns)
+        for df in chunks:
+            yield cast(df, field)
+
+    def get(self, field: Field, where: Dict[str, Any] = None) -> pandas.DataFrame:
+        """
+        Annotations for a field, with defaults for slides and regions that have
+        not been annotated yet. `where` maps columns to the values to keep, e.g.
+        {"sample": "SMP1"}; with the sqlite backend only those rows are loaded.
+        """
+        df = self.read(field, where=where)
 
         if field == Field.IMAGES_COORDS:
-            df_init = init_coords_slides(self.images, self.samples)
-            if DAO.is_file(filepath):
-                df = DAO.read_csv(filepath)
-                df["sample"] = df["sample"].astype(str)
-                df = upsert(df_init, using=df, cols=columns_upsert[field])
-                return df
-            else:
-                return df_init
+            # sections are only found on slides without stored arrows
+            placed = set() if df is None else set(df["relpath"])
+            df_init = init_coords_slides(
+                self.images, self.samples, self.arrow_init, placed=placed
+            )
+            cols = columns_upsert[field]
 
         elif field == Field.ANGLES_COARSE:
             df_init = init_angles_coarse(self.samples)
-            if DAO.is_file(filepath):
-                df = DAO.read_csv(filepath)
-                df["sample"] = df["sample"].astype(str)
-                df = upsert(df_init, using=df, cols=columns_upsert[field])
-                return df
-            else:
-                return df_init
+            cols = columns_upsert[field]
 
         elif field == Field.IMAGES_COORDS_BOW:
-            df_init = pandas.DataFrame(
-                columns=[
-                    "relpath",
-                    "project",
-                    "block",
-                    "panel",
-                    "level",
-                    "sample",
-                    "cohorts",
-                    "drug",
-                    "origin_x",
-                    "origin_y",
-                    "center_x",
-                    "center_y",
-                    "well_x",
-                    "well_y",
-                    "mpp",
-                    "metadata",
-                ]
-            )
-            if DAO.is_file(filepath):
-                df = DAO.read_csv(filepath)
-                df["sample"] = df["sample"].astype(str)
-                df = upsert(df_init, using=df, cols=columns_upsert[field])
-                return df
-            else:
-                return df_init
+            df_init = pandas.DataFrame(columns=list(dtypes_bow.keys()))
+            cols = columns_upsert[field]
 
         elif field == Field.REGIONS_COORDS_BOW:
             df_init = init_coords_bows(self.regions, self.samples)
-            if DAO.is_file(filepath):
-                df = DAO.read_csv(filepath)
-                df["sample"] = df["sample"].astype(str)
-
-                df = upsert(
-                    df_init, using=df, cols=["relpath"]
-                )  # columns_upsert[field])
-                return df
-            else:
-                return df_init
+            cols = ["relpath"]  # columns_upsert[field]
 
         else:
             raise RuntimeError(f"Unknown field {field.name}!")
 
-    def save(self, df: pandas.DataFrame, field: Field, overwrite: bool = True):
-        filename = join("annotations", f"{field.value}.csv")
-        filepath = join(self.relpath, filename)
+        if where is not None:
+            df_init = select(df_init, where)
+
+        if df is not None:
+            df_init = upsert(cast(df_init, field), using=df, cols=cols)
+        df = cast(df_init, field)
+        # defaults count as read, so that only rows changed since are merged
+        self.snapshots[field] = df.copy()
+        return df
+
+    def save(
+        self,
+        df: pandas.DataFrame,
+        field: Field,
+        overwrite: bool = True,
+        merge: bool = False,
+    ):
+        """
+        Writes the annotations of a field, atomically and under an advisory
+        lock. With merge=True, rows that another process saved since this block
+        last read the field are kept: if the stored version has changed, only
+        the rows of `df` that differ from what this block read are upserted
+        into it, on the field's key columns. MergeConflict is raised, and
+        nothing written, if the other process changed any of the same rows.
+        """
+        store = self.store(field)
+        name = field.value
+        df = cast(df, field)
+
+        with store.lock(name):
+            if store.exists(name) and not overwrite:
+                self.log.info("Metadata not written.")
+                return
+
+            version = store.version(name)
+            if (
+                merge
+                and store.exists(name)
+                and (version is None or version != self.versions.get(field))
+            ):
+                self.log.info(f"{name} was changed by another writer; merging.")
+                keys = columns_key(field)
+                snapshot = self.snapshots.get(field)
+                rows = df
+                if snapshot is not None:
+                    stored = cast(store.read(name), field)
+                    rows = merge_changes(df, snapshot, stored, keys, name=name)
+                store.upsert(rows, name, keys=keys, schema=self.schema(field))
+            else:
+                store.write(df, name)
+
+            self.versions[field] = store.version(name)
+            self.snapshots[field] = df.copy()
+
+    def save_chunks(self, chunks: Iterable[pandas.DataFrame], field: Field) -> None:
+        """
+        Writes the annotations of a field from an iterable of frames, one at a
+        time, replacing what is stored.
+        """
+        store = self.store(field)
+        with store.lock(field.value):
+            store.write_chunks((cast(df, field) for df in chunks), field.value)
+            self.versions[field] = store.version(field.value)
+
+    def upsert(self, df: pandas.DataFrame, field: Field) -> None:
+        """
+        Writes only the given rows, keeping the other stored rows of the field.
+        Use this for frames obtained with `get(field, where=...)`.
+        """
+        store = self.store(field)
+        store.upsert(
+            cast(df, field),
+            field.value,
+            keys=columns_key(field),
+            schema=self.schema(field),
+        )
+
+    @property
+    def region_format(self) -> str:
+        # "tif" writes one file per region, "store" packs them into the region
+        # store, and "virtual" only records where they are in their slides
+        return self.project.config.get("region_format", "tif")
 
-        if not DAO.is_file(filepath) or overwrite:
-            DAO.make_dir(dirname(filepath))
-            DAO.to_csv(df, filepath)
+    @property
+    def region_reader(self) -> Optional[RegionReader]:
+        if self.region_format != "virtual":
+            return None
+
+        manifest = self.read(Field.REGIONS_MANIFEST)
+        if manifest is None:
+            return None
+        return RegionReader(manifest)
+
+    def open_regions(self) -> Union[FileReader, RegionStore, RegionReader]:
+        """
+        A reader of extracted region pixels, whichever their format: each has
+        size(relpath) and read(relpath, x, y, width, height).
+        """
+        if self.region_format == "virtual":
+            return self.region_reader
+        elif self.region_format == "store":
+            return self.region_store
         else:
-            self.log.info("Metadata not written.")
+            return FileReader()
+
+    @property
+    def region_store(self) -> RegionStore:
+        settings = self.project.config.get("region_store", {})
+        return RegionStore(join(self.relpath, Step.S1.value + ".store"), **settings)
+
+    @property
+    def polar_store(self) -> RegionStore:
+        # regions resampled around their bows by antilles.pipeline.unwarp
+        settings = self.project.config.get("region_store", {})
+        dirpath = get_step_dir(Step.S2, mode="polar") + ".store"
+        return RegionStore(join(self.relpath, dirpath), **settings)
+
+    @property
+    def histogram_store(self) -> RegionStore:
+        # radial histograms of regions; see antilles.pipeline.histogram
+        settings = self.project.config.get("region_store", {})
+        dirpath = get_step_dir(Step.S2, mode="histogram") + ".store"
+        return RegionStore(join(self.relpath, dirpath), **settings)
+
+    @property
+    def arrow_init(self) -> Optional[Dict[str, Any]]:
+        # how arrows are first placed on slides, if set in project.json
+        settings = self.project.config.get("arrow_init")
+        if settings is None:
+            return None
+        return {**arrow_init_defaults, **settings}
+
+    @property
+    def stain_output(self) -> Optional[Dict[str, Any]]:
+        # stain densities written during extraction, if set in project.json
+        settings = self.project.config.get("stain_output")
+        if settings is None:
+            return None
+        if settings.get("keep_rgb", True) is False:
+            # fitting, adjusting, detecting, profiling and histograms all read
+            # the rgb regions, so stains are only ever written alongside them
+            raise ValueError("Stain output without rgb regions is not supported!")
+        return {**stain_output_defaults, **settings}
+
+    @property
+    def stain_store(self) -> Optional[RegionStore]:
+        if self.stain_output is None:
+            return None
+        settings = self.project.config.get("region_store", {})
+        dirpath = get_step_dir(Step.S2, mode=self.stain_output["stains"]) + ".store"
+        return RegionStore(join(self.relpath, dirpath), **settings)
+
+    def object_index(self, field: Field = Field.IMAGES_COORDS_BOW) -> ObjectIndex:
+        """
+        The spatial index of the objects of this block, in the bow coordinates
+        of `field`. It is saved next to the objects and rebuilt only when the
+        objects or bows have changed since.
+        """
+        dirpath = join(self.relpath, "annotations")
+        path = join(dirpath, Field.OBJECTS.value + ".index.npz")
+        versions = [self.store(f).version(f.value) for f in (Field.OBJECTS, field)]
+        version = None if None in versions else repr((field.value, *versions))
+
+        if version is not None and DAO.is_file(path):
+            index = ObjectIndex.load(path)
+            if index.version == version:
+                return index
+
+        objects = self.read(Field.OBJECTS)
+        if objects is None:
+            raise FileNotFoundError(f"No objects detected in block {self.name}!")
+
+        index = ObjectIndex.build(objects, self.get(field), version)
+        DAO.make_dir(dirpath)
+        index.save(path)
+        return index
 
     def clean(self) -> None:
         DAO.rm_dir(join(self.relpath, Step.S1.value))
+        DAO.rm_dir(join(self.relpath, Step.S1.value + ".store"))
+        for mode in ["polar", "histogram"]:
+            DAO.rm_dir(join(self.relpath, get_step_dir(Step.S2, mode=mode) + ".store"))
+        if self.stain_output is not None:
+            dirpath = get_step_dir(Step.S2, mode=self.stain_output["stains"])
+            DAO.rm_dir(join(self.relpath, dirpath))
+            DAO.rm_dir(join(self.relpath, dirpath + ".store"))
@@ -6,7 +6,7 @@ from matplotlib.axes import Axes
 from matplotlib.backend_bases import MouseEvent
 from matplotlib.patches import FancyArrowPatch, Arc
 
-from antilles.utils.math import cart2pol, pol2cart
+from antilles.utils.math import cart2pol, pol2cart, BOW_SPAN
 
 K_UP: str = "w"
 K_DOWN: str = "s"
@@ -270,7 +270,7 @@ class BowInteractor(BaseInteractor):
         self.cxy = kwargs.get("cxy")
         self.wxy = kwargs.get("wxy")
 
-        self.span = kwargs.get("span", 90.0)  # degrees
+        self.span = kwargs.get("span", BOW_SPAN)  # degrees
         self.stickout = kwargs.get("stickout", 50)  # px
 
         super().__init__(*args, **kwargs)
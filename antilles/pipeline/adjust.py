@@ -1,18 +1,20 @@
 import json
 import logging
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Union
 
 import wx
 from PIL import Image
-from pandas import DataFrame
+from pandas import DataFrame, Series
 from pubsub import pub
 
 from antilles.block import Field, Block
 from antilles.gui.interactors import device2interactor
 from antilles.gui.panels import ImageAnnotationPanel, ButtonPanel, MetadataPanel
 from antilles.project import Project
-from antilles.utils.image import get_thumbnail
+from antilles.utils.arrays import RegionStore
+from antilles.utils.image import get_region_thumbnail
+from antilles.utils.regions import RegionReader
 
 
 def get_interactors(region: Dict[str, Any]):
@@ -32,9 +34,11 @@ def get_interactors(region: Dict[str, Any]):
 
 
 class RegionBowAnnotationModel:
-    def __init__(self, regions: DataFrame):
+    def __init__(self, regions: DataFrame, relpaths: Optional[List[str]] = None):
         self.regions = regions
-        self.relpaths = sorted(list(set(self.regions["relpath"])))
+        if relpaths is None:
+            relpaths = self.regions["relpath"]
+        self.relpaths = sorted(list(set(relpaths)))
 
     def get(self, index: int) -> Dict[str, Any]:
         relpath = self.relpaths[index]
@@ -69,7 +73,7 @@ class RegionBowAnnotationModel:
 
     @property
     def n_regions(self) -> int:
-        return len(self.regions)
+        return len(self.relpaths)
 
 
 class RegionBowAnnotationView(wx.Frame):
@@ -185,9 +189,12 @@ class RegionBowAnnotationView(wx.Frame):
 
 
 class RegionBowAnnotationPresenter:
-    def __init__(self, model, view):
+    def __init__(
+        self, model, view, reader: Union[RegionReader, RegionStore, None] = None
+    ):
         self.model = model
         self.view = view
+        self.reader = reader
         self.state = {"ind": 0, "id": None, "factor": None}
 
         pub.subscribe(self.on_changed, "update")
@@ -217,7 +224,7 @@ class RegionBowAnnotationPresenter:
     def render(self) -> None:
         ind = self.state["ind"]
         region = self.model.get(ind)
-        thumbnail = get_thumbnail(region["relpath"])
+        thumbnail = get_region_thumbnail(region["relpath"], reader=self.reader)
         self.state["id"] = region["relpath"]
         self.state["factor"] = thumbnail["factor"]
 
@@ -261,12 +268,22 @@ class RegionBowAnnotationPresenter:
             self.render()
 
 
-def adjust_regions(*args, **kwargs) -> None:
-    model = RegionBowAnnotationModel(*args, **kwargs)
+def adjust_regions(
+    regions: DataFrame,
+    reader: Union[RegionReader, RegionStore, None] = None,
+    relpaths: Optional[List[str]] = None,
+) -> None:
+    """
+    Shows the regions at `relpaths`, or all of them, for adjustment. Changes
+    are written back into `regions`.
+    """
+    model = RegionBowAnnotationModel(regions, relpaths)
+    if model.n_regions == 0:
+        return
 
     app = wx.App()
     view = RegionBowAnnotationView()
-    presenter = RegionBowAnnotationPresenter(model=model, view=view)
+    presenter = RegionBowAnnotationPresenter(model=model, view=view, reader=reader)
     presenter.render()
 
     app.MainLoop()
@@ -278,12 +295,43 @@ class Adjuster:
         self.project = project
         self.block = block
 
-    def run(self) -> None:
+    def run(
+        self, skip_excluded: bool = False, max_confidence: Optional[float] = None
+    ) -> None:
+        """
+        Shows every region for adjustment, but those excluded with
+        `skip_excluded`, and those whose bows were fit with a confidence of at
+        least `max_confidence` (see antilles.pipeline.fit), if given.
+        """
         regions = self.block.get(Field.IMAGES_COORDS_BOW)
+        metadata = regions["metadata"].map(json.loads)
 
-        adjust_regions(regions)
+        relpaths = None
+        shown = Series(True, index=regions.index)
+        if skip_excluded:
+            # e.g. wells found to be off the tissue during extraction
+            excluded = metadata.map(lambda m: m.get("include") is False)
+            shown &= ~excluded
+            self.log.info(f"Skipping {int(excluded.sum())} excluded regions.")
+
+        if max_confidence is not None:
+            confident = metadata.map(
+                lambda m: m.get("bow_confidence", 0.0) >= max_confidence
+            )
+            shown &= ~confident
+            self.log.info(f"Skipping {int(confident.sum())} confidently fit regions.")
+
+        if skip_excluded or max_confidence is not None:
+            relpaths = list(regions.loc[shown, "relpath"])
+
+        # regions that were never written as tifs are read where they are kept
+        reader = None
+        if self.block.region_format in ("virtual", "store"):
+            reader = self.block.open_regions()
+        adjust_regions(regions, reader=reader, relpaths=relpaths)
 
-        self.block.save(regions, Field.IMAGES_COORDS_BOW)
+        # keep rows saved by other sessions while this one was open
+        self.block.save(regions, Field.IMAGES_COORDS_BOW, merge=True)
 
 
 class RegionAdjuster:
@@ -297,4 +345,5 @@ class RegionAdjuster:
 
         adjust_regions(regions)
 
-        self.block.save(regions, Field.REGIONS_COORDS_BOW)
+        # keep rows saved by other sessions while this one was open
+        self.block.save(regions, Field.REGIONS_COORDS_BOW, merge=True)
@@ -0,0 +1,234 @@
+import logging
+import math
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import List, Dict, Any, Tuple, Iterator, Optional
+
+import numpy
+import pandas
+from scipy import ndimage
+from skimage.feature import peak_local_max
+from skimage.filters import gaussian
+from skimage.measure import regionprops_table
+from skimage.segmentation import watershed
+
+from antilles.block import Block, Field
+from antilles.project import Project
+from antilles.utils.color import deconvolve
+from antilles.utils.io import get_config, init_worker
+
+# region columns copied to every row of its objects
+columns_region = ["relpath", "project", "block", "panel", "level", "sample", "drug"]
+columns_object = ["object", "x", "y", "area", "intensity"]
+
+defaults = {
+    "stains": "hed",  # the first stain is hematoxylin in both
+    "threshold": 0.04,  # hematoxylin optical density
+    "sigma": 1.0,  # microns, of the smoothing before thresholding
+    "min_area": 10.0,  # square microns
+    "min_distance": 3.0,  # microns between the centers of touching nuclei
+    "max_diameter": 20.0,  # microns; tiles overlap by this much
+    "tile_size": 1024,  # pixels
+}
+
+
+def to_pixels(params: Dict[str, Any], mpp: float) -> Dict[str, Any]:
+    return {
+        **params,
+        "sigma": params["sigma"] / mpp,
+        "min_area": params["min_area"] / mpp**2,
+        "min_distance": max(int(round(params["min_distance"] / mpp)), 1),
+        "overlap": int(math.ceil(params["max_diameter"] / mpp)),
+    }
+
+
+def get_tiles(
+    size: Tuple[int, int], tile_size: int, overlap: int
+) -> Iterator[Tuple[Tuple[int, int, int, int], Tuple[int, int, int, int]]]:
+    """
+    (core, window) of each tile of a region, as (x, y, width, height). Cores
+    cover the region without overlapping; windows pad them by `overlap` on
+    every side, within the region.
+    """
+    w, h = size
+    for y in range(0, h, tile_size):
+        for x in range(0, w, tile_size):
+            core = x, y, min(tile_size, w - x), min(tile_size, h - y)
+            x0, y0 = max(x - overlap, 0), max(y - overlap, 0)
+            x1 = min(x + tile_size + overlap, w)
+            y1 = min(y + tile_size + overlap, h)
+            yield core, (x0, y0, x1 - x0, y1 - y0)
+
+
+def detect_nuclei(image: numpy.ndarray, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Nuclei in an RGB image as columns of centroid (x, y), area in pixels and
+    mean hematoxylin density. Touching nuclei are split by a watershed of
+    the distance to the background. `params` are in pixels; see to_pixels.
+    """
+    hematoxylin = deconvolve(image, params["stains"])[:, :, 0]
+    smoothed = gaussian(hematoxylin, sigma=params["sigma"])
+    mask = smoothed > params["threshold"]
+
+    distance = ndimage.distance_transform_edt(mask)
+    markers, _ = ndimage.label(mask)
+    peaks = peak_local_max(
+        distance, min_distance=params["min_distance"], labels=markers
+    )
+    seeds = numpy.zeros(mask.shape, dtype=numpy.int32)
+    seeds[tuple(peaks.T)] = numpy.arange(1, len(peaks) + 1)
+    labels = watershed(-distance, seeds, mask=mask)
+
+    props = regionprops_table(
+        labels,
+        intensity_image=hematoxylin,
+        properties=["centroid", "area", "intensity_mean"],
+    )
+    keep = props["area"] >= params["min_area"]
+    return {
+        "x": props["centroid-1"][keep],
+        "y": props["centroid-0"][keep],
+        "area": props["area"][keep],
+        "intensity": props["intensity_mean"][keep],
+    }
+
+
+# readers of the blocks a worker process has detected in
+_readers: Dict[Tuple[str, str], Any] = {}
+
+
+def get_reader(project: str, block: str):
+    key = project, block
+    if key not in _readers.keys():
+        _readers[key] = Project(project).block(block).open_regions()
+    return _readers[key]
+
+
+def detect_tile(
+    reader,
+    relpath: str,
+    core: Tuple[int, int, int, int],
+    window: Tuple[int, int, int, int],
+    params: Dict[str, Any],
+) -> Dict[str, numpy.ndarray]:
+    """
+    Nuclei of one tile, in region coordinates. Nuclei are kept by the tile
+    whose core holds their centroid, so nuclei in overlaps are only kept once;
+    windows overlap by the largest nucleus, so kept nuclei are never cut off.
+    """
+    x, y, w, h = window
+    image = reader.read(relpath, x, y, w, h)
+    nuclei = detect_nuclei(image, params)
+
+    nuclei["x"] += x
+    nuclei["y"] += y
+    cx, cy, cw, ch = core
+    owned = (
+        (nuclei["x"] >= cx)
+        & (nuclei["x"] < cx + cw)
+        & (nuclei["y"] >= cy)
+        & (nuclei["y"] < cy + ch)
+    )
+    return {key: values[owned] for key, values in nuclei.items()}
+
+
+def detect_region(
+    project: str,
+    block: str,
+    relpath: str,
+    size: Tuple[int, int],
+    params: Dict[str, Any],
+) -> List[Dict[str, numpy.ndarray]]:
+    """
+    Nuclei of each tile of one region. Runs in a worker process, so takes
+    names rather than objects. The tiles of a region are detected by the same
+    worker, so regions extracted as files are decoded once, and the other
+    formats are read a window at a time.
+    """
+    reader = get_reader(project, block)
+    tiles = get_tiles(size, params["tile_size"], params["overlap"])
+    return [
+        detect_tile(reader, relpath, core, window, params) for core, window in tiles
+    ]
+
+
+def to_frame(region: Dict[str, Any], tiles: List[Dict[str, Any]]) -> pandas.DataFrame:
+    nuclei = {
+        key: numpy.concatenate([tile[key] for tile in tiles])
+        for key in ["x", "y", "area", "intensity"]
+    }
+    df = pandas.DataFrame(
+        {
+            "object": numpy.arange(len(nuclei["x"]), dtype=numpy.int32),
+            "x": nuclei["x"].astype(numpy.float32),
+            "y": nuclei["y"].astype(numpy.float32),
+            "area": nuclei["area"].astype(numpy.int32),
+            "intensity": nuclei["intensity"].astype(numpy.float32),
+        }
+    )
+    for i, column in enumerate(columns_region):
+        df.insert(i, column, region[column])
+    return df
+
+
+class Detector:
+    def __init__(
+        self,
+        project: Project,
+        block: Block,
+        params: Dict[str, Any] = None,
+        max_workers: Optional[int] = None,
+    ):
+        """
+        Detects nuclei in each region, a tile at a time, with regions spread
+        over worker processes, and saves their centroids, areas and intensities as Field.OBJECTS,
+        keyed like the regions they are in.
+        """
+        self.log = logging.getLogger(__name__)
+        self.project = project
+        self.block = block
+        self.params = {**defaults, **(params or {})}
+        self.max_workers = max_workers
+
+    def submit(
+        self, pool: ProcessPoolExecutor, region: Dict[str, Any], size: Tuple[int, int]
+    ) -> Future:
+        params = to_pixels(self.params, float(region["mpp"]))
+        return pool.submit(
+            detect_region,
+            self.project.name,
+            self.block.name,
+            region["relpath"],
+            size,
+            params,
+        )
+
+    def detect(self, regions: pandas.DataFrame) -> Iterator[pandas.DataFrame]:
+        reader = self.block.open_regions()
+        regions = regions.to_dict("records")
+
+        with ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=init_worker,
+            initargs=(get_config().to_dict(),),
+        ) as pool:
+            # every region is queued up front, so the pool stays busy while the
+            # nuclei of earlier regions are being written
+            futures = [
+                self.submit(pool, region, reader.size(region["relpath"]))
+                for region in regions
+            ]
+            for i, (region, future) in enumerate(zip(regions, futures)):
+                df = to_frame(region, future.result())
+                self.log.debug(
+                    f"Detected {len(df)} nuclei in region {i + 1}/{len(regions)}"
+                )
+                yield df
+
+        if not regions:
+            yield pandas.DataFrame(columns=columns_region + columns_object)
+
+    def run(self, field: Field = Field.IMAGES_COORDS_BOW) -> None:
+        self.log.info("Detecting nuclei ... ")
+        regions = self.block.get(field)
+        self.block.save_chunks(self.detect(regions), Field.OBJECTS)
+        self.log.info(f"Detecting nuclei in {len(regions)} regions complete.")
@@ -1,18 +1,23 @@
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from functools import reduce
-from os.path import join
-from typing import Tuple, Iterator, List, Dict, Any
+from os.path import join, dirname, normpath, sep, splitext
+from typing import Tuple, Iterator, List, Dict, Any, Optional
 
 import numpy
-import openslide
 import pandas
+from PIL import Image
 from pandas import DataFrame
 
-from antilles.block import Field, Step, Block
+from antilles.block import Field, Step, Block, columns_manifest, get_step_dir
 from antilles.pipeline.annotate import annotate_slides
 from antilles.project import Project
-from antilles.utils.image import get_mpp_from_openslide
+from antilles.utils.color import get_stains, separate
+from antilles.utils.slides import get_slide_info
+from antilles.utils.tiles import read_region, get_tile_cache
+from antilles.utils.tissue import get_slide_thumbnail, tissue_mask, wedge_fractions
 from antilles.utils.io import DAO
 from antilles.utils.math import pol2cart
 
@@ -114,7 +119,9 @@ def microns2pixels(dct: Dict[str, Any], keys: List[str], mpp: float):
     return dct
 
 
-def get_filepath(step: Step, fields: Dict[str, Any], output_order: List[str]) -> str:
+def get_filepath(
+    step: Step, fields: Dict[str, Any], output_order: List[str], make_dir: bool = True
+) -> str:
     for key in ["project", "block", "panel", "level", "sample", "drug"]:
         if key not in fields.keys():
             raise ValueError(f"Key not found: {key}")
@@ -123,7 +130,8 @@ def get_filepath(step: Step, fields: Dict[str, Any], output_order: List[str]) ->
 
     dirpath = join(fields["project"], fields["block"], step.value)
     dirpath = join(dirpath, *(fields[o] for o in output_order))
-    DAO.make_dir(dirpath)
+    if make_dir:
+        DAO.make_dir(dirpath)
 
     filename_order = ["project", "block", "panel", "level", "sample", "drug"]
     filename = "_".join(fields[f] for f in filename_order) + ".tif"
@@ -134,16 +142,15 @@ def get_filepath(step: Step, fields: Dict[str, Any], output_order: List[str]) ->
     return filepath
 
 
-def extract_image(src: str, dst: str, params: Dict[str, Any]) -> Dict[str, Any]:
-    with openslide.OpenSlide(DAO.abs(src)) as obj:
-        dims = obj.dimensions
-        mpp = get_mpp_from_openslide(obj)
-        params = microns2pixels(params, ["radius_inner", "radius_outer"], mpp)
-        origin, size = calc_bbox(dims=dims, **params)
+def locate_region(src: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    info = get_slide_info(src)
+    dims = tuple(info["dims"])
+    mpp = info["mpp"]
+    if mpp is None:
+        raise ValueError(f"MPP not found for {src}!")
 
-        image = obj.read_region(origin, 0, size)
-        image = image.convert("RGB")
-        image.save(DAO.abs(dst))
+    params = microns2pixels(params, ["radius_inner", "radius_outer"], mpp)
+    origin, size = calc_bbox(dims=dims, **params)
 
     cx = params["center"][0] - origin[0]
     cy = params["center"][1] - origin[1]
@@ -152,10 +159,119 @@ def extract_image(src: str, dst: str, params: Dict[str, Any]) -> Dict[str, Any]:
     dx, dy = pol2cart(r_init, params["angle"])
     wx, wy = int(round(cx + dx)), int(round(cy + dy))
 
-    return {"oxy": origin, "cxy": (cx, cy), "wxy": (wx, wy), "dims": size, "mpp": mpp}
+    return {
+        "oxy": origin,
+        "cxy": (cx, cy),
+        "wxy": (wx, wy),
+        "dims": size,
+        "mpp": mpp,
+        "params": params,
+    }
+
+
+def crop_image(
+    src: str, params: Dict[str, Any]
+) -> Tuple[numpy.ndarray, Dict[str, Any]]:
+    props = locate_region(src, params)
+    # wedges of neighbouring wells overlap, so their tiles are decoded once
+    image = read_region(src, props["oxy"], 0, props["dims"])
+    return image, props
+
+
+def extract_image(src: str, dst: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    image, props = crop_image(src, params)
+    Image.fromarray(image).save(DAO.abs(dst))
+    return props
+
+
+def get_stain_filepath(dst: str, stains: str, name: str) -> str:
+    """
+    The path of the tif of one stain of a region, in the same place under
+    '2_regions_{stains}' as the region is under '1_regions'.
+    """
+    parts = normpath(dst).split(sep)
+    parts[parts.index(Step.S1.value)] = get_step_dir(Step.S2, mode=stains)
+    stem, ext = splitext(parts[-1])
+    parts[-1] = f"{stem}_{name}{ext}"
+    return join(*parts)
+
+
+def save_stains(od: numpy.ndarray, dst: str, stains: str) -> None:
+    _, names = get_stains(stains)
+    for k, name in enumerate(names):
+        filepath = get_stain_filepath(dst, stains, name)
+        DAO.make_dir(dirname(filepath))
+
+        channel = od[:, :, k]
+        if channel.dtype == numpy.float16:
+            # tif readers rarely support half floats
+            channel = channel.astype(numpy.float32)
+        Image.fromarray(channel).save(DAO.abs(filepath))
+
+
+def get_manifest_row(src: str, dst: str, props: Dict[str, Any]) -> Dict[str, Any]:
+    params = props["params"]
+    return {
+        "relpath": dst,
+        "src": src,
+        "level": 0,
+        "origin_x": props["oxy"][0],
+        "origin_y": props["oxy"][1],
+        "width": props["dims"][0],
+        "height": props["dims"][1],
+        "center_x": props["cxy"][0],
+        "center_y": props["cxy"][1],
+        "angle": params["angle"],
+        "span": params.get("span", 90.0),
+        "radius_inner": params.get("radius_inner", 400),
+        "radius_outer": params.get("radius_outer", 800),
+        "mpp": props["mpp"],
+    }
+
+
+def get_tissue_fractions(
+    sequence: List[Dict[str, Any]], params: Dict[str, Any], max_size: int = 1024
+) -> List[float]:
+    """
+    The fraction of the wedge of each region in an extraction sequence that is
+    tissue, from the thumbnail of its slide. The wedges of all wells of a
+    sample are measured at once.
+    """
+    fractions = [0.0] * len(sequence)
+    groups: Dict[Tuple[str, Tuple[int, int]], List[int]] = {}
+    for i, region in enumerate(sequence):
+        key = region["src"], region["params"]["center"]
+        groups.setdefault(key, []).append(i)
+
+    for (src, center), indices in groups.items():
+        mpp = get_slide_info(src)["mpp"]
+        if mpp is None:
+            raise ValueError(f"MPP not found for {src}!")
+
+        thumbnail, factor = get_slide_thumbnail(src, max_size)
+        angles = [sequence[i]["params"]["angle"] for i in indices]
+        values = wedge_fractions(
+            tissue_mask(thumbnail),
+            factor,
+            center,
+            angles,
+            span=params.get("span", 90.0),
+            radius_inner=params.get("radius_inner", 400) / mpp,
+            radius_outer=params.get("radius_outer", 800) / mpp,
+        )
+        for i, value in zip(indices, values):
+            fractions[i] = float(value)
+
+    return fractions
 
 
 def update_translate(df: DataFrame, using: DataFrame):
+    """
+    Bows of previously extracted regions, moved into the frame of the regions
+    extracted again, which may have new origins. Metadata set since, e.g. by
+    adjustment, is kept, but what the new extraction found, such as
+    tissue_fraction and include, takes precedence.
+    """
     buffer = 5
 
     cols = ["project", "block", "panel", "level", "sample", "drug"]
@@ -182,7 +298,11 @@ def update_translate(df: DataFrame, using: DataFrame):
             df.loc[i, ["center_y"]] = cxy_new[1]
             df.loc[i, ["well_x"]] = wxy_new[0]
             df.loc[i, ["well_y"]] = wxy_new[1]
-            df.loc[i, ["metadata"]] = using_row["metadata"].values[0]
+            metadata = {
+                **json.loads(using_row["metadata"].values[0]),
+                **json.loads(row["metadata"]),
+            }
+            df.loc[i, ["metadata"]] = json.dumps(metadata)
 
     return df
 
@@ -199,21 +319,39 @@ class Extractor:
 
         annotate_slides(coords, angles)
 
-        self.block.save(coords, Field.IMAGES_COORDS)
-        self.block.save(angles, Field.ANGLES_COARSE)
+        # keep rows saved by other sessions while this one was open
+        self.block.save(coords, Field.IMAGES_COORDS, merge=True)
+        self.block.save(angles, Field.ANGLES_COARSE, merge=True)
 
     def extract(self, params: Dict[str, Any]) -> None:
         self.log.info("Extracting wedges ... ")
         self.block.clean()
 
         regions_prev = self.block.get(Field.IMAGES_COORDS_BOW)
-        regions = self.extract_wedges(params["wedge"])
+        regions = self.extract_wedges(params["wedge"], params.get("tissue"))
         regions = update_translate(regions, using=regions_prev)
 
         self.block.save(regions, Field.IMAGES_COORDS_BOW)
+        self.log.info(f"Tile cache: {get_tile_cache().stats()}")
         self.log.info("Extracting wedges complete.")
 
-    def extract_wedges(self, params: Dict[str, Any]) -> DataFrame:
+    def export(self) -> None:
+        self.log.info("Exporting regions to tif ... ")
+        if self.block.region_format == "virtual":
+            self.block.region_reader.export()
+        else:
+            self.block.region_store.export()
+        self.log.info("Exporting regions complete.")
+
+    def extract_wedges(
+        self, params: Dict[str, Any], tissue: Optional[Dict[str, Any]] = None
+    ) -> DataFrame:
+        """
+        Extracts a wedge for each well of each sample. With `tissue`, e.g.
+        {"min_fraction": 0.25, "skip": False}, wells whose wedges are mostly
+        off the tissue, as seen in slide thumbnails, are flagged with
+        include=False in their metadata, or not extracted at all with skip.
+        """
         output_order = self.project.config["output_order"]
 
         settings = {
@@ -223,31 +361,98 @@ class Extractor:
             "angles": self.block.get(Field.ANGLES_COARSE),
         }
 
-        regions = []
-        regions_to_extract = get_extraction_sequence(settings)
-        for region in regions_to_extract:
-            src = region["src"]
-            dst = get_filepath(Step.S1, region["fields"], output_order)
-            props = extract_image(src, dst, {**params, **region["params"]})
-
-            regions.append(
-                {
-                    **region["fields"],
-                    **{
-                        "relpath": dst,
-                        "origin_x": props["oxy"][0],
-                        "origin_y": props["oxy"][1],
-                        "center_x": props["cxy"][0],
-                        "center_y": props["cxy"][1],
-                        "well_x": props["wxy"][0],
-                        "well_y": props["wxy"][1],
-                        "mpp": props["mpp"],
-                        "width": props["dims"][0],
-                        "height": props["dims"][1],
-                        "metadata": json.dumps({}),
-                    },
-                }
-            )
+        region_format = self.block.region_format
+        manifest = []
+
+        # stain densities are computed while each region is still in memory,
+        # rather than read back from disk later
+        stain_output = self.block.stain_output
+        if stain_output is not None and region_format == "virtual":
+            raise ValueError("Stain output needs the tif or store region format!")
+
+        with ExitStack() as stack:
+            if region_format == "store":
+                writer = stack.enter_context(self.block.region_store.writer())
+                if stain_output is not None:
+                    stain_writer = stack.enter_context(self.block.stain_store.writer())
+            if stain_output is not None:
+                pool = stack.enter_context(
+                    ThreadPoolExecutor(max_workers=stain_output["max_workers"])
+                )
+
+            sequence = list(get_extraction_sequence(settings))
+            if tissue is not None:
+                fractions = get_tissue_fractions(
+                    sequence, params, tissue.get("max_size", 1024)
+                )
+                min_fraction = tissue.get("min_fraction", 0.25)
+
+            regions = []
+            n_off_tissue = 0
+            for i, region in enumerate(sequence):
+                metadata = {}
+                if tissue is not None:
+                    metadata["tissue_fraction"] = round(fractions[i], 3)
+                    if fractions[i] < min_fraction:
+                        n_off_tissue += 1
+                        if tissue.get("skip", False):
+                            continue
+                        metadata["include"] = False
+
+                src = region["src"]
+                dst = get_filepath(
+                    Step.S1,
+                    region["fields"],
+                    output_order,
+                    make_dir=region_format == "tif",
+                )
+                region_params = {**params, **region["params"]}
+
+                if region_format in ("tif", "store"):
+                    image, props = crop_image(src, region_params)
+                    if region_format == "tif":
+                        Image.fromarray(image).save(DAO.abs(dst))
+                    else:
+                        writer.add(dst, image)
+
+                    if stain_output is not None:
+                        od = separate(
+                            image,
+                            stains=stain_output["stains"],
+                            dtype=stain_output["dtype"],
+                            od_max=stain_output["od_max"],
+                            chunk_rows=stain_output["chunk_rows"],
+                            pool=pool,
+                        )
+                        if region_format == "tif":
+                            save_stains(od, dst, stain_output["stains"])
+                        else:
+                            stain_writer.add(dst, od)
+                elif region_format == "virtual":
+                    # pixels are read from the slide when needed; see RegionReader
+                    props = locate_region(src, region_params)
+                    manifest.append(get_manifest_row(src, dst, props))
+                else:
+                    raise ValueError(f"Unknown region format {region_format}!")
+
+                regions.append(
+                    {
+                        **region["fields"],
+                        **{
+                            "relpath": dst,
+                            "origin_x": props["oxy"][0],
+                            "origin_y": props["oxy"][1],
+                            "center_x": props["cxy"][0],
+                            "center_y": props["cxy"][1],
+                            "well_x": props["wxy"][0],
+                            "well_y": props["wxy"][1],
+                            "mpp": props["mpp"],
+                            "width": props["dims"][0],
+                            "height": props["dims"][1],
+                            "metadata": json.dumps(metadata),
+                        },
+                    }
+                )
 
         columns = [
             "relpath",
@@ -268,4 +473,12 @@ class Extractor:
             "metadata",
         ]
         regions = pandas.DataFrame(regions, columns=columns)
+        if tissue is not None:
+            action = "Skipped" if tissue.get("skip", False) else "Excluded"
+            self.log.info(f"{action} {n_off_tissue} wells off the tissue.")
+
+        if region_format == "virtual":
+            manifest = pandas.DataFrame(manifest, columns=columns_manifest)
+            self.block.save(manifest, Field.REGIONS_MANIFEST)
+
         return regions
@@ -0,0 +1,209 @@
+import json
+import logging
+import math
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional
+
+import numpy
+from scipy import ndimage
+
+from antilles.block import Block, Field
+from antilles.pipeline.detect import get_reader
+from antilles.project import Project
+from antilles.utils.io import get_config, init_worker
+from antilles.utils.math import cart2pol, pol2cart
+from antilles.utils.tissue import tissue_mask
+
+defaults = {
+    "resolution": 4.0,  # microns per pixel of the downsampled regions
+    "device_radius": 400.0,  # microns, as assumed by extraction
+    "max_shift": 300.0,  # microns between the found and initial device centers
+    "well_search": 30.0,  # degrees either side of the initial well direction
+    "well_depth": 100.0,  # microns a well reaches beyond the device
+    "min_saturation": 0.05,
+    "min_size": 64,  # downsampled pixels, of the smallest piece of tissue
+    "min_confidence": 0.5,  # of fits that replace the initial bow
+}
+
+
+def downsample(image: numpy.ndarray, step: int) -> numpy.ndarray:
+    # mean of each step x step block, dropping partial blocks at the edges
+    h, w = image.shape[0] // step, image.shape[1] // step
+    blocks = image[: h * step, : w * step].reshape(h, step, w, step, -1)
+    return blocks.mean(axis=(1, 3)).astype(numpy.uint8)
+
+
+def fit_bow(
+    image: numpy.ndarray, region: Dict[str, Any], params: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    The bow of a region from its pixels. The device leaves a round hole of
+    glass in the tissue, and its well a notch in the rim of that hole. The
+    center is that of the largest disk of glass near the initial center, and
+    the well is the tip of the notch near the initial well direction.
+
+    The confidence is the weakest of three scores in [0, 1]: how close the
+    radius of the hole is to the device radius, how much of a ring around
+    the hole is tissue, and how deep the notch is compared to `well_depth`.
+    Coordinates are in region pixels, as in `region`.
+    """
+    mpp = float(region["mpp"])
+    step = max(int(round(params["resolution"] / mpp)), 1)
+    scale = mpp * step  # microns per downsampled pixel
+    fit = {
+        "center_x": int(region["center_x"]),
+        "center_y": int(region["center_y"]),
+        "well_x": int(region["well_x"]),
+        "well_y": int(region["well_y"]),
+        "confidence": 0.0,
+    }
+
+    small = downsample(image, step)
+    if min(small.shape[:2]) < 2:
+        return fit
+    glass = ~tissue_mask(
+        small, params["min_saturation"], params["min_size"], fill_holes=False
+    )
+
+    # the initial bow, in downsampled pixels
+    ex = (float(region["center_x"]) - (step - 1) / 2) / step
+    ey = (float(region["center_y"]) - (step - 1) / 2) / step
+    _, well_angle = cart2pol(
+        float(region["well_x"]) - float(region["center_x"]),
+        float(region["well_y"]) - float(region["center_y"]),
+    )
+    r_device = params["device_radius"] / scale
+    max_shift = params["max_shift"] / scale
+
+    # the hole is searched for within reach of the initial center only, so that
+    # glass off the edge of the section is not taken for it
+    yy, xx = numpy.mgrid[: small.shape[0], : small.shape[1]]
+    near = numpy.hypot(xx - ex, yy - ey)
+    hole = glass & (near <= max_shift + 2 * r_device)
+    distance = ndimage.distance_transform_edt(hole)
+    distance[near > max_shift] = 0
+    if distance.max() == 0:
+        return fit
+
+    cy, cx = numpy.unravel_index(numpy.argmax(distance), distance.shape)
+    radius = float(distance[cy, cx])
+    labels, _ = ndimage.label(hole)
+    hole = labels == labels[cy, cx]
+
+    rho = numpy.hypot(xx - cx, yy - cy)
+    theta = numpy.degrees(numpy.arctan2(yy - cy, xx - cx))
+    window = numpy.abs((theta - well_angle + 180) % 360 - 180) <= params["well_search"]
+
+    # the notch is whatever of the hole reaches past its disk, near the well,
+    # short of where it may open onto glass beyond the tissue
+    reach = radius + 2 * params["well_depth"] / scale
+    notch = hole & window & (rho > radius + 1) & (rho <= reach)
+    if notch.any():
+        weights = rho[notch] - radius
+        angles = numpy.radians(theta[notch])
+        angle = math.degrees(
+            math.atan2(
+                (weights * numpy.sin(angles)).sum(), (weights * numpy.cos(angles)).sum()
+            )
+        )
+        r_well = float(rho[notch].max())
+    else:
+        angle, r_well = well_angle, radius
+
+    ring = (rho >= 1.2 * radius) & (rho <= 1.6 * radius) & ~window
+    scores = [
+        1 - min(abs(radius / r_device - 1), 1),
+        float((~glass[ring]).mean()) if ring.any() else 0.0,
+        min((r_well - radius) * scale / params["well_depth"], 1.0),
+    ]
+
+    # back to region pixels, from the centers of the downsampled blocks
+    cx, cy = cx * step + (step - 1) / 2, cy * step + (step - 1) / 2
+    dx, dy = pol2cart(r_well * step, angle)
+    return {
+        "center_x": int(round(cx)),
+        "center_y": int(round(cy)),
+        "well_x": int(round(cx + dx)),
+        "well_y": int(round(cy + dy)),
+        "confidence": round(float(min(scores)), 3),
+    }
+
+
+def fit_region(
+    project: str, block: str, region: Dict[str, Any], params: Dict[str, Any]
+) -> Dict[str, Any]:
+    # runs in a worker process, so takes names rather than objects
+    image = get_reader(project, block).read(region["relpath"])
+    return fit_bow(image, region, params)
+
+
+class BowFitter:
+    def __init__(
+        self,
+        project: Project,
+        block: Block,
+        params: Dict[str, Any] = None,
+        max_workers: Optional[int] = None,
+    ):
+        """
+        Fits the bow of each extracted region from its pixels, in worker
+        processes, before the regions are adjusted by hand. Fits at least
+        `min_confidence` replace the initial bows; every fit records its
+        confidence as bow_confidence in the metadata of its region, so that
+        only uncertain regions need to be reviewed; see Adjuster.run.
+        """
+        self.log = logging.getLogger(__name__)
+        self.project = project
+        self.block = block
+        self.params = {**defaults, **(params or {})}
+        self.max_workers = max_workers
+
+    def fit(self, regions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        keys = ["relpath", "center_x", "center_y", "well_x", "well_y", "mpp"]
+        with ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=init_worker,
+            initargs=(get_config().to_dict(),),
+        ) as pool:
+            futures = [
+                pool.submit(
+                    fit_region,
+                    self.project.name,
+                    self.block.name,
+                    {key: region[key] for key in keys},
+                    self.params,
+                )
+                for region in regions
+            ]
+            return [future.result() for future in futures]
+
+    def run(
+        self, field: Field = Field.IMAGES_COORDS_BOW, overwrite: bool = False
+    ) -> None:
+        """
+        Regions already fit are left alone, as they may have been adjusted
+        since, unless `overwrite`.
+        """
+        self.log.info("Fitting bows ... ")
+        regions = self.block.get(field)
+        metadata = regions["metadata"].map(json.loads)
+
+        todo = regions.index
+        if not overwrite:
+            todo = regions.index[~metadata.map(lambda m: "bow_confidence" in m)]
+        fits = self.fit(regions.loc[todo].to_dict("records"))
+
+        n_confident = 0
+        for i, fit in zip(todo, fits):
+            confidence = fit.pop("confidence")
+            metadata[i]["bow_confidence"] = confidence
+            if confidence >= self.params["min_confidence"]:
+                n_confident += 1
+                regions.loc[i, list(fit.keys())] = list(fit.values())
+        regions["metadata"] = metadata.map(json.dumps)
+
+        self.block.save(regions, field, merge=True)
+        self.log.info(
+            f"Fitting {len(fits)} bows complete "
+            f"({n_confident} at least {self.params['min_confidence']} confident)."
+        )
@@ -1,63 +1,260 @@
 import json
 import logging
-import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from os.path import join
+from typing import List, Dict, Any, Iterator, Iterable, Optional
 
 import pandas
 
 from antilles.block import Block, Field
 from antilles.project import Project
+from antilles.utils.io import DAO, get_config, init_worker
+
+# columns of the CellProfiler input files, and the annotations they come from
+columns_cellprofiler = {
+    "relpath": "Filename",
+    "project": "Project",
+    "block": "Block",
+    "panel": "Panel",
+    "level": "Level",
+    "sample": "Sample",
+    "cohorts": "Cohorts",
+    "drug": "Drug",
+    "center_x": "Bow_Center_X",
+    "center_y": "Bow_Center_Y",
+    "well_x": "Bow_Well_X",
+    "well_y": "Bow_Well_Y",
+    "mpp": "MPP",
+}
+
+# metadata keys that every region has, and their values if not yet annotated
+metadata_defaults = {"include": False}
+
+
+def metadata_column(key: str) -> str:
+    # include -> Include, stain_quality -> Stain_Quality
+    return "_".join(part.capitalize() for part in key.split("_"))
+
+
+def parse_metadata(values: pandas.Series) -> List[Dict[str, Any]]:
+    # one call into the json parser per chunk, rather than one per row
+    return json.loads("[" + ",".join(values.fillna("{}")) + "]")
+
+
+# pandas.api.types.infer_dtype results, by the kinds of values they contain
+kinds_inferred = {
+    "boolean": {"bool"},
+    "integer": {"int"},
+    "floating": {"float"},
+    "mixed-integer-float": {"int", "float"},
+    "empty": set(),
+}
+
+
+def metadata_dtype(kinds: set) -> str:
+    if kinds == {"bool"}:
+        return "boolean"
+    elif kinds == {"int"}:
+        return "Int64"
+    elif kinds and kinds <= {"int", "float"}:
+        return "Float64"
+    else:
+        # nullable, as astype("str") would write missing values as "nan"
+        return "string"
+
+
+def scan_metadata(chunks: Iterable[pandas.DataFrame]) -> Dict[str, str]:
+    """
+    The dtype of every metadata key found in the annotations, so that the
+    columns of the CellProfiler input are known before any rows are written.
+    """
+    kinds: Dict[str, set] = {
+        key: kinds_inferred[pandas.api.types.infer_dtype([value])]
+        for key, value in metadata_defaults.items()
+    }
+    for df in chunks:
+        records = pandas.DataFrame.from_records(parse_metadata(df["metadata"]))
+        for key in records.columns:
+            inferred = pandas.api.types.infer_dtype(records[key], skipna=True)
+            kinds.setdefault(key, set()).update(kinds_inferred.get(inferred, {"str"}))
+
+    return {key: metadata_dtype(k) for key, k in kinds.items()}
+
+
+def decode_metadata(values: pandas.Series, dtypes: Dict[str, str]) -> pandas.DataFrame:
+    """
+    Metadata json objects as typed columns, one per key in `dtypes`. Missing
+    keys take their defaults, if any, and are NA otherwise.
+    """
+    records = parse_metadata(values)
+    df = pandas.DataFrame.from_records(records, columns=list(dtypes.keys()))
+    df.index = values.index
+
+    for key, dtype in dtypes.items():
+        column = df[key]
+        if dtype == "string":
+            # nested values are kept as json
+            column = column.map(
+                lambda v: json.dumps(v) if isinstance(v, (dict, list)) else v
+            )
+        if key in metadata_defaults.keys():
+            column = column.where(column.notna(), metadata_defaults[key])
+        df[key] = column.astype(dtype)
+
+    return df.rename(columns=metadata_column)
+
+
+def format_chunk(df: pandas.DataFrame, dtypes: Dict[str, str]) -> pandas.DataFrame:
+    metadata = decode_metadata(df["metadata"], dtypes)
+
+    df = df[list(columns_cellprofiler.keys())].rename(columns=columns_cellprofiler)
+    # CellProfiler matches images by file name only
+    df["Filename"] = df["Filename"].str.replace(r"^.*[\\/]", "", regex=True)
+
+    return pandas.concat([df, metadata], axis=1)
+
+
+# annotations from which each CellProfiler input file is made
+sources = {
+    Field.CELLPROFILER_IMAGE_INPUT: Field.IMAGES_COORDS_BOW,
+    Field.CELLPROFILER_REGION_INPUT: Field.REGIONS_COORDS_BOW,
+}
 
 
 class Formatter:
-    def __init__(self, project: Project, block: Block):
+    chunksize = 100_000
+
+    def __init__(self, project: Project, block: Block, chunksize: int = None):
+        """
+        Writes the CellProfiler input files of a block from its bow annotations.
+        Annotations are read and written a chunk of rows at a time, with every
+        metadata key unpacked into a column of its own.
+        """
         self.log = logging.getLogger(__name__)
         self.project = project
         self.block = block
+        self.chunksize = chunksize or self.chunksize
+
+    def read_chunks(
+        self, field: Field, columns: List[str] = None
+    ) -> Iterator[pandas.DataFrame]:
+        if field == Field.REGIONS_COORDS_BOW:
+            # regions without annotations yet are formatted with their defaults
+            df = self.block.get(field)
+            if columns is not None:
+                df = df[columns]
+            for start in range(0, len(df), self.chunksize):
+                yield df.iloc[start : start + self.chunksize]
+        else:
+            yield from self.block.read_chunks(field, self.chunksize, columns=columns)
+
+    def format(self, field: Field) -> Iterator[pandas.DataFrame]:
+        # metadata keys are collected first, so that all chunks have the same
+        # columns; this only reads the metadata column
+        dtypes = scan_metadata(self.read_chunks(field, columns=["metadata"]))
+
+        empty = True
+        for df in self.read_chunks(field):
+            empty = False
+            yield format_chunk(df, dtypes)
+
+        if empty:
+            columns = list(columns_cellprofiler.keys()) + ["metadata"]
+            yield format_chunk(pandas.DataFrame(columns=columns), dtypes)
+
+    def run(self, field: Field = Field.CELLPROFILER_IMAGE_INPUT) -> str:
+        self.block.save_chunks(self.format(sources[field]), field)
+        return self.block.store(field).path(field.value)
 
-    def run(self) -> None:
-        regions: pandas.DataFrame = self.block.get(Field.IMAGES_COORDS_BOW)
-
-        metadata = regions["metadata"]
-
-        regions = regions[
-            [
-                "relpath",
-                "project",
-                "block",
-                "panel",
-                "level",
-                "sample",
-                "cohorts",
-                "drug",
-                "center_x",
-                "center_y",
-                "well_x",
-                "well_y",
-                "mpp",
+
+def format_block(project: str, block: str, field: str, chunksize: int) -> str:
+    # runs in a worker process, so takes and returns names rather than objects
+    project = Project(project)
+    formatter = Formatter(project, project.block(block), chunksize=chunksize)
+    return formatter.run(Field(field))
+
+
+class ProjectFormatter:
+    chunksize = Formatter.chunksize
+
+    def __init__(
+        self, project: Project, max_workers: int = None, chunksize: int = None
+    ):
+        """
+        Formats every block of a project in worker processes, then merges their
+        CellProfiler input files into one for the project, without duplicate
+        images, and splits it by panel for filtering in CellProfiler.
+        """
+        self.log = logging.getLogger(__name__)
+        self.project = project
+        self.max_workers = max_workers
+        self.chunksize = chunksize or self.chunksize
+
+    def path(self, field: Field, panel: str = None) -> str:
+        name = field.value if panel is None else f"{field.value}_{panel}"
+        return join(self.project.relpath, name + ".csv")
+
+    def format_blocks(self, field: Field) -> List[str]:
+        names = [block.name for block in self.project.blocks]
+        with ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=init_worker,
+            initargs=(get_config().to_dict(),),
+        ) as pool:
+            futures = [
+                pool.submit(
+                    format_block, self.project.name, name, field.value, self.chunksize
+                )
+                for name in names
             ]
-        ]
-        regions.insert(loc=len(regions.columns), column="Include", value=False)
-
-        regions.rename(
-            columns={
-                "relpath": "Filename",
-                "project": "Project",
-                "block": "Block",
-                "panel": "Panel",
-                "level": "Level",
-                "sample": "Sample",
-                "cohorts": "Cohorts",
-                "drug": "Drug",
-                "center_x": "Bow_Center_X",
-                "center_y": "Bow_Center_Y",
-                "well_x": "Bow_Well_X",
-                "well_y": "Bow_Well_Y",
-                "mpp": "MPP",
-                "metadata": "Metadata",
-            },
-            inplace=True,
-        )
-        regions["Filename"] = regions["Filename"].apply(lambda s: os.path.basename(s))
-        regions["Include"] = metadata.apply(lambda s: json.loads(s)["include"])
-
-        self.block.save(regions, Field.CELLPROFILER_IMAGE_INPUT)
+            # blocks are merged in project order, whichever finishes first
+            return [future.result() for future in futures]
+
+    def merge(self, field: Field, paths: List[str]) -> None:
+        # blocks may have different metadata keys; the merged file has them all
+        columns: List[str] = []
+        for path in paths:
+            for column in DAO.read_csv_header(path):
+                if column not in columns:
+                    columns.append(column)
+
+        seen = set()
+        n_rows, n_duplicates = 0, 0
+
+        with ExitStack() as stack:
+            files: Dict[Optional[str], Any] = {}
+
+            def write(df: pandas.DataFrame, panel: str = None):
+                if panel not in files.keys():
+                    tmppath = stack.enter_context(DAO.atomic(self.path(field, panel)))
+                    files[panel] = stack.enter_context(open(tmppath, "w", newline=""))
+                    df.iloc[:0].to_csv(files[panel], index=False)
+                df.to_csv(files[panel], header=False, index=False)
+
+            write(pandas.DataFrame(columns=columns))
+            for path in paths:
+                for df in DAO.read_csv_chunks(path, self.chunksize):
+                    df = df.reindex(columns=columns)
+
+                    # CellProfiler matches images by file name, so each may
+                    # only appear once
+                    duplicated = df["Filename"].duplicated() | df["Filename"].isin(seen)
+                    n_duplicates += int(duplicated.sum())
+                    df = df[~duplicated]
+                    seen.update(df["Filename"])
+                    n_rows += len(df)
+
+                    write(df)
+                    for panel, group in df.groupby("Panel", sort=False):
+                        write(group, str(panel))
+
+        if n_duplicates:
+            self.log.warning(f"Dropped {n_duplicates} duplicate images.")
+        self.log.info(f"Merged {n_rows} images into {self.path(field)}")
+
+    def run(self, field: Field = Field.CELLPROFILER_IMAGE_INPUT) -> None:
+        self.log.info(f"Formatting {field.value} for project {self.project.name} ... ")
+        paths = self.format_blocks(field)
+        self.merge(field, paths)
+        self.log.info(f"Formatting {field.value} complete.")
@@ -0,0 +1,228 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join
+from typing import List, Dict, Any, Tuple, Sequence, Optional
+
+import numpy
+import pandas
+
+from antilles.block import Block, Field
+from antilles.pipeline.profile import get_bow, get_tiles, columns_region
+from antilles.project import Project
+from antilles.utils.arrays import RegionStore
+from antilles.utils.color import deconvolve, get_stains
+from antilles.utils.io import DAO
+from antilles.utils.math import polar_grid
+
+defaults = {
+    "bin_width": 5.0,  # microns
+    "max_distance": 1000.0,  # microns from the well
+    "angle_bins": 72,  # over the whole circle around the device
+    "channel": "intensity",  # or a stain, e.g. hematoxylin
+    "stains": "hed",
+    "value_bins": 16,
+    "od_max": 2.0,  # stain densities binned from 0 to this
+    "tile_size": 1024,  # pixels
+}
+
+
+def get_values(image: numpy.ndarray, params: Dict[str, Any]) -> numpy.ndarray:
+    # the channel being binned, scaled to [0, 1)
+    if params["channel"] == "intensity":
+        return image.mean(axis=-1, dtype=numpy.float32) / 256
+
+    _, names = get_stains(params["stains"])
+    od = deconvolve(image, params["stains"])[..., names.index(params["channel"])]
+    return od / params["od_max"]
+
+
+def histogram_tile(
+    image: numpy.ndarray,
+    origin: Tuple[int, int],
+    bow: Dict[str, Any],
+    params: Dict[str, Any],
+) -> numpy.ndarray:
+    """
+    Pixel counts of one tile of a region, binned by distance from the well,
+    angle from the bow and value, as an array of shape (distances, angles,
+    values).
+    """
+    h, w = image.shape[:2]
+    n_d, n_a, n_v = bow["n_distances"], bow["n_angles"], params["value_bins"]
+
+    rho, theta = polar_grid(origin, (w, h), bow["center"], bow["angle"])
+    distance = (rho - bow["r_well"]) / bow["bin_width"]
+    inside = (distance >= 0) & (distance < n_d)
+
+    di = distance[inside].astype(numpy.int64)
+    ai = ((theta[inside] + 180) / 360 * n_a).astype(numpy.int64)
+    ai = numpy.minimum(ai, n_a - 1)
+    vi = (get_values(image[inside], params) * n_v).astype(numpy.int64)
+    vi = numpy.clip(vi, 0, n_v - 1)
+
+    counts = numpy.bincount((di * n_a + ai) * n_v + vi, minlength=n_d * n_a * n_v)
+    return counts.reshape(n_d, n_a, n_v)
+
+
+def cumulate(counts: numpy.ndarray) -> numpy.ndarray:
+    """
+    Sums of the counts up to each bin along every axis, padded with a leading
+    zero on each, so that the counts of any block of bins take 8 lookups.
+    """
+    out = numpy.zeros(tuple(n + 1 for n in counts.shape), dtype=numpy.int64)
+    out[1:, 1:, 1:] = counts.cumsum(axis=0).cumsum(axis=1).cumsum(axis=2)
+    return out
+
+
+class RadialHistogram:
+    """
+    The histogram of one region, from its counts; see Histogrammer. Bands and
+    sectors are snapped to the nearest edges of its bins.
+    """
+
+    def __init__(self, counts: numpy.ndarray, params: Dict[str, Any]):
+        self.cumulative = cumulate(counts.astype(numpy.int64))
+        self.params = params
+
+    def indices(self, edges: Sequence[float], width: float, n: int) -> numpy.ndarray:
+        indices = numpy.rint(numpy.asarray(edges, dtype=numpy.float64) / width)
+        return numpy.clip(indices, 0, n).astype(numpy.int64)
+
+    def counts(
+        self, edges: Sequence[float], sectors: Sequence[float] = (-180.0, 180.0)
+    ) -> numpy.ndarray:
+        """
+        Pixel counts in each band between consecutive `edges`, in microns from
+        the well, and each sector between consecutive `sectors`, in degrees
+        from the bow, by value, as an array of shape (bands, sectors, values).
+        """
+        n_d, n_a, _ = (n - 1 for n in self.cumulative.shape)
+        di = self.indices(edges, self.params["bin_width"], n_d)
+        ai = self.indices(numpy.asarray(sectors) + 180, 360 / n_a, n_a)
+
+        c = self.cumulative[numpy.ix_(di, ai)]
+        boxes = c[1:, 1:] - c[:-1, 1:] - c[1:, :-1] + c[:-1, :-1]
+        return numpy.diff(boxes, axis=2)
+
+    def profile(
+        self, edges: Sequence[float], sectors: Sequence[float] = (-180.0, 180.0)
+    ) -> pandas.DataFrame:
+        """
+        Pixel count and mean value in each band and sector, with values at the
+        centers of their bins, in the units of the channel.
+        """
+        counts = self.counts(edges, sectors)
+        n_v = counts.shape[2]
+        if self.params["channel"] == "intensity":
+            scale = 256.0
+        else:
+            scale = self.params["od_max"]
+        centers = (numpy.arange(n_v) + 0.5) / n_v * scale
+
+        n_pixels = counts.sum(axis=2)
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            means = (counts * centers).sum(axis=2) / n_pixels
+
+        b, s = numpy.unravel_index(numpy.arange(n_pixels.size), n_pixels.shape)
+        edges, sectors = numpy.asarray(edges), numpy.asarray(sectors)
+        return pandas.DataFrame(
+            {
+                "distance_min": edges[b],
+                "distance_max": edges[b + 1],
+                "angle_min": sectors[s],
+                "angle_max": sectors[s + 1],
+                "n_pixels": n_pixels.ravel(),
+                self.params["channel"]: means.ravel(),
+            }
+        )
+
+
+class Histogrammer:
+    filename = "params.json"
+
+    def __init__(
+        self,
+        project: Project,
+        block: Block,
+        params: Dict[str, Any] = None,
+        max_workers: Optional[int] = None,
+    ):
+        """
+        Counts the pixels of each region in fine bins of distance from the well,
+        angle from the bow and value, once, and stores the counts in the
+        histogram store of the block. Profiles of any coarser bands and sectors
+        are then sums of a few of their cumulative sums, without reading pixels.
+        """
+        self.log = logging.getLogger(__name__)
+        self.project = project
+        self.block = block
+        self.params = {**defaults, **(params or {})}
+        self.max_workers = max_workers
+
+    @property
+    def store(self) -> RegionStore:
+        return self.block.histogram_store
+
+    def histogram_region(
+        self, region: Dict[str, Any], reader, pool: ThreadPoolExecutor
+    ) -> numpy.ndarray:
+        bow = get_bow(region, {**self.params, "span": 360.0})
+        size = reader.size(region["relpath"])
+
+        def work(tile) -> numpy.ndarray:
+            (x, y), (w, h) = tile
+            image = reader.read(region["relpath"], x, y, w, h)
+            return histogram_tile(image, (x, y), bow, self.params)
+
+        counts = numpy.zeros(
+            (bow["n_distances"], bow["n_angles"], self.params["value_bins"]),
+            dtype=numpy.int64,
+        )
+        for c in pool.map(work, get_tiles(size, bow, self.params["tile_size"])):
+            counts += c
+        # raw counts, which compress much better than their cumulative sums
+        return counts.astype(numpy.uint32)
+
+    def run(self, field: Field = Field.IMAGES_COORDS_BOW) -> None:
+        self.log.info("Histogramming regions ... ")
+        regions = self.block.get(field).to_dict("records")
+        reader = self.block.open_regions()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            with self.store.writer() as writer:
+                for i, region in enumerate(regions):
+                    self.log.debug(f"Histogramming region {i + 1}/{len(regions)}")
+                    writer.add(
+                        region["relpath"], self.histogram_region(region, reader, pool)
+                    )
+        DAO.to_json(self.params, join(self.store.dirpath, self.filename))
+
+        self.log.info(f"Histogramming {len(regions)} regions complete.")
+
+    def read(self, relpath: str) -> RadialHistogram:
+        params = DAO.read_json(join(self.store.dirpath, self.filename))
+        return RadialHistogram(self.store.read(relpath), params)
+
+    def profile(
+        self,
+        edges: Sequence[float],
+        sectors: Sequence[float] = (-180.0, 180.0),
+        field: Field = Field.IMAGES_COORDS_BOW,
+    ) -> pandas.DataFrame:
+        """
+        Profiles of every region of the block from their stored histograms.
+        """
+        params = DAO.read_json(join(self.store.dirpath, self.filename))
+        profiles: List[pandas.DataFrame] = []
+        for region in self.block.get(field).to_dict("records"):
+            if region["relpath"] not in self.store:
+                continue
+            histogram = RadialHistogram(self.store.read(region["relpath"]), params)
+            df = histogram.profile(edges, sectors)
+            for i, column in enumerate(columns_region):
+                df.insert(i, column, region[column])
+            profiles.append(df)
+
+        if not profiles:
+            return pandas.DataFrame(columns=columns_region)
+        return pandas.concat(profiles, ignore_index=True)
@@ -0,0 +1,294 @@
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Tuple, Iterator, Optional
+
+import numpy
+import pandas
+
+from antilles.block import Block, Field
+from antilles.pipeline.unwarp import get_grid, unwarp
+from antilles.project import Project
+from antilles.utils.color import deconvolve, get_stains
+from antilles.utils.math import BOW_SPAN, cart2pol, polar_grid, distance_range
+
+# region columns copied to every row of its profile
+columns_region = ["relpath", "project", "block", "panel", "level", "sample", "drug"]
+
+defaults = {
+    "bin_width": 10.0,  # microns
+    "max_distance": 1000.0,  # microns from the well
+    "span": BOW_SPAN,  # degrees
+    "angle_bins": 1,
+    "tile_size": 1024,  # pixels
+    "stains": "hed",
+    "polar": False,  # profile polar images rather than tiles of the regions
+}
+
+
+def measurements(stains: str) -> List[str]:
+    # in the order of the values binned by profile_tile
+    _, names = get_stains(stains)
+    return ["red", "green", "blue", "intensity"] + names
+
+
+def get_bow(region: Dict[str, Any], params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The geometry of a bow in region pixels: the device center, the direction
+    and distance of the well from it, and the bins of distance from the well.
+    """
+    cx, cy = float(region["center_x"]), float(region["center_y"])
+    r_well, angle = cart2pol(float(region["well_x"]) - cx, float(region["well_y"]) - cy)
+
+    mpp = float(region["mpp"])
+    if not mpp > 0:
+        raise ValueError(f"MPP not set for region {region['relpath']}!")
+
+    bin_width = params["bin_width"] / mpp
+    n_distances = int(math.ceil(params["max_distance"] / params["bin_width"]))
+
+    return {
+        "center": (cx, cy),
+        "angle": angle,
+        "r_well": r_well,
+        "bin_width": bin_width,
+        "n_distances": n_distances,
+        "n_angles": int(params["angle_bins"]),
+        "span": float(params["span"]),
+    }
+
+
+def get_tiles(
+    size: Tuple[int, int], bow: Dict[str, Any], tile_size: int
+) -> Iterator[Tuple[Tuple[int, int], Tuple[int, int]]]:
+    """
+    (origin, size) of the tiles of a region that overlap the band of the bow
+    being profiled; tiles entirely nearer or farther than the band are skipped.
+    """
+    w, h = size
+    r_min = bow["r_well"]
+    r_max = bow["r_well"] + bow["n_distances"] * bow["bin_width"]
+
+    for y in range(0, h, tile_size):
+        for x in range(0, w, tile_size):
+            tile = (x, y), (min(tile_size, w - x), min(tile_size, h - y))
+            near, far = distance_range(*tile, bow["center"])
+            if far >= r_min and near < r_max:
+                yield tile
+
+
+def bin_pixels(
+    pixels: numpy.ndarray,
+    bins: numpy.ndarray,
+    n_bins: int,
+    stains: str,
+    weights: Optional[numpy.ndarray] = None,
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Pixel counts, and sums of intensities and stain densities, in each bin,
+    for (n, 3) RGB pixels and the bin of each. With `weights`, each pixel
+    counts as its weight rather than as one.
+    """
+    if not len(pixels):
+        sums = numpy.zeros((n_bins, len(measurements(stains))))
+        dtype = numpy.int64 if weights is None else numpy.float64
+        return numpy.zeros(n_bins, dtype=dtype), sums
+
+    values = numpy.concatenate(
+        [
+            pixels.astype(numpy.float32),
+            pixels.mean(axis=1, dtype=numpy.float32)[:, numpy.newaxis],
+            deconvolve(pixels, stains),
+        ],
+        axis=1,
+    )
+
+    counts = numpy.bincount(bins, weights=weights, minlength=n_bins)
+    if weights is not None:
+        values = values * weights[:, numpy.newaxis]
+    sums = numpy.stack(
+        [
+            numpy.bincount(bins, weights=values[:, k], minlength=n_bins)
+            for k in range(values.shape[1])
+        ],
+        axis=1,
+    )
+    return counts, sums
+
+
+def profile_tile(
+    image: numpy.ndarray,
+    origin: Tuple[int, int],
+    bow: Dict[str, Any],
+    stains: str,
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Pixel counts, and sums of intensities and stain densities, in each
+    (distance, angle) bin of the bow, for one tile of a region.
+    """
+    h, w = image.shape[:2]
+    n_bins = bow["n_distances"] * bow["n_angles"]
+    hspan = bow["span"] / 2
+
+    rho, theta = polar_grid(origin, (w, h), bow["center"], bow["angle"])
+    distance = (rho - bow["r_well"]) / bow["bin_width"]
+    inside = (distance >= 0) & (distance < bow["n_distances"]) & (abs(theta) <= hspan)
+
+    di = distance[inside].astype(numpy.int64)
+    ai = ((theta[inside] + hspan) / bow["span"] * bow["n_angles"]).astype(numpy.int64)
+    ai = numpy.minimum(ai, bow["n_angles"] - 1)
+
+    bins = di * bow["n_angles"] + ai
+    return bin_pixels(image[inside], bins, n_bins, stains)
+
+
+def profile_polar(
+    image: numpy.ndarray, radii: numpy.ndarray, bow: Dict[str, Any], stains: str
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    As profile_tile, for the RGBA polar image of a region made by
+    antilles.pipeline.unwarp, whose rows are `radii` pixels from the well and
+    evenly cover the profiled distances. Bins are whole runs of rows and
+    columns, so no geometry is computed. Samples farther from the device
+    center stand for more of the region, so each is weighted by the area it
+    covers, in region pixels; counts are then comparable to profile_tile's.
+    """
+    n_bins = bow["n_distances"] * bow["n_angles"]
+    n_radii, n_angles = image.shape[:2]
+
+    # area of the annulus sector around each sample, rho * d_theta * d_rho
+    d_rho = bow["n_distances"] * bow["bin_width"] / n_radii
+    d_theta = math.radians(bow["span"]) / n_angles
+    area = (radii + bow["r_well"]) * d_theta * d_rho
+
+    di = numpy.floor(radii / bow["bin_width"]).astype(numpy.int64)
+    ai = numpy.arange(n_angles)[numpy.newaxis, :] * bow["n_angles"] // n_angles
+    bins = numpy.broadcast_to(di * bow["n_angles"] + ai, image.shape[:2])
+
+    inside = (image[:, :, 3] > 0) & (di >= 0) & (di < bow["n_distances"])
+    weights = numpy.broadcast_to(area, image.shape[:2])[inside].astype(numpy.float64)
+    return bin_pixels(image[:, :, :3][inside], bins[inside], n_bins, stains, weights)
+
+
+def to_frame(
+    region: Dict[str, Any],
+    bow: Dict[str, Any],
+    counts: numpy.ndarray,
+    sums: numpy.ndarray,
+    params: Dict[str, Any],
+) -> pandas.DataFrame:
+    """
+    One row per bin with any pixels: its distance and angle, the number of
+    region pixels in it, and their mean intensities and stain densities.
+    """
+    n_d, n_a = bow["n_distances"], bow["n_angles"]
+    di, ai = numpy.divmod(numpy.arange(n_d * n_a), n_a)
+    angle_width = bow["span"] / n_a
+
+    df = pandas.DataFrame(
+        {
+            "distance": (di + 0.5) * params["bin_width"],
+            "angle": -bow["span"] / 2 + (ai + 0.5) * angle_width,
+            # polar samples are counted by area, so are rounded to pixels
+            "n_pixels": numpy.rint(counts).astype(numpy.int64),
+        }
+    )
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts[:, numpy.newaxis]
+    for k, name in enumerate(measurements(params["stains"])):
+        df[name] = means[:, k]
+
+    df = df[counts > 0]
+    for i, column in enumerate(columns_region):
+        df.insert(i, column, region[column])
+    return df
+
+
+class Profiler:
+    def __init__(
+        self,
+        project: Project,
+        block: Block,
+        params: Dict[str, Any] = None,
+        max_workers: Optional[int] = None,
+    ):
+        """
+        Mean intensities and stain densities of each region against distance
+        from the well, within the span of its bow. Regions are read and binned
+        a tile at a time in a thread pool, so that whole regions are never
+        held in memory at full precision; only tiles that overlap the profiled
+        band are read. With `polar`, each region is unwarped whole instead
+        (see profile_polar), and regions are profiled in parallel. The
+        profiles of a block are saved as Field.PROFILES.
+        """
+        self.log = logging.getLogger(__name__)
+        self.project = project
+        self.block = block
+        self.params = {**defaults, **(params or {})}
+        self.max_workers = max_workers
+
+    def profile_polar(self, region: Dict[str, Any], reader) -> pandas.DataFrame:
+        bow = get_bow(region, self.params)
+
+        # enough columns for every angle bin to have as many
+        n_angles = bow["n_angles"] * int(math.ceil(180 / bow["n_angles"]))
+        params = {
+            "radius_range": (0.0, bow["n_distances"] * self.params["bin_width"]),
+            "resolution": None,
+            "span": bow["span"],
+            "n_angles": n_angles,
+        }
+        image = unwarp(reader, region, params)
+
+        radii, _, _ = get_grid(float(region["mpp"]), params)
+        counts, sums = profile_polar(image, radii, bow, self.params["stains"])
+        return to_frame(region, bow, counts, sums, self.params)
+
+    def profile_region(
+        self, region: Dict[str, Any], reader, pool: ThreadPoolExecutor
+    ) -> pandas.DataFrame:
+        bow = get_bow(region, self.params)
+        size = reader.size(region["relpath"])
+
+        def work(tile) -> Tuple[numpy.ndarray, numpy.ndarray]:
+            (x, y), (w, h) = tile
+            image = reader.read(region["relpath"], x, y, w, h)
+            return profile_tile(image, (x, y), bow, self.params["stains"])
+
+        n_bins = bow["n_distances"] * bow["n_angles"]
+        n_measurements = len(measurements(self.params["stains"]))
+        counts = numpy.zeros(n_bins, dtype=numpy.int64)
+        sums = numpy.zeros((n_bins, n_measurements))
+        for c, s in pool.map(work, get_tiles(size, bow, self.params["tile_size"])):
+            counts += c
+            sums += s
+
+        return to_frame(region, bow, counts, sums, self.params)
+
+    def profile(self, regions: pandas.DataFrame) -> pandas.DataFrame:
+        reader = self.block.open_regions()
+
+        records = regions.to_dict("records")
+        profiles: List[pandas.DataFrame] = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            if self.params["polar"]:
+                # regions are unwarped whole, so are profiled in parallel
+                # rather than a tile at a time
+                profiles = list(
+                    pool.map(lambda region: self.profile_polar(region, reader), records)
+                )
+            else:
+                for i, region in enumerate(records):
+                    self.log.debug(f"Profiling region {i + 1}/{len(regions)}")
+                    profiles.append(self.profile_region(region, reader, pool))
+
+        if not profiles:
+            return pandas.DataFrame(columns=columns_region)
+        return pandas.concat(profiles, ignore_index=True)
+
+    def run(self, field: Field = Field.IMAGES_COORDS_BOW) -> None:
+        self.log.info("Profiling regions ... ")
+        regions = self.block.get(field)
+        profiles = self.profile(regions)
+        self.block.save(profiles, Field.PROFILES)
+        self.log.info(f"Profiling {len(regions)} regions complete.")
@@ -0,0 +1,176 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Collection
+
+import numpy
+import pandas
+from PIL import Image
+
+from antilles.block import Block, Field, dtypes_registration
+from antilles.project import Project
+from antilles.utils.io import get_config, init_worker
+from antilles.utils.registration import to_signal, estimate_transform
+from antilles.utils.slides import get_slide_info
+from antilles.utils.tissue import get_slide_thumbnail
+from antilles.wholeslideimage import WholeSlideImage
+
+defaults = {
+    "reference": None,  # fields of the reference slide, e.g. {"panel": "HE"}
+    "max_size": 512,  # pixels, of the thumbnails registered
+    "rotation": True,  # or translation only
+    "upsample": 10,  # subpixel precision of phase correlation
+    "min_quality": 0.5,  # correlation of aligned thumbnails; lower are flagged
+    "max_rotation": 10.0,  # degrees; sample angles are shared by every slide
+}
+
+columns_matrix = ["m00", "m01", "m02", "m10", "m11", "m12"]
+
+
+def get_reference(
+    slides: List[WholeSlideImage], fields: Optional[Dict[str, Any]] = None
+) -> WholeSlideImage:
+    # the first slide with `fields`, by level and then panel
+    slides = sorted(slides, key=lambda s: (s.level, str(s.panel)))
+    for slide in slides:
+        info = slide.to_dict()
+        if all(str(info[key]) == str(value) for key, value in (fields or {}).items()):
+            return slide
+    raise ValueError(f"No reference slide with {fields}!")
+
+
+def register_slide(
+    reference: str, relpath: str, params: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    The transform taking level 0 (x, y) of the slide at `reference` to level
+    0 (x, y) of the slide at `relpath`, from their thumbnails, with the
+    quality of the alignment. Alignments that are poor, or turn the slide
+    further than arrow angles allow, are flagged. Runs in a worker process.
+    """
+    ref_image, ref_factor = get_slide_thumbnail(reference, params["max_size"])
+    image, _ = get_slide_thumbnail(relpath, params["max_size"])
+
+    # both thumbnails are compared at the microns per pixel of the reference
+    ref_mpp, mpp = get_slide_info(reference)["mpp"], get_slide_info(relpath)["mpp"]
+    scale = ref_factor
+    if ref_mpp is not None and mpp is not None:
+        scale = ref_factor * ref_mpp / mpp  # level 0 pixels per thumbnail pixel
+    w, h = get_slide_info(relpath)["dims"]
+    dims = max(int(round(w / scale)), 1), max(int(round(h / scale)), 1)
+    image = numpy.asarray(Image.fromarray(image).resize(dims, Image.BILINEAR))
+
+    matrix, quality = estimate_transform(to_signal(ref_image), to_signal(image), params)
+    matrix = numpy.diag([scale, scale, 1.0]) @ matrix
+    matrix = matrix @ numpy.diag([1 / ref_factor, 1 / ref_factor, 1.0])
+
+    # arrow angles are set per sample, not per slide, so cannot follow a turn
+    rotation = float(numpy.degrees(numpy.arctan2(matrix[1, 0], matrix[0, 0])))
+    flagged = quality < params["min_quality"] or abs(rotation) > params["max_rotation"]
+    return {
+        "relpath": relpath,
+        "reference": reference,
+        **dict(zip(columns_matrix, matrix[:2].ravel().tolist())),
+        "rotation": rotation,
+        "quality": quality,
+        "flagged": flagged,
+    }
+
+
+def propagate(
+    coords: pandas.DataFrame,
+    registration: pandas.DataFrame,
+    reference: str,
+    relpaths: Optional[Collection[str]] = None,
+) -> pandas.DataFrame:
+    """
+    Arrow centers of the reference slide mapped onto every other slide whose
+    alignment was not flagged, or only onto those of `relpaths`, if given.
+    Flagged slides keep their arrows, as do samples the reference lacks.
+    """
+    coords = coords.copy()
+    centers = coords[coords["relpath"] == reference].set_index("sample")
+    for row in registration[~registration["flagged"]].to_dict("records"):
+        if relpaths is not None and row["relpath"] not in relpaths:
+            continue
+        ind = (coords["relpath"] == row["relpath"]) & coords["sample"].isin(
+            centers.index
+        )
+        xy = centers.loc[coords.loc[ind, "sample"], ["center_x", "center_y"]]
+        matrix = numpy.array([row[c] for c in columns_matrix]).reshape(2, 3)
+        mapped = xy.to_numpy(numpy.float64) @ matrix[:, :2].T + matrix[:, 2]
+        # in the dtypes of the columns, e.g. int32 once cast by Block
+        for k, column in enumerate(["center_x", "center_y"]):
+            values = numpy.rint(mapped[:, k]).astype(coords[column].dtype)
+            coords.loc[ind, column] = values
+    return coords
+
+
+class Registrar:
+    def __init__(
+        self,
+        project: Project,
+        block: Block,
+        params: Dict[str, Any] = None,
+        max_workers: Optional[int] = None,
+    ):
+        """
+        Aligns the thumbnail of every slide of a block onto a reference slide
+        with a rigid transform, in worker processes, and saves the transforms
+        as Field.REGISTRATION. Arrows annotated on the reference slide are
+        then mapped onto the other levels and panels, so that only the slides
+        whose alignments are flagged need annotating by hand.
+        """
+        self.log = logging.getLogger(__name__)
+        self.project = project
+        self.block = block
+        self.params = {**defaults, **(params or {})}
+        self.max_workers = max_workers
+
+    def register(self, reference: str, relpaths: List[str]) -> pandas.DataFrame:
+        with ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=init_worker,
+            initargs=(get_config().to_dict(),),
+        ) as pool:
+            futures = [
+                pool.submit(register_slide, reference, relpath, self.params)
+                for relpath in relpaths
+            ]
+            rows = [future.result() for future in futures]
+        return pandas.DataFrame.from_records(
+            rows, columns=list(dtypes_registration.keys())
+        )
+
+    def run(self, overwrite: bool = False) -> None:
+        """
+        Arrows are only mapped onto slides that have none stored yet, as those
+        may have been adjusted by hand since, unless `overwrite`.
+        """
+        self.log.info("Registering slides ... ")
+        slides = self.block.images
+        reference = get_reference(slides, self.params["reference"]).relpath
+        relpaths = [slide.relpath for slide in slides if slide.relpath != reference]
+
+        registration = self.register(reference, relpaths)
+        self.block.save(registration, Field.REGISTRATION)
+
+        todo = set(relpaths)
+        stored = self.block.read(Field.IMAGES_COORDS)
+        if not overwrite and stored is not None:
+            todo -= set(stored["relpath"])
+            if len(todo) < len(relpaths):
+                self.log.info(
+                    f"Keeping the arrows of {len(relpaths) - len(todo)} slides."
+                )
+
+        coords = self.block.get(Field.IMAGES_COORDS)
+        coords = propagate(coords, registration, reference, relpaths=todo)
+        self.block.save(coords, Field.IMAGES_COORDS, merge=True)
+
+        flagged = registration.loc[registration["flagged"], "relpath"]
+        for relpath in flagged:
+            self.log.warning(f"Alignment of {relpath} is poor; annotate it by hand.")
+        self.log.info(
+            f"Registering {len(relpaths)} slides onto {reference} complete "
+            f"({len(flagged)} flagged)."
+        )
@@ -0,0 +1,165 @@
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from functools import lru_cache
+from typing import Dict, Any, Tuple, Optional
+
+import numpy
+from scipy import ndimage
+
+from antilles.block import Block, Field
+from antilles.project import Project
+from antilles.utils.math import BOW_SPAN, cart2pol
+
+defaults = {
+    "radius_range": (0.0, 1000.0),  # microns from the well
+    "resolution": None,  # microns per row; the mpp of each region if not set
+    "span": BOW_SPAN,  # degrees
+    "n_angles": 180,
+}
+
+
+def get_size(mpp: float, params: Dict[str, Any]) -> Tuple[int, int]:
+    # (rows, columns) of the polar image of a region
+    r0, r1 = params["radius_range"]
+    resolution = params["resolution"] or mpp
+    return int(math.ceil((r1 - r0) / resolution)), int(params["n_angles"])
+
+
+@lru_cache(maxsize=64)
+def get_remap_grid(
+    size: Tuple[int, int], radius_range: Tuple[float, float], span: float, mpp: float
+) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """
+    The part of the polar sampling grid that only depends on the geometry of
+    a bow, so is shared by every region with the same size, radius range (in
+    microns from the well), span and mpp: the distance from the well of each
+    row in pixels, and the direction of each column relative to the bow.
+    """
+    n_radii, n_angles = size
+    r0, r1 = radius_range
+
+    radii = r0 + (numpy.arange(n_radii) + 0.5) * (r1 - r0) / n_radii
+    radii = (radii / mpp).astype(numpy.float32)[:, numpy.newaxis]
+
+    theta = -span / 2 + (numpy.arange(n_angles) + 0.5) * span / n_angles
+    theta = numpy.radians(theta).astype(numpy.float32)[numpy.newaxis, :]
+    cos, sin = numpy.cos(theta), numpy.sin(theta)
+
+    for array in (radii, cos, sin):
+        array.setflags(write=False)
+    return radii, cos, sin
+
+
+def get_grid(
+    mpp: float, params: Dict[str, Any]
+) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    size = get_size(mpp, params)
+    radius_range = tuple(float(r) for r in params["radius_range"])
+    return get_remap_grid(size, radius_range, float(params["span"]), float(mpp))
+
+
+def get_coords(
+    region: Dict[str, Any], params: Dict[str, Any]
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Region coordinates (x, y) of every pixel of the polar image of a region,
+    with rows going away from the well and columns sweeping clockwise across
+    the span of its bow.
+    """
+    mpp = float(region["mpp"])
+    if not mpp > 0:
+        raise ValueError(f"MPP not set for region {region['relpath']}!")
+
+    cx, cy = float(region["center_x"]), float(region["center_y"])
+    r_well, angle = cart2pol(float(region["well_x"]) - cx, float(region["well_y"]) - cy)
+
+    radii, cos, sin = get_grid(mpp, params)
+
+    # rotate the cached directions onto the bow, then scale and translate
+    ca, sa = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+    ux, uy = cos * ca - sin * sa, sin * ca + cos * sa
+    rho = radii + numpy.float32(r_well)
+    return cx + rho * ux, cy + rho * uy
+
+
+def unwarp(reader, region: Dict[str, Any], params: Dict[str, Any]) -> numpy.ndarray:
+    """
+    The polar image of a region as RGBA, bilinearly resampled from the window
+    of the region that the bow covers. Alpha is 0 where the bow leaves the
+    region.
+    """
+    xs, ys = get_coords(region, params)
+    out = numpy.zeros(xs.shape + (4,), dtype=numpy.uint8)
+
+    rw, rh = reader.size(region["relpath"])
+    # the window of the region that the samples fall in
+    x0 = max(int(math.floor(xs.min())), 0)
+    y0 = max(int(math.floor(ys.min())), 0)
+    x1 = min(int(math.ceil(xs.max())) + 1, rw)
+    y1 = min(int(math.ceil(ys.max())) + 1, rh)
+    if x1 <= x0 or y1 <= y0:
+        return out
+
+    window = reader.read(region["relpath"], x0, y0, x1 - x0, y1 - y0)
+    coords = numpy.stack([ys - y0, xs - x0])
+    for c in range(3):
+        channel = ndimage.map_coordinates(window[:, :, c], coords, order=1)
+        out[:, :, c] = channel
+
+    inside = (xs >= 0) & (xs <= rw - 1) & (ys >= 0) & (ys <= rh - 1)
+    out[:, :, 3] = inside * 255
+    return out
+
+
+class Unwarper:
+    def __init__(
+        self,
+        project: Project,
+        block: Block,
+        params: Dict[str, Any] = None,
+        max_workers: Optional[int] = None,
+    ):
+        """
+        Resamples each region into a polar image centered on its bow, with
+        distance from the well down the rows and angle across the columns, and
+        saves them to the polar store of the block. Sampling grids are cached
+        by geometry, so regions of the same size, radius range, span and mpp
+        only rotate and translate a shared grid.
+        """
+        self.log = logging.getLogger(__name__)
+        self.project = project
+        self.block = block
+        self.params = {**defaults, **(params or {})}
+        self.max_workers = max_workers
+
+    def run(self, field: Field = Field.IMAGES_COORDS_BOW) -> None:
+        self.log.info("Unwarping regions ... ")
+        regions = self.block.get(field).to_dict("records")
+        reader = self.block.open_regions()
+
+        def work(region: Dict[str, Any]) -> Tuple[str, numpy.ndarray]:
+            return region["relpath"], unwarp(reader, region, self.params)
+
+        # regions are queued a few at a time and written as they complete, so
+        # that only a few polar images are in memory at once
+        n_queued = 2 * (self.max_workers or os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            with self.block.polar_store.writer() as writer:
+                pending = set()
+                for region in regions:
+                    if len(pending) >= n_queued:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            writer.add(*future.result())
+                    pending.add(pool.submit(work, region))
+
+                for future in wait(pending).done:
+                    writer.add(*future.result())
+
+        info = get_remap_grid.cache_info()
+        self.log.info(
+            f"Unwarping {len(regions)} regions complete "
+            f"(remap grids: {info.hits} hits, {info.misses} misses)."
+        )
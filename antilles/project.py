@@ -1,9 +1,10 @@
-import json
+import copy
 import logging
 import re
 import warnings
+from functools import lru_cache
 from os.path import join
-from typing import Pattern, List, Any, Dict
+from typing import Pattern, List, Any, Dict, Optional, Tuple
 
 from .block import Block
 from .utils.io import DAO
@@ -17,6 +18,11 @@ def validate(config: Dict[str, Any]):
             warnings.warn(f"{key} not in project.json!")
 
 
+@lru_cache(maxsize=None)
+def compile_regex(regex: str) -> Pattern:
+    return re.compile(regex)
+
+
 class Project:
     filename = "project.json"
 
@@ -25,14 +31,23 @@ class Project:
         A Project is a directory containing a project.json file and one or more
         subdirectories, each of which represents a block belonging to the
         project.
+
+        project.json is parsed once and parsed again only when it changes on
+        disk; blocks are built on first access, and kept across changes, with
+        their configuration updated.
         """
         self.log = logging.getLogger(__name__)
         self.name = name
+
+        self._config: Optional[Dict[str, Any]] = None
+        self._config_stamp: Optional[Tuple[int, int]] = None
+        self._blocks: Dict[str, Block] = {}
+
         self.check()
 
     def check(self) -> None:
         block_names_fs = DAO.list_folders(self.relpath)
-        block_names_json = [b["name"] for b in self.config["blocks"]]
+        block_names_json = [b["name"] for b in self.load()["blocks"]]
 
         if set(block_names_fs) != set(block_names_json):
             warnings.warn(
@@ -49,31 +64,54 @@ class Project:
     def relpath(self) -> str:
         return self.name
 
-    @property
-    def config(self) -> Dict[str, Any]:
+    def load(self) -> Dict[str, Any]:
+        # the parsed project.json, shared; not to be modified
         filepath = join(self.relpath, self.filename)
-        with open(DAO.abs(filepath)) as file:
-            config = json.load(file)
+        stat = DAO.stat(filepath)
+        stamp = stat.st_mtime_ns, stat.st_size
+
+        if stamp != self._config_stamp:
+            config = DAO.read_json(filepath)
             validate(config)
-            return config
+
+            self._config = config
+            self._config_stamp = stamp
+
+            # blocks keep what they have read, and are told of their changes
+            blocks = {b["name"]: b for b in config["blocks"]}
+            for name in list(self._blocks.keys()):
+                if name in blocks:
+                    self._blocks[name].update(copy.deepcopy(blocks[name]))
+                else:
+                    del self._blocks[name]
+
+        return self._config
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        return copy.deepcopy(self.load())
 
     @property
     def image_regex(self) -> Pattern:
-        regex = self.config["image_regex"]
-        return re.compile(regex)
+        regex = self.load()["image_regex"]
+        return compile_regex(regex)
 
     @property
     def region_regex(self) -> Pattern:
-        regex = self.config['region_regex']
-        return re.compile(regex)
+        regex = self.load()["region_regex"]
+        return compile_regex(regex)
 
     @property
     def blocks(self) -> List[Block]:
-        return [Block(b, self) for b in self.config["blocks"]]
+        return [self.block(b["name"]) for b in self.load()["blocks"]]
 
     def block(self, name: str) -> Block:
-        for b in self.blocks:
-            if b.name == name:
-                return b
+        config = self.load()
+        if name not in self._blocks.keys():
+            b = next((b for b in config["blocks"] if b["name"] == name), None)
+            if b is None:
+                raise ValueError(f"Block {name} not found in {self.name}!")
+
+            self._blocks[name] = Block(copy.deepcopy(b), self)
 
-        raise ValueError(f"Block {name} not found in {self.name}!")
+        return self._blocks[name]
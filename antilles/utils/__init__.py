@@ -1,7 +1,6 @@
 import logging
 import time
-from functools import reduce
-from typing import List, Iterator, Callable, Any
+from typing import List, Iterator, Callable, Any, Dict
 
 import pandas
 
@@ -21,18 +20,39 @@ def flatten(l: Iterator[Any]) -> Iterator[Any]:
 
 
 def upsert(
-    update: pandas.DataFrame, using: pandas.DataFrame, cols: List[str]
+    update: pandas.DataFrame,
+    using: pandas.DataFrame,
+    cols: List[str],
+    sort: bool = True,
 ) -> pandas.DataFrame:
-    indices = map(lambda x: ~update[x].isin(using[x]), cols)
-    indices = reduce((lambda x, y: x | y), indices)
+    """
+    Rows of `using`, plus the rows of `update` whose key is not in `using`.
+    Keys are the tuples of values in `cols`, matched with a hash join. With no
+    key columns, `using` replaces `update` entirely.
+    """
+    if len(cols) == 0:
+        updated = using.copy()
+    else:
+        keys_update = pandas.MultiIndex.from_frame(update[cols])
+        keys_using = pandas.MultiIndex.from_frame(using[cols])
+        indices = ~keys_update.isin(keys_using)
 
-    updated = pandas.concat([update[indices], using], ignore_index=True)
-    updated = updated.sort_values(by=cols)
-    updated.index = range(len(updated))
+        updated = pandas.concat([update[indices], using], ignore_index=True)
+        if sort:
+            updated = updated.sort_values(by=cols)
 
+    updated.index = range(len(updated))
     return updated
 
 
+def select(df: pandas.DataFrame, where: Dict[str, Any]) -> pandas.DataFrame:
+    for col, values in where.items():
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        df = df[df[col].isin(values)]
+    return df
+
+
 def profile(log: logging.Logger) -> Callable:
     def wrapper(func: Callable) -> Callable:
         def _wrapper(*args, **kwargs):
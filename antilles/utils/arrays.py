@@ -0,0 +1,347 @@
+import logging
+import os
+import zlib
+from contextlib import contextmanager
+from os.path import join, dirname
+from typing import List, Dict, Any, Optional, Tuple, Iterator
+
+import numpy
+import pandas
+from PIL import Image
+
+from antilles.utils.io import DAO
+
+log = logging.getLogger(__name__)
+
+codecs = ["none", "zlib"]
+
+columns = [
+    "name",
+    "height",
+    "width",
+    "channels",
+    "dtype",
+    "compression",
+    "chunk_height",
+    "chunk_width",
+    "chunk_start",
+    "chunk_count",
+]
+
+
+def encode(chunk: numpy.ndarray, compression: str, level: int) -> bytes:
+    data = numpy.ascontiguousarray(chunk).tobytes()
+    if compression == "zlib":
+        return zlib.compress(data, level)
+    return data
+
+
+def decode(data, compression: str) -> bytes:
+    if compression == "zlib":
+        return zlib.decompress(data)
+    return data
+
+
+class RegionWriter:
+    def __init__(self, store: "RegionStore", file, offset: int, n_chunks: int):
+        """
+        Appends regions to the data file of a RegionStore, one chunk at a time.
+        The chunk index and the region table are written when the writer is
+        closed by RegionStore.writer().
+        """
+        self.store = store
+        self.file = file
+        self.offset = offset
+        self.n_chunks = n_chunks  # chunks already in the store
+
+        self.chunks: List[Tuple[int, int]] = []
+        self.rows: List[Dict[str, Any]] = []
+
+    def add(self, name: str, array: numpy.ndarray) -> None:
+        if array.ndim == 2:
+            array = array[:, :, numpy.newaxis]
+        height, width, channels = array.shape
+        ch, cw = self.store.chunk_size
+
+        start = self.n_chunks + len(self.chunks)
+        for y in range(0, height, ch):
+            for x in range(0, width, cw):
+                data = encode(
+                    array[y : y + ch, x : x + cw],
+                    self.store.compression,
+                    self.store.level,
+                )
+                self.file.write(data)
+                self.chunks.append((self.offset, len(data)))
+                self.offset += len(data)
+
+        self.rows.append(
+            {
+                "name": name,
+                "height": height,
+                "width": width,
+                "channels": channels,
+                "dtype": array.dtype.str,
+                "compression": self.store.compression,
+                "chunk_height": ch,
+                "chunk_width": cw,
+                "chunk_start": start,
+                "chunk_count": self.n_chunks + len(self.chunks) - start,
+            }
+        )
+
+
+class RegionStore:
+    """
+    The regions of a block packed into a single chunked, compressed array
+    store instead of one tif per region, which saves thousands of files and
+    their metadata on shared drives. A store is a directory of:
+
+      data.<n>.bin     the encoded chunks of every region, back to back
+      chunks.<n>.npy   the (offset, length) in the data file of every chunk
+      regions.<n>.csv  one row per region: name, shape, dtype, compression,
+                       and which chunks it spans
+      store.json       which of those files make up the store
+
+    Regions are split into fixed-size chunks in row-major order, so that a
+    window of a region decodes only the chunks it overlaps. The data file is
+    read through a memory map. Regions are named by the relpath their tif
+    would have, and export() writes those tifs for CellProfiler.
+
+    Writes go to files of a new generation <n>, and store.json is replaced
+    last, so that readers see either the old store or the new one whole.
+    Files of all but the last two generations are then removed.
+    """
+
+    manifest = "store.json"
+
+    def __init__(
+        self,
+        dirpath: str,
+        chunk_size: Tuple[int, int] = (512, 512),
+        compression: str = "zlib",
+        level: int = 1,
+    ):
+        if compression not in codecs:
+            raise ValueError(f"Unknown compression {compression}!")
+
+        self.log = logging.getLogger(__name__)
+        self.dirpath = dirpath
+        self.chunk_size = tuple(chunk_size)
+        self.compression = compression
+        self.level = level
+
+        self._files: Optional[Dict[str, Any]] = None
+        self._regions: Optional[pandas.DataFrame] = None
+        self._chunks: Optional[numpy.ndarray] = None
+        self._mmap: Optional[numpy.memmap] = None
+
+    def path(self, name: str) -> str:
+        return join(self.dirpath, name)
+
+    @property
+    def files(self) -> Dict[str, Any]:
+        if self._files is None:
+            if DAO.is_file(self.path(self.manifest)):
+                self._files = DAO.read_json(self.path(self.manifest))
+            else:
+                # stores written before generations were kept
+                self._files = {
+                    "generation": 0,
+                    "data": "data.bin",
+                    "index": "chunks.npy",
+                    "table": "regions.csv",
+                }
+        return self._files
+
+    def exists(self) -> bool:
+        return DAO.is_file(self.path(self.files["table"]))
+
+    def reset(self) -> None:
+        self._files, self._regions, self._chunks, self._mmap = None, None, None, None
+
+    @property
+    def regions(self) -> pandas.DataFrame:
+        if self._regions is None:
+            if self.exists():
+                df = DAO.read_csv(self.path(self.files["table"]))
+            else:
+                df = pandas.DataFrame(columns=columns)
+            self._regions = df.set_index("name", drop=False)
+        return self._regions
+
+    @property
+    def chunks(self) -> numpy.ndarray:
+        if self._chunks is None:
+            if self.exists():
+                self._chunks = numpy.load(DAO.abs(self.path(self.files["index"])))
+            else:
+                self._chunks = numpy.empty((0, 2), dtype=numpy.int64)
+        return self._chunks
+
+    @property
+    def n_chunks(self) -> int:
+        return len(self.chunks)
+
+    @property
+    def mmap(self) -> numpy.memmap:
+        if self._mmap is None:
+            self._mmap = numpy.memmap(
+                DAO.abs(self.path(self.files["data"])), dtype=numpy.uint8, mode="r"
+            )
+        return self._mmap
+
+    @contextmanager
+    def writer(self, append: bool = False) -> Iterator[RegionWriter]:
+        """
+        Adds regions to the store, replacing it unless `append` is set. The
+        store is only updated once the block exits without error.
+        """
+        DAO.make_dir(self.dirpath)
+
+        with DAO.lock(self.path(self.manifest)):
+            self.reset()
+            append = append and self.exists()
+            generation = self.files["generation"] + 1
+
+            if append:
+                # chunks written after the last index are not referenced, so
+                # appending to the data file in use is safe
+                data = self.files["data"]
+                with open(DAO.abs(self.path(data)), "ab") as file:
+                    writer = RegionWriter(self, file, file.tell(), self.n_chunks)
+                    yield writer
+            else:
+                data = f"data.{generation}.bin"
+                with open(DAO.abs(self.path(data)), "wb") as file:
+                    writer = RegionWriter(self, file, 0, 0)
+                    yield writer
+
+            self.commit(writer, append, generation, data)
+
+    def commit(
+        self, writer: RegionWriter, append: bool, generation: int, data: str
+    ) -> None:
+        chunks = numpy.array(writer.chunks, dtype=numpy.int64).reshape(-1, 2)
+        regions = pandas.DataFrame(writer.rows, columns=columns)
+        if append:
+            chunks = numpy.concatenate([self.chunks, chunks])
+            kept = self.regions[~self.regions["name"].isin(regions["name"])]
+            regions = pandas.concat([kept, regions], ignore_index=True)
+
+        previous = self.files
+        files = {
+            "generation": generation,
+            "data": data,
+            "index": f"chunks.{generation}.npy",
+            "table": f"regions.{generation}.csv",
+        }
+        with open(DAO.abs(self.path(files["index"])), "wb") as file:
+            numpy.save(file, chunks)
+        regions.to_csv(DAO.abs(self.path(files["table"])), index=False)
+        DAO.to_json(files, self.path(self.manifest))
+
+        self.reset()
+        self.clean(previous, files)
+        self.log.info(f"Wrote {len(writer.rows)} regions to {self.dirpath}")
+
+    def clean(self, *kept: Dict[str, Any]) -> None:
+        """
+        Removes the files of generations other than `kept`. Readers that
+        loaded the previous store before it was replaced can still read it.
+        """
+        names = {f[key] for f in kept for key in ("data", "index", "table")}
+        for name in DAO.list_files(self.dirpath):
+            if name.endswith(".lock") or name == self.manifest or name in names:
+                continue
+            try:
+                os.remove(DAO.abs(self.path(name)))
+            except OSError:
+                # e.g. still mapped by a reader on Windows; removed next time
+                pass
+
+    def names(self) -> List[str]:
+        return list(self.regions["name"])
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.regions.index
+
+    def shape(self, name: str) -> Tuple[int, int, int]:
+        row = self.regions.loc[name]
+        return int(row["height"]), int(row["width"]), int(row["channels"])
+
+    def size(self, name: str) -> Tuple[int, int]:
+        height, width, _ = self.shape(name)
+        return width, height
+
+    def read(
+        self,
+        name: str,
+        x: int = 0,
+        y: int = 0,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+    ) -> numpy.ndarray:
+        """
+        The window of a region with its upper left corner at (x, y), or the
+        whole region. Only the chunks overlapping the window are decoded.
+        """
+        row = self.regions.loc[name]
+        rh, rw, channels = self.shape(name)
+        ch, cw = int(row["chunk_height"]), int(row["chunk_width"])
+        dtype = numpy.dtype(row["dtype"])
+
+        width = rw - x if width is None else width
+        height = rh - y if height is None else height
+        if x < 0 or y < 0 or x + width > rw or y + height > rh:
+            raise ValueError(
+                f"Window ({x}, {y}, {width}, {height}) is outside region {name} "
+                f"of size ({rw}, {rh})!"
+            )
+
+        out = numpy.empty((height, width, channels), dtype=dtype)
+        n_cols = -(-rw // cw)
+        start = int(row["chunk_start"])
+
+        for j in range(y // ch, -(-(y + height) // ch)):
+            for i in range(x // cw, -(-(x + width) // cw)):
+                offset, length = self.chunks[start + j * n_cols + i]
+                data = decode(self.mmap[offset : offset + length], row["compression"])
+
+                y0, x0 = j * ch, i * cw
+                shape = (min(ch, rh - y0), min(cw, rw - x0), channels)
+                chunk = numpy.frombuffer(data, dtype=dtype).reshape(shape)
+
+                # intersection of the chunk and the window, in region coordinates
+                top, bottom = max(y, y0), min(y + height, y0 + shape[0])
+                left, right = max(x, x0), min(x + width, x0 + shape[1])
+                out[top - y : bottom - y, left - x : right - x] = chunk[
+                    top - y0 : bottom - y0, left - x0 : right - x0
+                ]
+
+        return out
+
+    def thumbnail(self, name: str, size: Tuple[int, int]) -> Image.Image:
+        # a region downsampled to `size`, as RegionReader.thumbnail
+        array = self.read(name)
+        if array.shape[2] == 1:
+            array = array[:, :, 0]
+        return Image.fromarray(array).resize(size, Image.LANCZOS)
+
+    def export(self, names: Optional[List[str]] = None) -> List[str]:
+        """
+        Writes regions as tifs at the paths they are named by, for tools that
+        need one image per file.
+        """
+        names = self.names() if names is None else names
+        for name in names:
+            array = self.read(name)
+            if array.shape[2] == 1:
+                array = array[:, :, 0]
+
+            DAO.make_dir(dirname(name))
+            with DAO.atomic(name) as tmppath:
+                Image.fromarray(array).save(tmppath, format="TIFF")
+
+        self.log.info(f"Exported {len(names)} regions from {self.dirpath}")
+        return names
@@ -0,0 +1,85 @@
+from concurrent.futures import Executor
+from typing import List, Tuple, Optional
+
+import numpy
+from skimage.color import separate_stains, hed_from_rgb, hdx_from_rgb
+
+# stain separation matrices (Ruifrok and Johnston), and their channels in order
+stain_matrices = {
+    "hed": (hed_from_rgb, ["hematoxylin", "eosin", "dab"]),
+    "hdx": (hdx_from_rgb, ["hematoxylin", "dab", "residual"]),
+}
+
+
+def get_stains(name: str) -> Tuple[numpy.ndarray, List[str]]:
+    if name not in stain_matrices.keys():
+        raise ValueError(f"Unknown stains {name}!")
+    return stain_matrices[name]
+
+
+def deconvolve(rgb: numpy.ndarray, stains: str = "hed") -> numpy.ndarray:
+    """
+    Optical densities of each stain, as float32 with the stains along the last
+    axis. `rgb` is any array of 8-bit RGB pixels, e.g. (h, w, 3) or (n, 3).
+    """
+    matrix, _ = get_stains(stains)
+    shape = rgb.shape
+    od = separate_stains(rgb.reshape(-1, 1, 3), matrix)
+    return od.reshape(shape).astype(numpy.float32)
+
+
+# dtypes that stain densities can be stored as
+stain_dtypes = ["float16", "uint8"]
+
+
+def encode_stains(od: numpy.ndarray, dtype: str, od_max: float) -> numpy.ndarray:
+    """
+    Stain densities as `dtype`. For uint8, densities from 0 to `od_max` are
+    scaled to 0 to 255, and higher densities are clipped.
+    """
+    if dtype == "float16":
+        return od.astype(numpy.float16)
+    elif dtype == "uint8":
+        scaled = numpy.clip(od * (255 / od_max), 0, 255)
+        return numpy.rint(scaled, out=scaled).astype(numpy.uint8)
+    else:
+        raise ValueError(f"Unknown stain dtype {dtype}!")
+
+
+def decode_stains(array: numpy.ndarray, od_max: float) -> numpy.ndarray:
+    # the inverse of encode_stains, as float32
+    if array.dtype == numpy.uint8:
+        return array.astype(numpy.float32) * numpy.float32(od_max / 255)
+    return array.astype(numpy.float32)
+
+
+def separate(
+    image: numpy.ndarray,
+    stains: str = "hed",
+    dtype: str = "float16",
+    od_max: float = 2.0,
+    chunk_rows: int = 256,
+    pool: Optional[Executor] = None,
+) -> numpy.ndarray:
+    """
+    Stain densities of an (h, w, 3) RGB image as (h, w, n_stains) `dtype`.
+    Rows are deconvolved and encoded a chunk at a time, in `pool` if given,
+    so that float64 intermediates are only ever the size of a chunk.
+    """
+    h, w = image.shape[:2]
+    matrix, names = get_stains(stains)
+    out = numpy.empty((h, w, len(names)), dtype=dtype)
+
+    def work(start: int) -> None:
+        chunk = image[start : start + chunk_rows]
+        od = separate_stains(chunk, matrix)
+        out[start : start + chunk_rows] = encode_stains(od, dtype, od_max)
+
+    starts = range(0, h, chunk_rows)
+    if pool is None:
+        for start in starts:
+            work(start)
+    else:
+        # list() waits for every chunk, and raises the first error
+        list(pool.map(work, starts))
+    return out
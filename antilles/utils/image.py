@@ -1,12 +1,13 @@
-import warnings
-from typing import Tuple, Any, Dict
+from typing import Tuple, Any, Dict, Union
 
-import numpy
-import openslide
 import wx
 from PIL import Image
 
+from antilles.utils.arrays import RegionStore
 from antilles.utils.io import DAO
+from antilles.utils.regions import RegionReader
+from antilles.utils.slides import get_slide_info, get_best_level, get_image_size
+from antilles.utils.tiles import read_region
 
 
 def get_screen_size() -> Tuple[int, int]:
@@ -20,28 +21,6 @@ def get_screen_size() -> Tuple[int, int]:
 screen_size = get_screen_size()
 
 
-def get_slide_dims(path: str) -> Tuple[int, int]:
-    with openslide.OpenSlide(DAO.abs(path)) as obj:
-        return obj.dimensions
-
-
-def get_mpp_from_openslide(obj) -> float:
-    mpp_x = float(obj.properties[openslide.PROPERTY_NAME_MPP_X])
-    mpp_y = float(obj.properties[openslide.PROPERTY_NAME_MPP_Y])
-
-    if not numpy.equal(mpp_x, mpp_y):
-        warnings.warn(
-            "MPP values are not equal in x and y directions! "
-            "x: {x}, y: {y}".format(x=mpp_x, y=mpp_y)
-        )
-        mpp = numpy.average((mpp_x, mpp_y))
-
-    else:
-        mpp = mpp_x
-
-    return mpp
-
-
 def calc_downsample_factor(dims: Tuple[int, int]) -> float:
     # area in which image is displayed is not quite as big as the screen
     screen_size_eff = [s * 0.75 for s in screen_size]
@@ -53,20 +32,52 @@ def calc_downsample_factor(dims: Tuple[int, int]) -> float:
 
 
 def get_thumbnail(path: str) -> Dict[str, Any]:
-    try:
-        with openslide.OpenSlide(DAO.abs(path)) as obj:
-            dims = obj.dimensions
-            factor = calc_downsample_factor(dims)
+    """
+    A downsampled whole-slide image that fits on the screen, and the
+    downsample factor. Slides are read through the slide catalog and the tile
+    cache, which they are shared with.
+    """
+    info = get_slide_info(path)
+    dims = tuple(info["dims"])
+
+    factor = calc_downsample_factor(dims)
+    dims_tn = tuple(int(round(float(s) / factor)) for s in dims)
+
+    if info["openslide"]:
+        level = get_best_level(info, factor)
+        image = read_region(path, (0, 0), level, info["level_dimensions"][level])
+        image = Image.fromarray(image).resize(dims_tn, Image.LANCZOS)
 
-            dims_tn = tuple(int(round(float(s) / factor)) for s in dims)
-            image = obj.get_thumbnail(dims_tn)
-
-    except openslide.lowlevel.OpenSlideUnsupportedFormatError:
+    else:
         with Image.open(DAO.abs(path)) as obj:
-            dims = obj.size
-            factor = calc_downsample_factor(dims)
+            image = obj.resize(dims_tn, Image.LANCZOS)
+
+    return {"factor": factor, "image": image}
+
+
+def get_region_thumbnail(
+    path: str, reader: Union[RegionReader, RegionStore, None] = None
+) -> Dict[str, Any]:
+    """
+    A downsampled region that fits on the screen, and the downsample factor.
+    Regions that are not tifs are read through `reader`, from their source
+    slides if virtual or from the region store; tifs are read directly, so as
+    not to fill the slide catalog and tile cache with regions.
+    """
+    if reader is not None and path in reader:
+        dims = reader.size(path)
+    else:
+        reader = None
+        dims = get_image_size(path)
+
+    factor = calc_downsample_factor(dims)
+    dims_tn = tuple(int(round(float(s) / factor)) for s in dims)
+
+    if reader is not None:
+        image = reader.thumbnail(path, dims_tn)
 
-            dims_tn = tuple(int(round(float(s) / factor)) for s in dims)
+    else:
+        with Image.open(DAO.abs(path)) as obj:
             image = obj.resize(dims_tn, Image.LANCZOS)
 
     return {"factor": factor, "image": image}
@@ -0,0 +1,190 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join, dirname
+from typing import List, Dict, Any, Pattern, Tuple, Callable, Optional
+
+from antilles.utils.io import DAO
+
+
+def file_entry(dirpath: str, name: str, stat: os.stat_result) -> Dict[str, Any]:
+    return {
+        "name": name,
+        "relpath": join(dirpath, name),
+        "mtime": stat.st_mtime_ns,
+        "size": stat.st_size,
+    }
+
+
+def is_changed(f: Dict[str, Any], stat: os.stat_result) -> bool:
+    return f["mtime"] != stat.st_mtime_ns or f["size"] != stat.st_size
+
+
+class FileIndex:
+    """
+    A snapshot of the files under a directory, built with os.scandir. Each
+    directory's listing is kept along with its modification time, and only
+    directories whose modification time has changed (i.e. files were added,
+    removed or renamed) are listed again on refresh, so a refresh costs one
+    stat per directory. Files overwritten in place leave the modification
+    time of their directory as it is, and keep their entries until then;
+    values memoized on entries are checked against their files when used.
+
+    Files are matched against filename regexes once per listing, and the
+    matches are grouped by each named group so that e.g. all regions of a
+    sample can be looked up without a scan.
+    """
+
+    def __init__(self, dirpath: str, recursive: bool = False):
+        self.dirpath = dirpath
+        self.recursive = recursive
+        self.lock = threading.RLock()
+
+        # relative directory path -> {"mtime": ..., "files": {...}, "dirs": [...]}
+        self.dirs: Dict[str, Dict[str, Any]] = {}
+        self.version = 0
+
+        # regex pattern -> (version, matched entries, groups)
+        self._matches: Dict[str, Tuple[int, List[Dict[str, Any]], Dict]] = {}
+
+    def scan(self, dirpath: str, mtime: int) -> Dict[str, Any]:
+        prev = self.dirs.get(dirpath, {"files": {}})["files"]
+        files, dirs = {}, []
+
+        with os.scandir(DAO.abs(dirpath)) as it:
+            for entry in it:
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    f = prev.get(entry.name)
+                    if f is None or is_changed(f, stat):
+                        f = file_entry(dirpath, entry.name, stat)
+                    files[entry.name] = f
+
+        return {"mtime": mtime, "files": files, "dirs": sorted(dirs)}
+
+    def refresh(self) -> None:
+        with self.lock:
+            changed = False
+            seen = set()
+
+            stack = [self.dirpath]
+            while stack:
+                dirpath = stack.pop()
+                try:
+                    mtime = DAO.stat(dirpath).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+
+                seen.add(dirpath)
+                record = self.dirs.get(dirpath)
+                if record is None or record["mtime"] != mtime:
+                    self.dirs[dirpath] = self.scan(dirpath, mtime)
+                    changed = True
+
+                if self.recursive:
+                    stack.extend(join(dirpath, d) for d in self.dirs[dirpath]["dirs"])
+
+            for dirpath in list(self.dirs.keys()):
+                if dirpath not in seen:
+                    del self.dirs[dirpath]
+                    changed = True
+
+            if changed:
+                self.version += 1
+
+    def files(self) -> List[Dict[str, Any]]:
+        self.refresh()
+        with self.lock:
+            return [
+                f
+                for dirpath in sorted(self.dirs.keys())
+                for _, f in sorted(self.dirs[dirpath]["files"].items())
+            ]
+
+    def _match(self, regex: Pattern) -> Tuple[List[Dict[str, Any]], Dict]:
+        files = self.files()
+
+        with self.lock:
+            cached = self._matches.get(regex.pattern)
+            if cached is not None and cached[0] == self.version:
+                return cached[1], cached[2]
+
+            matches = []
+            groups: Dict[str, Dict[str, List[Dict[str, Any]]]] = {
+                g: {} for g in regex.groupindex.keys()
+            }
+            for f in files:
+                match = regex.fullmatch(f["name"])
+                if match:
+                    entry = {"fields": match.groupdict(), "file": f}
+                    matches.append(entry)
+                    for g, value in entry["fields"].items():
+                        groups[g].setdefault(value, []).append(entry)
+
+            self._matches[regex.pattern] = self.version, matches, groups
+            return matches, groups
+
+    def match(self, regex: Pattern) -> List[Dict[str, Any]]:
+        """
+        Files whose names fully match the regex, as {"fields": groupdict,
+        "file": {...}} entries. Entries are shared; do not modify them.
+        """
+        matches, _ = self._match(regex)
+        return matches
+
+    def find(self, regex: Pattern, **fields) -> List[Dict[str, Any]]:
+        """
+        Matching files with the given named-group values, e.g.
+        find(regex, sample="SMP1", level=1).
+        """
+        matches, groups = self._match(regex)
+        if not fields:
+            return matches
+
+        candidates = []
+        for g, value in fields.items():
+            candidates.append(groups.get(g, {}).get(str(value), []))
+        candidates.sort(key=len)
+
+        found = candidates[0]
+        for g, value in fields.items():
+            found = [e for e in found if e["fields"][g] == str(value)]
+        return found
+
+    def memoize(
+        self,
+        files: List[Dict[str, Any]],
+        key: str,
+        func: Callable[[str], Any],
+        max_workers: Optional[int] = None,
+    ) -> List[Any]:
+        """
+        func(relpath) for each of the given files, computed in a thread pool
+        and stored on the file entries under `key`. Entries with a stored value
+        are stat'ed first, and those of files that have changed since, e.g.
+        overwritten in place, are updated and lose their stored values.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            stored = [f for f in files if key in f]
+            list(pool.map(self.validate, stored))
+
+            missing = [f for f in files if key not in f]
+            values = list(pool.map(func, (f["relpath"] for f in missing)))
+            for f, value in zip(missing, values):
+                f[key] = value
+
+        return [f[key] for f in files]
+
+    def validate(self, f: Dict[str, Any]) -> None:
+        # a file entry, and the values memoized on it, as of its file now
+        try:
+            stat = DAO.stat(f["relpath"])
+        except FileNotFoundError:
+            return  # its directory has changed, so the entry goes on refresh
+        if is_changed(f, stat):
+            with self.lock:
+                entry = file_entry(dirname(f["relpath"]), f["name"], stat)
+                f.clear()
+                f.update(entry)
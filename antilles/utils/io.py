@@ -1,25 +1,133 @@
 import json
 import os
 import shutil
-from typing import List
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Iterator, Iterable
 
 import pandas
+import pyarrow
+import pyarrow.parquet
 
-CONFIG = "../config.json"
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
+# config.json at the root of the repository, whatever the working directory
+CONFIG = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "config.json",
+)
 
-def get_basepath() -> str:
-    with open(CONFIG) as file:
-        return json.load(file)["basepath"]
+# environment variables take precedence over config.json
+ENVIRONMENT = {
+    "basepath": "ANTILLES_BASEPATH",
+    "sample_prefix": "ANTILLES_SAMPLE_PREFIX",
+}
+DEFAULTS = {"sample_prefix": "SMP"}
+
+
+class Config:
+    def __init__(self, settings: Dict[str, Any]):
+        """
+        Settings for the current run: the basepath containing the projects on
+        this computer, the sample prefix, and anything else in config.json.
+        """
+        self.settings = settings
+
+    @property
+    def basepath(self) -> str:
+        try:
+            return self.settings["basepath"]
+        except KeyError:
+            raise RuntimeError(
+                "Basepath not set! Specify it in config.json, or set "
+                f"{ENVIRONMENT['basepath']}."
+            )
+
+    @property
+    def sample_prefix(self) -> str:
+        return self.settings["sample_prefix"]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.settings.get(key, default)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.settings)
+
+
+def load_config(path: str = None, **overrides) -> Config:
+    """
+    Reads config.json from `path`, $ANTILLES_CONFIG or the root of the
+    repository, in that order; environment variables and then explicit
+    overrides replace its values.
+    """
+    path = path or os.environ.get("ANTILLES_CONFIG", CONFIG)
+
+    settings = dict(DEFAULTS)
+    if os.path.isfile(path):
+        with open(path) as file:
+            settings.update(json.load(file))
+
+    for key, var in ENVIRONMENT.items():
+        if var in os.environ.keys():
+            settings[key] = os.environ[var]
+
+    settings.update({k: v for k, v in overrides.items() if v is not None})
+    return Config(settings)
 
 
-BASEPATH = get_basepath()
+_config: Optional[Config] = None
+
+
+def configure(path: str = None, **overrides) -> Config:
+    global _config
+    _config = load_config(path, **overrides)
+    return _config
+
+
+def get_config() -> Config:
+    # loaded once, on first use rather than on import
+    if _config is None:
+        configure()
+    return _config
+
+
+def init_worker(settings: Dict[str, Any]) -> None:
+    """
+    Initializer for process pools, e.g.
+    ProcessPoolExecutor(initializer=init_worker, initargs=(config.to_dict(),)),
+    so that workers use the parent's settings whatever their working directory.
+    """
+    global _config
+    _config = Config(settings)
+
+
+def get_basepath() -> str:
+    return get_config().basepath
 
 
 def get_sample_prefix() -> str:
-    default_sample_prefix = "SMP"
-    with open(CONFIG) as file:
-        return json.load(file).get("sample_prefix", default_sample_prefix)
+    return get_config().sample_prefix
+
+
+_locks_held = threading.local()
+
+
+def try_lock(file) -> bool:
+    # takes the lock on an open file if it is free, without waiting
+    try:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
 
 
 class DAO:
@@ -34,11 +142,64 @@ class DAO:
 
     @staticmethod
     def abs(path: str) -> str:
-        return os.path.join(BASEPATH, path)
+        if os.path.isabs(path):
+            return path
+        return os.path.join(get_basepath(), path)
 
     @staticmethod
     def rel(path: str) -> str:
-        return os.path.relpath(path, BASEPATH)
+        return os.path.relpath(path, get_basepath())
+
+    @staticmethod
+    @contextmanager
+    def atomic(path: str) -> Iterator[str]:
+        """
+        Yields a temporary path next to `path`, which replaces `path` once the
+        block exits without error. Readers, including those in other processes,
+        see either the old file or the new one, never a half-written one.
+        """
+        abspath = DAO.abs(path)
+        tmppath = f"{abspath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            yield tmppath
+            os.replace(tmppath, abspath)
+        finally:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+
+    @staticmethod
+    @contextmanager
+    def lock(path: str, timeout: float = 600.0) -> Iterator[None]:
+        """
+        Exclusive advisory lock on `path`, held through a `.lock` file next to
+        it. Only writers that also take the lock are kept out. Raises
+        TimeoutError if the lock is not free within `timeout` seconds.
+        """
+        lockpath = DAO.abs(path) + ".lock"
+
+        # re-entrant within a thread; flock would block on a second descriptor
+        held = _locks_held.__dict__.setdefault("paths", set())
+        if lockpath in held:
+            yield
+            return
+
+        with open(lockpath, "a+") as file:
+            deadline = time.monotonic() + timeout
+            while not try_lock(file):
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Timed out waiting for lock on {path}!")
+                time.sleep(0.05)
+
+            held.add(lockpath)
+            try:
+                yield
+            finally:
+                held.discard(lockpath)
+                if fcntl is not None:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+                else:
+                    file.seek(0)
+                    msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
 
     @staticmethod
     def read_csv(path: str) -> pandas.DataFrame:
@@ -46,7 +207,74 @@ class DAO:
 
     @staticmethod
     def to_csv(df: pandas.DataFrame, path: str) -> None:
-        df.to_csv(DAO.abs(path), index=False)
+        with DAO.atomic(path) as tmppath:
+            df.to_csv(tmppath, index=False)
+
+    @staticmethod
+    def read_csv_header(path: str) -> List[str]:
+        return list(pandas.read_csv(DAO.abs(path), nrows=0).columns)
+
+    @staticmethod
+    def read_csv_chunks(
+        path: str, chunksize: int, columns: List[str] = None
+    ) -> Iterator[pandas.DataFrame]:
+        with pandas.read_csv(
+            DAO.abs(path), usecols=columns, chunksize=chunksize
+        ) as reader:
+            yield from reader
+
+    @staticmethod
+    def to_csv_chunks(chunks: Iterable[pandas.DataFrame], path: str) -> None:
+        with DAO.atomic(path) as tmppath:
+            with open(tmppath, "w", newline="") as file:
+                for i, df in enumerate(chunks):
+                    df.to_csv(file, header=i == 0, index=False)
+
+    @staticmethod
+    def read_parquet(path: str) -> pandas.DataFrame:
+        return pandas.read_parquet(DAO.abs(path))
+
+    @staticmethod
+    def to_parquet(df: pandas.DataFrame, path: str) -> None:
+        with DAO.atomic(path) as tmppath:
+            df.to_parquet(tmppath, index=False)
+
+    @staticmethod
+    def read_parquet_chunks(
+        path: str, chunksize: int, columns: List[str] = None
+    ) -> Iterator[pandas.DataFrame]:
+        file = pyarrow.parquet.ParquetFile(DAO.abs(path))
+        for batch in file.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+
+    @staticmethod
+    def to_parquet_chunks(chunks: Iterable[pandas.DataFrame], path: str) -> None:
+        with DAO.atomic(path) as tmppath:
+            writer = None
+            try:
+                for df in chunks:
+                    table = pyarrow.Table.from_pandas(df, preserve_index=False)
+                    if writer is None:
+                        writer = pyarrow.parquet.ParquetWriter(tmppath, table.schema)
+                    writer.write_table(table.cast(writer.schema))
+            finally:
+                if writer is not None:
+                    writer.close()
+
+    @staticmethod
+    def read_json(path: str) -> Dict[str, Any]:
+        with open(DAO.abs(path)) as file:
+            return json.load(file)
+
+    @staticmethod
+    def to_json(obj: Dict[str, Any], path: str) -> None:
+        with DAO.atomic(path) as tmppath:
+            with open(tmppath, "w") as file:
+                json.dump(obj, file, indent=2)
+
+    @staticmethod
+    def stat(path: str) -> os.stat_result:
+        return os.stat(DAO.abs(path))
 
     @staticmethod
     def list_folders(path: str) -> List[str]:
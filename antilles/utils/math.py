@@ -3,6 +3,8 @@ from typing import Tuple, Iterator
 
 import numpy
 
+BOW_SPAN: float = 90.0  # degrees, of the arc drawn around the well
+
 
 def cart2pol(x: float, y: float, in_deg: bool = True) -> Tuple[float, float]:
     r = math.sqrt(pow(x, 2) + pow(y, 2))
@@ -46,3 +48,42 @@ def init_arrow_coords(dims: Tuple[int, int], n: int) -> Iterator[Tuple[int, int]
     xx, yy = (int(round(x)) for x in xx), (int(round(y)) for y in yy)
 
     return zip(xx, yy)
+
+
+def polar_grid(
+    origin: Tuple[int, int],
+    size: Tuple[int, int],
+    center: Tuple[float, float],
+    angle: float,
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Distance from `center` and angle from the direction `angle`, in degrees
+    within [-180, 180), of every pixel in the window at `origin` of `size`.
+    Angles increase clockwise, as image rows go down.
+    """
+    (x0, y0), (w, h) = origin, size
+    dy, dx = numpy.ogrid[y0 : y0 + h, x0 : x0 + w]
+    dx = dx.astype(numpy.float32) - numpy.float32(center[0])
+    dy = dy.astype(numpy.float32) - numpy.float32(center[1])
+
+    rho = numpy.hypot(dx, dy)
+    theta = numpy.degrees(numpy.arctan2(dy, dx))
+    theta = (theta - numpy.float32(angle) + 180) % 360 - 180
+    return rho, theta
+
+
+def distance_range(
+    origin: Tuple[int, int], size: Tuple[int, int], center: Tuple[float, float]
+) -> Tuple[float, float]:
+    """
+    The nearest and farthest distances from `center` to the window at `origin`
+    of `size`.
+    """
+    (x0, y0), (w, h) = origin, size
+    cx, cy = center
+
+    nx = min(max(cx, x0), x0 + w - 1)
+    ny = min(max(cy, y0), y0 + h - 1)
+    fx = max(abs(cx - x0), abs(cx - (x0 + w - 1)))
+    fy = max(abs(cy - y0), abs(cy - (y0 + h - 1)))
+    return math.hypot(cx - nx, cy - ny), math.hypot(fx, fy)
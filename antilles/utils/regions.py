@@ -0,0 +1,168 @@
+import logging
+import math
+import threading
+from collections import OrderedDict
+from os.path import dirname
+from typing import List, Dict, Any, Optional, Tuple, Iterator
+
+import numpy
+import pandas
+from PIL import Image
+
+from antilles.utils.io import DAO
+from antilles.utils.slides import get_slide_info, get_best_level, get_image_size
+from antilles.utils.tiles import read_region
+
+log = logging.getLogger(__name__)
+
+
+class RegionReader:
+    """
+    Pixels of virtual regions, read on demand from their source slides rather
+    than from extracted tifs. The manifest holds one row per region: its
+    relpath (the tif it stands in for), the source slide and pyramid level, and
+    the origin and size of the crop in level 0 pixels. Pixels come from the
+    process-wide tile cache, so overlapping regions decode shared tiles once.
+    """
+
+    def __init__(self, manifest: pandas.DataFrame):
+        self.manifest = manifest.set_index("relpath", drop=False)
+
+    def __contains__(self, relpath: str) -> bool:
+        return relpath in self.manifest.index
+
+    def names(self) -> List[str]:
+        return list(self.manifest["relpath"])
+
+    def region(self, relpath: str) -> Dict[str, Any]:
+        return self.manifest.loc[relpath].to_dict()
+
+    def size(self, relpath: str) -> Tuple[int, int]:
+        region = self.region(relpath)
+        return int(region["width"]), int(region["height"])
+
+    def read(
+        self,
+        relpath: str,
+        x: int = 0,
+        y: int = 0,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+    ) -> numpy.ndarray:
+        """
+        The window of a region with its upper left corner at (x, y), or the
+        whole region, as an RGB array.
+        """
+        region = self.region(relpath)
+        rw, rh = int(region["width"]), int(region["height"])
+
+        width = rw - x if width is None else width
+        height = rh - y if height is None else height
+        if x < 0 or y < 0 or x + width > rw or y + height > rh:
+            raise ValueError(
+                f"Window ({x}, {y}, {width}, {height}) is outside region "
+                f"{relpath} of size ({rw}, {rh})!"
+            )
+
+        origin = int(region["origin_x"]) + x, int(region["origin_y"]) + y
+        return read_region(region["src"], origin, int(region["level"]), (width, height))
+
+    def tiles(
+        self, relpath: str, tile_size: Tuple[int, int] = (1024, 1024)
+    ) -> Iterator[Tuple[Tuple[int, int], numpy.ndarray]]:
+        """
+        ((x, y), array) for each tile of a region, in row-major order. Tiles on
+        the right and bottom edges are cropped to the region.
+        """
+        rw, rh = self.size(relpath)
+        tw, th = tile_size
+        for y in range(0, rh, th):
+            for x in range(0, rw, tw):
+                width, height = min(tw, rw - x), min(th, rh - y)
+                yield (x, y), self.read(relpath, x, y, width, height)
+
+    def thumbnail(self, relpath: str, size: Tuple[int, int]) -> Image.Image:
+        """
+        A region downsampled to `size`, read from the coarsest pyramid level
+        that still has enough pixels.
+        """
+        region = self.region(relpath)
+        rw, rh = int(region["width"]), int(region["height"])
+        factor = max(rw / size[0], rh / size[1])
+
+        info = get_slide_info(region["src"])
+        level = get_best_level(info, factor)
+        downsample = info["level_downsamples"][level]
+        dims = (
+            max(int(math.ceil(rw / downsample)), 1),
+            max(int(math.ceil(rh / downsample)), 1),
+        )
+        origin = int(region["origin_x"]), int(region["origin_y"])
+        image = read_region(region["src"], origin, level, dims)
+
+        return Image.fromarray(image).resize(size, Image.LANCZOS)
+
+    def export(self, names: Optional[List[str]] = None) -> List[str]:
+        """
+        Writes regions as tifs at their relpaths, for tools that need one image
+        per file.
+        """
+        names = self.names() if names is None else names
+        for name in names:
+            DAO.make_dir(dirname(name))
+            with DAO.atomic(name) as tmppath:
+                Image.fromarray(self.read(name)).save(tmppath, format="TIFF")
+
+        log.info(f"Exported {len(names)} virtual regions")
+        return names
+
+
+class FileReader:
+    """
+    Pixels of regions extracted as image files, with the same interface as
+    RegionReader. The most recently read files are kept decoded, since regions
+    are usually read a window at a time.
+    """
+
+    def __init__(self, n_cached: int = 4):
+        self.n_cached = n_cached
+        self.lock = threading.Lock()
+        self.images: "OrderedDict[str, numpy.ndarray]" = OrderedDict()
+
+    def image(self, relpath: str) -> numpy.ndarray:
+        with self.lock:
+            if relpath in self.images.keys():
+                self.images.move_to_end(relpath)
+                return self.images[relpath]
+
+        with Image.open(DAO.abs(relpath)) as obj:
+            image = numpy.asarray(obj.convert("RGB"))
+
+        with self.lock:
+            self.images[relpath] = image
+            while len(self.images) > self.n_cached:
+                self.images.popitem(last=False)
+        return image
+
+    def size(self, relpath: str) -> Tuple[int, int]:
+        return get_image_size(relpath)
+
+    def read(
+        self,
+        relpath: str,
+        x: int = 0,
+        y: int = 0,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+    ) -> numpy.ndarray:
+        image = self.image(relpath)
+        rh, rw = image.shape[:2]
+
+        width = rw - x if width is None else width
+        height = rh - y if height is None else height
+        if x < 0 or y < 0 or x + width > rw or y + height > rh:
+            raise ValueError(
+                f"Window ({x}, {y}, {width}, {height}) is outside region "
+                f"{relpath} of size ({rw}, {rh})!"
+            )
+        return image[y : y + height, x : x + width]
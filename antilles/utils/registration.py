@@ -0,0 +1,130 @@
+from typing import Tuple, Dict, Any
+
+import numpy
+from scipy import ndimage
+from skimage.color import rgb2hsv
+from skimage.filters import difference_of_gaussians, window
+from skimage.registration import phase_cross_correlation
+from skimage.transform import warp_polar
+
+
+def to_signal(image: numpy.ndarray) -> numpy.ndarray:
+    # saturation, which tells tissue from glass whatever the stain of a panel
+    return rgb2hsv(image)[:, :, 1].astype(numpy.float64)
+
+
+def pad_to(image: numpy.ndarray, shape: Tuple[int, int]) -> numpy.ndarray:
+    out = numpy.zeros(shape, dtype=image.dtype)
+    h, w = min(image.shape[0], shape[0]), min(image.shape[1], shape[1])
+    out[:h, :w] = image[:h, :w]
+    return out
+
+
+def rotation_about(angle: float, center: Tuple[float, float]) -> numpy.ndarray:
+    # 3 x 3 matrix rotating (x, y) by `angle` degrees about `center`
+    a = numpy.radians(angle)
+    cx, cy = center
+    cos, sin = numpy.cos(a), numpy.sin(a)
+    return numpy.array(
+        [
+            [cos, -sin, cx - cos * cx + sin * cy],
+            [sin, cos, cy - sin * cx - cos * cy],
+            [0.0, 0.0, 1.0],
+        ]
+    )
+
+
+def translation(x: float, y: float) -> numpy.ndarray:
+    return numpy.array([[1.0, 0.0, x], [0.0, 1.0, y], [0.0, 0.0, 1.0]])
+
+
+def transform(
+    image: numpy.ndarray, matrix: numpy.ndarray, cval: float = 0.0
+) -> numpy.ndarray:
+    """
+    `image` resampled onto the grid of another image, given the matrix taking
+    (x, y) of that grid to (x, y) of `image`.
+    """
+    # ndimage works in (row, column)
+    swap = numpy.array([[0.0, 1.0, 0.0], [1.0, 0.0, 0.0], [0.0, 0.0, 1.0]])
+    m = swap @ matrix @ swap
+    return ndimage.affine_transform(
+        image, m[:2, :2], offset=m[:2, 2], order=1, cval=cval
+    )
+
+
+def estimate_rotation(
+    reference: numpy.ndarray, moving: numpy.ndarray, upsample: int = 10
+) -> float:
+    """
+    The rotation of `moving` from `reference`, in degrees clockwise in [0, 180),
+    from the log-polar magnitudes of their spectra, which do not change with
+    translation. Spectra cannot tell a half turn apart; see estimate_transform.
+    """
+    hann = window("hann", reference.shape)
+    spectra = []
+    for image in (reference, moving):
+        filtered = difference_of_gaussians(image, 1, 8) * hann
+        spectra.append(numpy.abs(numpy.fft.fftshift(numpy.fft.fft2(filtered))))
+
+    radius = min(reference.shape) // 2
+    polar = [
+        warp_polar(s, radius=radius, output_shape=(360, radius), scaling="log")
+        for s in spectra
+    ]
+    # spectra of real images are symmetric, so half the angles are enough
+    shift, _, _ = phase_cross_correlation(
+        polar[0][:180], polar[1][:180], upsample_factor=upsample, normalization=None
+    )
+    return float(-shift[0]) % 180
+
+
+def correlation(
+    reference: numpy.ndarray, moving: numpy.ndarray, overlap: numpy.ndarray
+) -> float:
+    # Pearson correlation of the images where they overlap
+    if overlap.sum() < 2:
+        return 0.0
+    a, b = reference[overlap], moving[overlap]
+    if a.std() == 0 or b.std() == 0:
+        return 0.0
+    return float(numpy.corrcoef(a, b)[0, 1])
+
+
+def estimate_transform(
+    reference: numpy.ndarray, moving: numpy.ndarray, params: Dict[str, Any]
+) -> Tuple[numpy.ndarray, float]:
+    """
+    The rigid transform of grayscale `moving` onto `reference`, as the 3 x 3
+    matrix taking (x, y) of `reference` to (x, y) of `moving`, and the
+    correlation of the two images once aligned, as a measure of its quality.
+    The rotation is found first, up to a half turn, then the translation by
+    phase correlation, for both ways the rotation could go; the better
+    aligned is kept.
+    """
+    shape = tuple(max(a, b) for a, b in zip(reference.shape, moving.shape))
+    reference, moving = pad_to(reference, shape), pad_to(moving, shape)
+    center = (shape[1] - 1) / 2, (shape[0] - 1) / 2
+
+    angles = [0.0]
+    if params["rotation"]:
+        angle = estimate_rotation(reference, moving, params["upsample"])
+        angles = [angle, angle - 180]
+
+    best = numpy.eye(3), -1.0
+    for angle in angles:
+        rotation = rotation_about(angle, center)
+        rotated = transform(moving, rotation)
+        shift, _, _ = phase_cross_correlation(
+            reference, rotated, upsample_factor=params["upsample"]
+        )
+        # reference(p) is rotated(p - shift)
+        matrix = rotation @ translation(-shift[1], -shift[0])
+
+        aligned = transform(moving, matrix)
+        overlap = transform(numpy.ones(shape), matrix) > 0.5
+        quality = correlation(reference, aligned, overlap)
+        if quality > best[1]:
+            best = matrix, quality
+
+    return best
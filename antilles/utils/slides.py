@@ -0,0 +1,358 @@
+import hashlib
+import logging
+import os
+import struct
+import threading
+import warnings
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing.util import Finalize
+from os.path import join, normpath
+from typing import Dict, Any, Tuple, Optional, Iterator, List, ContextManager
+
+import numpy
+import openslide
+from PIL import Image
+
+from antilles.utils.io import DAO, get_config
+
+log = logging.getLogger(__name__)
+
+
+def get_mpp_from_openslide(obj) -> float:
+    mpp_x = float(obj.properties[openslide.PROPERTY_NAME_MPP_X])
+    mpp_y = float(obj.properties[openslide.PROPERTY_NAME_MPP_Y])
+
+    if not numpy.equal(mpp_x, mpp_y):
+        warnings.warn(
+            "MPP values are not equal in x and y directions! "
+            "x: {x}, y: {y}".format(x=mpp_x, y=mpp_y)
+        )
+        mpp = numpy.average((mpp_x, mpp_y))
+
+    else:
+        mpp = mpp_x
+
+    return mpp
+
+
+class SlidePool:
+    """
+    Open slide handles shared by the whole process, keyed by absolute path, so
+    that slides are not reopened for every read and OpenSlide's tile cache
+    survives between them. A handle is checked out by one thread at a time; a
+    thread that finds no idle handle for a slide opens another. Idle handles
+    are closed, least recently used first, once more than `max_handles` are
+    open. All handles share one tile cache of `cache_size` bytes, if set.
+    """
+
+    def __init__(self, max_handles: int = 8, cache_size: Optional[int] = None):
+        self.max_handles = max_handles
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+
+        # path -> idle handles, least recently used path first
+        self.idle: "OrderedDict[str, List[openslide.OpenSlide]]" = OrderedDict()
+        self.n_open = 0
+        self._cache = None
+
+    def open(self, path: str) -> openslide.OpenSlide:
+        obj = openslide.OpenSlide(path)
+        # shared caches need OpenSlide 4 and openslide-python 1.3
+        if self.cache_size is not None and hasattr(openslide, "OpenSlideCache"):
+            with self.lock:
+                if self._cache is None:
+                    self._cache = openslide.OpenSlideCache(self.cache_size)
+            obj.set_cache(self._cache)
+        return obj
+
+    @contextmanager
+    def checkout(self, relpath: str) -> Iterator[openslide.OpenSlide]:
+        path = DAO.abs(relpath)
+
+        with self.lock:
+            handles = self.idle.get(path)
+            obj = handles.pop() if handles else None
+            if handles is not None and not handles:
+                del self.idle[path]
+            if obj is None:
+                self.n_open += 1
+
+        if obj is None:
+            try:
+                obj = self.open(path)
+            except BaseException:
+                with self.lock:
+                    self.n_open -= 1
+                raise
+
+        try:
+            yield obj
+        finally:
+            with self.lock:
+                self.idle.setdefault(path, []).append(obj)
+                self.idle.move_to_end(path)
+                self.evict()
+
+    def evict(self) -> None:
+        # handles in use are never closed; the pool shrinks as they come back
+        while self.n_open > self.max_handles and self.idle:
+            path, handles = next(iter(self.idle.items()))
+            handles.pop(0).close()
+            self.n_open -= 1
+            if not handles:
+                del self.idle[path]
+
+    def clear(self) -> None:
+        with self.lock:
+            for handles in self.idle.values():
+                for obj in handles:
+                    obj.close()
+                    self.n_open -= 1
+            self.idle.clear()
+
+
+_pool: Optional[SlidePool] = None
+_pool_lock = threading.Lock()
+
+
+def get_slide_pool() -> SlidePool:
+    """
+    The process-wide pool, configured by the optional `slide_pool` key of
+    config.json, e.g. {"max_handles": 8, "cache_size": 268435456}.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SlidePool(**get_config().get("slide_pool", {}))
+        return _pool
+
+
+def _reset_pool() -> None:
+    # a forked child must not share the parent's file descriptors and caches
+    global _pool
+    _pool = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_pool)
+
+
+def open_slide(relpath: str) -> ContextManager[openslide.OpenSlide]:
+    """
+    A slide handle checked out of the process-wide pool for the calling
+    thread. Do not close it.
+    """
+    return get_slide_pool().checkout(relpath)
+
+
+def get_fingerprint(path: str, size: int) -> str:
+    """
+    A cheap content hash: the file size and its first and last 64 KiB. Enough to
+    tell slides apart (and to notice a slide being replaced) without reading
+    gigabytes of pixel data.
+    """
+    chunk = 64 * 1024
+
+    h = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(DAO.abs(path), "rb") as file:
+        h.update(file.read(chunk))
+        if size > chunk:
+            file.seek(max(size - chunk, chunk))
+            h.update(file.read(chunk))
+    return h.hexdigest()
+
+
+def probe(path: str) -> Dict[str, Any]:
+    try:
+        with open_slide(path) as obj:
+            try:
+                mpp = float(get_mpp_from_openslide(obj))
+            except KeyError:
+                mpp = None
+
+            return {
+                "openslide": True,
+                "dims": list(obj.dimensions),
+                "level_dimensions": [list(d) for d in obj.level_dimensions],
+                "level_downsamples": list(obj.level_downsamples),
+                "mpp": mpp,
+            }
+
+    except openslide.lowlevel.OpenSlideUnsupportedFormatError:
+        with Image.open(DAO.abs(path)) as obj:
+            dims = list(obj.size)
+
+        return {
+            "openslide": False,
+            "dims": dims,
+            "level_dimensions": [dims],
+            "level_downsamples": [1.0],
+            "mpp": None,
+        }
+
+
+class SlideCatalog:
+    """
+    Dimensions, pyramid levels and MPP of every slide in a project, stored in
+    the project directory so that slides only need to be opened once. An entry
+    is refreshed when the modification time or size of its slide changes.
+
+    Slides are probed outside the lock, so threads probe different slides at
+    once. New entries are written in batches, and at exit of the process,
+    including worker processes; each write is merged with what other processes
+    have written since, under the file lock.
+    """
+
+    filename = "slide_catalog.json"
+    batch_size = 64  # new entries written at once
+
+    def __init__(self, project: str):
+        self.path = join(project, self.filename)
+        self.lock = threading.Lock()
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+        self.pending: Dict[str, Dict[str, Any]] = {}
+
+        # run at exit by multiprocessing, in the main process and in workers
+        Finalize(self, self.flush, exitpriority=10)
+
+    @property
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+        if self._entries is None:
+            if DAO.is_file(self.path):
+                self._entries = DAO.read_json(self.path)
+            else:
+                self._entries = {}
+        return self._entries
+
+    def get(self, relpath: str) -> Dict[str, Any]:
+        stat = DAO.stat(relpath)
+
+        with self.lock:
+            entry = self.entries.get(relpath)
+            if (
+                entry is not None
+                and entry["mtime"] == stat.st_mtime
+                and entry["size"] == stat.st_size
+            ):
+                return entry
+
+        log.debug(f"Adding {relpath} to slide catalog")
+        entry = {
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "fingerprint": get_fingerprint(relpath, stat.st_size),
+            **probe(relpath),
+        }
+
+        with self.lock:
+            self.entries[relpath] = entry
+            self.pending[relpath] = entry
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.flush()
+        return entry
+
+    def flush(self) -> None:
+        """
+        Writes the entries added since the last flush, keeping those that other
+        processes have written since.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+
+        with DAO.lock(self.path):
+            stored = DAO.read_json(self.path) if DAO.is_file(self.path) else {}
+            stored.update(pending)
+            DAO.to_json(stored, self.path)
+
+        with self.lock:
+            for relpath, entry in stored.items():
+                self.entries.setdefault(relpath, entry)
+
+
+catalogs: Dict[str, SlideCatalog] = {}
+catalogs_lock = threading.Lock()
+
+
+def get_catalog(relpath: str) -> SlideCatalog:
+    # relative paths always start with the project directory
+    project = normpath(relpath).split(os.sep)[0]
+
+    with catalogs_lock:
+        if project not in catalogs.keys():
+            catalogs[project] = SlideCatalog(project)
+        return catalogs[project]
+
+
+def get_slide_info(relpath: str) -> Dict[str, Any]:
+    return get_catalog(relpath).get(relpath)
+
+
+def read_tiff_size(file) -> Optional[Tuple[int, int]]:
+    """
+    Width and height from the first IFD of a (Big)TIFF file, reading only the
+    few hundred bytes of the header. Returns None if the file is not a TIFF.
+    """
+    header = file.read(16)
+    if header[:2] == b"II":
+        order = "<"
+    elif header[:2] == b"MM":
+        order = ">"
+    else:
+        return None
+
+    (magic,) = struct.unpack(order + "H", header[2:4])
+    if magic == 42:
+        (offset,) = struct.unpack(order + "I", header[4:8])
+        count_fmt, tag_fmt, tag_size = "H", "HHI4s", 12
+    elif magic == 43:
+        (offset,) = struct.unpack(order + "Q", header[8:16])
+        count_fmt, tag_fmt, tag_size = "Q", "HHQ8s", 20
+    else:
+        return None
+
+    file.seek(offset)
+    count_size = struct.calcsize(count_fmt)
+    (n_tags,) = struct.unpack(order + count_fmt, file.read(count_size))
+    tags = file.read(n_tags * tag_size)
+
+    # tag types: 3 = SHORT, 4 = LONG, 16 = LONG8
+    type_fmt = {3: "H", 4: "I", 16: "Q"}
+    size = {}
+    for i in range(n_tags):
+        tag, type_, _, value = struct.unpack_from(order + tag_fmt, tags, i * tag_size)
+        if tag in (256, 257) and type_ in type_fmt.keys():
+            fmt = order + type_fmt[type_]
+            size[tag] = struct.unpack_from(fmt, value)[0]
+
+    if 256 not in size.keys() or 257 not in size.keys():
+        return None
+    return size[256], size[257]
+
+
+def get_image_size(relpath: str) -> Tuple[int, int]:
+    with open(DAO.abs(relpath), "rb") as file:
+        try:
+            size = read_tiff_size(file)
+        except struct.error:
+            size = None
+
+    if size is None:
+        # PIL only parses the header until pixel data is requested
+        with Image.open(DAO.abs(relpath)) as obj:
+            size = obj.size
+    return size
+
+
+def get_slide_dims(relpath: str) -> Tuple[int, int]:
+    return tuple(get_slide_info(relpath)["dims"])
+
+
+def get_best_level(info: Dict[str, Any], downsample: float) -> int:
+    # as OpenSlide.get_best_level_for_downsample: the most downsampled level
+    # that is not coarser than asked for
+    levels = [i for i, d in enumerate(info["level_downsamples"]) if d <= downsample]
+    return levels[-1] if levels else 0
@@ -0,0 +1,201 @@
+from typing import List, Optional, Sequence
+
+import numpy
+import pandas
+
+from antilles.utils.io import DAO
+
+
+def to_bow_coords(
+    objects: pandas.DataFrame, regions: pandas.DataFrame
+) -> pandas.DataFrame:
+    """
+    Distance in microns from the well, and angle in degrees from the direction
+    of the bow in [-180, 180), of each object, from the bow of its region.
+    Objects of regions without a bow are dropped.
+    """
+    bows = regions.set_index("relpath")[
+        ["center_x", "center_y", "well_x", "well_y", "mpp"]
+    ].astype(numpy.float64)
+    objects = objects[objects["relpath"].isin(bows.index)]
+    bow = bows.loc[objects["relpath"]].to_numpy()
+    cx, cy, wx, wy, mpp = bow.T
+
+    r_well = numpy.hypot(wx - cx, wy - cy)
+    direction = numpy.degrees(numpy.arctan2(wy - cy, wx - cx))
+
+    dx = objects["x"].to_numpy(numpy.float64) - cx
+    dy = objects["y"].to_numpy(numpy.float64) - cy
+    angle = numpy.degrees(numpy.arctan2(dy, dx)) - direction
+
+    return pandas.DataFrame(
+        {
+            "relpath": objects["relpath"].to_numpy(),
+            "distance": (numpy.hypot(dx, dy) - r_well) * mpp,
+            "angle": (angle + 180) % 360 - 180,
+        }
+    )
+
+
+class ObjectIndex:
+    """
+    Objects of many regions in bow coordinates, sorted by region and then by
+    distance from the well, so that the objects of a region in a band of
+    distances are one contiguous run found by binary search. Counts in bands,
+    and in sectors of them, are answered for every region at once without
+    scanning objects outside the bands.
+    """
+
+    def __init__(
+        self,
+        relpaths: Sequence[str],
+        offsets: numpy.ndarray,
+        distance: numpy.ndarray,
+        angle: numpy.ndarray,
+        version: Optional[str] = None,
+    ):
+        self.relpaths = list(relpaths)
+        self.offsets = offsets  # start of the objects of each region, and end
+        self.distance = distance
+        self.angle = angle
+        self.version = version
+
+        # distances keyed by region, so one search finds bands in every region;
+        # the stride keeps regions apart whatever the distances
+        span = float(numpy.abs(distance).max()) if len(distance) else 0.0
+        self.stride = 2.0 * span + 1.0
+        regions = numpy.repeat(numpy.arange(len(self.relpaths)), numpy.diff(offsets))
+        self.keys = regions * self.stride + distance
+
+    def __len__(self) -> int:
+        return len(self.distance)
+
+    @classmethod
+    def build(
+        cls,
+        objects: pandas.DataFrame,
+        regions: pandas.DataFrame,
+        version: Optional[str] = None,
+    ) -> "ObjectIndex":
+        coords = to_bow_coords(objects, regions)
+        relpaths = list(regions["relpath"])
+
+        codes = pandas.Categorical(coords["relpath"], categories=relpaths).codes
+        order = numpy.lexsort((coords["distance"].to_numpy(), codes))
+        offsets = numpy.zeros(len(relpaths) + 1, dtype=numpy.int64)
+        offsets[1:] = numpy.cumsum(numpy.bincount(codes, minlength=len(relpaths)))
+
+        return cls(
+            relpaths,
+            offsets,
+            coords["distance"].to_numpy(numpy.float64)[order],
+            coords["angle"].to_numpy(numpy.float32)[order],
+            version=version,
+        )
+
+    @classmethod
+    def concat(cls, indexes: List["ObjectIndex"]) -> "ObjectIndex":
+        # e.g. the indexes of every block of a project
+        starts = numpy.cumsum([0] + [len(index) for index in indexes])
+        offsets = [index.offsets[:-1] + start for index, start in zip(indexes, starts)]
+        return cls(
+            [relpath for index in indexes for relpath in index.relpaths],
+            numpy.concatenate(offsets + [starts[-1:]]),
+            numpy.concatenate([index.distance for index in indexes]),
+            numpy.concatenate([index.angle for index in indexes]),
+        )
+
+    def save(self, path: str) -> None:
+        with DAO.atomic(path) as tmppath:
+            with open(tmppath, "wb") as file:
+                numpy.savez(
+                    file,
+                    relpaths=numpy.array(self.relpaths, dtype=str),
+                    offsets=self.offsets,
+                    distance=self.distance,
+                    angle=self.angle,
+                    version=numpy.array(self.version or ""),
+                )
+
+    @classmethod
+    def load(cls, path: str) -> "ObjectIndex":
+        with numpy.load(DAO.abs(path)) as npz:
+            return cls(
+                npz["relpaths"].tolist(),
+                npz["offsets"],
+                npz["distance"],
+                npz["angle"],
+                version=str(npz["version"]) or None,
+            )
+
+    def bands(self, edges: Sequence[float]) -> numpy.ndarray:
+        """
+        (start, stop) positions of the objects of each region between each pair
+        of consecutive `edges`, in microns from the well, as an array of shape
+        (regions, len(edges)).
+        """
+        # edges beyond every object must not reach into the next region
+        edges = numpy.clip(
+            numpy.asarray(edges, dtype=numpy.float64), -self.stride / 2, self.stride / 2
+        )
+        regions = numpy.arange(len(self.relpaths))[:, numpy.newaxis]
+        return numpy.searchsorted(self.keys, regions * self.stride + edges)
+
+    def counts(
+        self, edges: Sequence[float], sectors: Optional[Sequence[float]] = None
+    ) -> numpy.ndarray:
+        """
+        Numbers of objects of each region in each band between consecutive
+        `edges`, as an array of shape (regions, bands). With `sectors`, edges
+        of angles in degrees from the bow, only objects within them are
+        counted, by sector, as an array of shape (regions, bands, sectors).
+        """
+        positions = self.bands(edges)
+        if sectors is None:
+            return numpy.diff(positions, axis=1)
+
+        edges = numpy.asarray(edges, dtype=numpy.float64)
+        sectors = numpy.asarray(sectors, dtype=numpy.float64)
+        n_regions, n_bands, n_sectors = (
+            len(self.relpaths),
+            len(edges) - 1,
+            len(sectors) - 1,
+        )
+
+        # only the objects between the first and last edges are visited
+        starts, stops = positions[:, 0], positions[:, -1]
+        lengths = stops - starts
+        regions = numpy.repeat(numpy.arange(n_regions), lengths)
+        shift = numpy.repeat(starts - (numpy.cumsum(lengths) - lengths), lengths)
+        index = numpy.arange(lengths.sum()) + shift
+
+        band = numpy.searchsorted(edges, self.distance[index], side="right") - 1
+        sector = numpy.searchsorted(sectors, self.angle[index], side="right") - 1
+        valid = (sector >= 0) & (sector < n_sectors) & (band < n_bands)
+
+        bins = (regions * n_bands + band) * n_sectors + sector
+        counts = numpy.bincount(bins[valid], minlength=n_regions * n_bands * n_sectors)
+        return counts.reshape(n_regions, n_bands, n_sectors)
+
+    def to_frame(
+        self, edges: Sequence[float], sectors: Optional[Sequence[float]] = None
+    ) -> pandas.DataFrame:
+        """
+        counts() as a long frame of relpath, band edges, sector edges and count.
+        """
+        counts = self.counts(edges, sectors)
+        if sectors is None:
+            counts = counts[:, :, numpy.newaxis]
+            sectors = [-180.0, 180.0]
+
+        r, b, s = numpy.unravel_index(numpy.arange(counts.size), counts.shape)
+        return pandas.DataFrame(
+            {
+                "relpath": numpy.array(self.relpaths, dtype=object)[r],
+                "distance_min": numpy.asarray(edges, dtype=numpy.float64)[b],
+                "distance_max": numpy.asarray(edges, dtype=numpy.float64)[b + 1],
+                "angle_min": numpy.asarray(sectors, dtype=numpy.float64)[s],
+                "angle_max": numpy.asarray(sectors, dtype=numpy.float64)[s + 1],
+                "count": counts.ravel(),
+            }
+        )
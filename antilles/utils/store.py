@@ -0,0 +1,343 @@
+import sqlite3
+from contextlib import closing, contextmanager
+from os.path import join, dirname
+from typing import List, Dict, Any, Tuple, Iterator, Optional, Callable, Iterable
+
+import pandas
+
+from antilles.utils import upsert, select
+from antilles.utils.io import DAO
+
+
+def align_keys(
+    stored: pandas.DataFrame, df: pandas.DataFrame, keys: List[str]
+) -> pandas.DataFrame:
+    """
+    `stored` with its key columns coerced to the types of those of `df`, so
+    that keys read back from text, e.g. samples named with digits only, match
+    the keys they were written from.
+    """
+    stored = stored.copy()
+    for key in keys:
+        dtype = df[key].dtype
+        if stored[key].dtype == dtype:
+            continue
+        if isinstance(dtype, pandas.CategoricalDtype):
+            # categories of their own, so stored values outside those of `df`
+            # are kept
+            stored[key] = stored[key].astype(str).astype("category")
+        elif pandas.api.types.is_numeric_dtype(dtype):
+            stored[key] = stored[key].astype(dtype)
+        else:
+            stored[key] = stored[key].astype(str).astype(dtype)
+    return stored
+
+
+class CsvStore:
+    """
+    Annotations for a block, stored as one csv file per field. This is the
+    format CellProfiler reads, so its input files are always written this way.
+    """
+
+    extension = ".csv"
+
+    def __init__(self, dirpath: str):
+        self.dirpath = dirpath
+
+    def path(self, name: str) -> str:
+        return join(self.dirpath, name + self.extension)
+
+    def exists(self, name: str) -> bool:
+        return DAO.is_file(self.path(name))
+
+    def read(self, name: str, where: Dict[str, Any] = None) -> pandas.DataFrame:
+        df = DAO.read_csv(self.path(name))
+        return df if where is None else select(df, where)
+
+    def write(self, df: pandas.DataFrame, name: str) -> None:
+        DAO.make_dir(self.dirpath)
+        DAO.to_csv(df, self.path(name))
+
+    def read_chunks(
+        self,
+        name: str,
+        chunksize: int,
+        where: Dict[str, Any] = None,
+        columns: List[str] = None,
+    ) -> Iterator[pandas.DataFrame]:
+        for df in DAO.read_csv_chunks(self.path(name), chunksize, columns=columns):
+            yield df if where is None else select(df, where)
+
+    def write_chunks(self, chunks: Iterable[pandas.DataFrame], name: str) -> None:
+        DAO.make_dir(self.dirpath)
+        DAO.to_csv_chunks(chunks, self.path(name))
+
+    def version(self, name: str) -> Optional[Tuple[int, int]]:
+        if not self.exists(name):
+            return None
+        stat = DAO.stat(self.path(name))
+        return stat.st_mtime_ns, stat.st_size
+
+    @contextmanager
+    def lock(self, name: str) -> Iterator[None]:
+        DAO.make_dir(self.dirpath)
+        with DAO.lock(self.path(name)):
+            yield
+
+    def upsert(
+        self,
+        df: pandas.DataFrame,
+        name: str,
+        keys: List[str],
+        schema: Callable[[pandas.DataFrame], pandas.DataFrame] = None,
+    ) -> None:
+        """
+        Replaces the stored rows whose keys are in `df` and adds the rest.
+        `schema` coerces the stored rows to the types of `df` before matching;
+        without it, stored keys are coerced to the types of the keys of `df`.
+        """
+        with self.lock(name):
+            if self.exists(name):
+                stored = self.read(name)
+                if schema is not None:
+                    stored = schema(stored)
+                stored = align_keys(stored, df, keys)
+                df = upsert(stored, using=df, cols=keys)
+            self.write(df, name)
+
+
+class ParquetStore(CsvStore):
+    """
+    Annotations for a block, stored as one parquet file per field. Column types
+    survive the round trip, so loading does not re-parse or re-infer anything.
+    """
+
+    extension = ".parquet"
+
+    def read(self, name: str, where: Dict[str, Any] = None) -> pandas.DataFrame:
+        df = DAO.read_parquet(self.path(name))
+        return df if where is None else select(df, where)
+
+    def write(self, df: pandas.DataFrame, name: str) -> None:
+        DAO.make_dir(self.dirpath)
+        DAO.to_parquet(df, self.path(name))
+
+    def read_chunks(
+        self,
+        name: str,
+        chunksize: int,
+        where: Dict[str, Any] = None,
+        columns: List[str] = None,
+    ) -> Iterator[pandas.DataFrame]:
+        path = self.path(name)
+        for df in DAO.read_parquet_chunks(path, chunksize, columns=columns):
+            yield df if where is None else select(df, where)
+
+    def write_chunks(self, chunks: Iterable[pandas.DataFrame], name: str) -> None:
+        DAO.make_dir(self.dirpath)
+        DAO.to_parquet_chunks(chunks, self.path(name))
+
+
+def sql_type(dtype) -> str:
+    if pandas.api.types.is_bool_dtype(dtype):
+        return "INTEGER"
+    elif pandas.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    elif pandas.api.types.is_float_dtype(dtype):
+        return "REAL"
+    else:
+        return "TEXT"
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    # take the write lock up front, so that concurrent writers queue up instead
+    # of failing when upgrading from a read lock
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+
+
+class SqliteStore:
+    """
+    Annotations for every block of a project, stored in a single SQLite
+    database with one table per field. Rows are scoped to a block by the
+    hidden `_block` column, and each table has a unique index on the field's
+    key columns so that updates are transactional upserts rather than
+    rewrites. Several processes can write to the same database; SQLite
+    serializes the transactions.
+    """
+
+    scope = "_block"
+    timeout = 60.0  # seconds to wait for another writer
+
+    def __init__(self, path: str, block: str, keys: List[str]):
+        self.path = path
+        self.block = block
+        self.keys = keys
+
+    def connect(self) -> sqlite3.Connection:
+        DAO.make_dir(dirname(self.path))
+        conn = sqlite3.connect(
+            DAO.abs(self.path), timeout=self.timeout, isolation_level=None
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def columns(self, conn: sqlite3.Connection, name: str) -> List[str]:
+        rows = conn.execute(f"PRAGMA table_info({quote(name)})").fetchall()
+        return [r[1] for r in rows]
+
+    def exists(self, name: str) -> bool:
+        if not DAO.is_file(self.path):
+            return False
+
+        with closing(self.connect()) as conn:
+            if not self.columns(conn, name):
+                return False
+            query = f"SELECT 1 FROM {quote(name)} WHERE {self.scope} = ? LIMIT 1"
+            return conn.execute(query, (self.block,)).fetchone() is not None
+
+    def create(self, conn: sqlite3.Connection, df: pandas.DataFrame, name: str):
+        existing = self.columns(conn, name)
+        if not existing:
+            cols = [f"{self.scope} TEXT NOT NULL"] + [
+                f"{quote(c)} {sql_type(df[c].dtype)}" for c in df.columns
+            ]
+            conn.execute(f"CREATE TABLE {quote(name)} ({', '.join(cols)})")
+
+            keys = ", ".join(quote(k) for k in [self.scope] + self.keys)
+            index = quote(f"ix_{name}_keys")
+            conn.execute(f"CREATE UNIQUE INDEX {index} ON {quote(name)} ({keys})")
+
+        else:
+            for c in df.columns:
+                if c not in existing:
+                    conn.execute(
+                        f"ALTER TABLE {quote(name)} "
+                        f"ADD COLUMN {quote(c)} {sql_type(df[c].dtype)}"
+                    )
+
+    def insert(self, conn: sqlite3.Connection, df: pandas.DataFrame, name: str):
+        cols = [self.scope] + list(df.columns)
+        updates = [c for c in df.columns if c not in self.keys]
+
+        query = (
+            f"INSERT INTO {quote(name)} ({', '.join(quote(c) for c in cols)}) "
+            f"VALUES ({', '.join('?' for _ in cols)}) "
+            f"ON CONFLICT ({', '.join(quote(k) for k in [self.scope] + self.keys)}) "
+        )
+        if updates:
+            query += "DO UPDATE SET " + ", ".join(
+                f"{quote(c)} = excluded.{quote(c)}" for c in updates
+            )
+        else:
+            query += "DO NOTHING"
+
+        conn.executemany(query, self.records(df))
+
+    def records(self, df: pandas.DataFrame) -> List[Tuple[Any, ...]]:
+        # sqlite3 only binds native python types
+        df = df.astype(object).where(df.notna(), None)
+        return [(self.block,) + tuple(r) for r in df.itertuples(index=False)]
+
+    def query(
+        self, name: str, where: Dict[str, Any] = None, columns: List[str] = None
+    ) -> Tuple[str, List[Any]]:
+        conditions = [f"{self.scope} = ?"]
+        params = [self.block]
+        for col, values in (where or {}).items():
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            values = list(values)
+            conditions.append(f"{quote(col)} IN ({', '.join('?' for _ in values)})")
+            params.extend(values)
+
+        selected = "*" if columns is None else ", ".join(quote(c) for c in columns)
+        query = (
+            f"SELECT {selected} FROM {quote(name)} "
+            f"WHERE {' AND '.join(conditions)} ORDER BY rowid"
+        )
+        return query, params
+
+    def read(self, name: str, where: Dict[str, Any] = None) -> pandas.DataFrame:
+        query, params = self.query(name, where)
+        with closing(self.connect()) as conn:
+            df = pandas.read_sql_query(query, conn, params=params)
+        return df.drop(columns=[self.scope])
+
+    def read_chunks(
+        self,
+        name: str,
+        chunksize: int,
+        where: Dict[str, Any] = None,
+        columns: List[str] = None,
+    ) -> Iterator[pandas.DataFrame]:
+        query, params = self.query(name, where, columns)
+        with closing(self.connect()) as conn:
+            for df in pandas.read_sql_query(
+                query, conn, params=params, chunksize=chunksize
+            ):
+                yield df.drop(columns=[self.scope], errors="ignore")
+
+    def write(self, df: pandas.DataFrame, name: str) -> None:
+        with closing(self.connect()) as conn:
+            with transaction(conn):
+                self.create(conn, df, name)
+                conn.execute(
+                    f"DELETE FROM {quote(name)} WHERE {self.scope} = ?", (self.block,)
+                )
+                self.insert(conn, df, name)
+
+    def write_chunks(self, chunks: Iterable[pandas.DataFrame], name: str) -> None:
+        with closing(self.connect()) as conn:
+            with transaction(conn):
+                for i, df in enumerate(chunks):
+                    self.create(conn, df, name)
+                    if i == 0:
+                        conn.execute(
+                            f"DELETE FROM {quote(name)} WHERE {self.scope} = ?",
+                            (self.block,),
+                        )
+                    self.insert(conn, df, name)
+
+    def version(self, name: str) -> Optional[Tuple[int, int]]:
+        # rows are merged by the database itself; see upsert
+        return None
+
+    @contextmanager
+    def lock(self, name: str) -> Iterator[None]:
+        yield
+
+    def upsert(
+        self,
+        df: pandas.DataFrame,
+        name: str,
+        keys: List[str],
+        schema: Callable[[pandas.DataFrame], pandas.DataFrame] = None,
+    ) -> None:
+        if keys != self.keys:
+            raise ValueError(f"Table {name} is keyed on {self.keys}, not {keys}!")
+
+        with closing(self.connect()) as conn:
+            with transaction(conn):
+                self.create(conn, df, name)
+                self.insert(conn, df, name)
+
+
+backends = {"csv": CsvStore, "parquet": ParquetStore}
+
+
+def get_store(backend: str, dirpath: str) -> CsvStore:
+    if backend not in backends.keys():
+        raise ValueError(f"Unknown storage backend {backend}!")
+    return backends[backend](dirpath)
@@ -0,0 +1,276 @@
+import hashlib
+import logging
+import math
+import os
+import struct
+import threading
+from collections import OrderedDict
+from multiprocessing.util import Finalize
+from typing import Dict, Any, Tuple, Optional, Hashable
+
+import numpy
+
+from antilles.utils.io import get_config
+from antilles.utils.slides import get_slide_info, open_slide
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # python < 3.8
+    resource_tracker, shared_memory = None, None
+
+log = logging.getLogger(__name__)
+
+
+class TileCache:
+    """
+    Decoded slide tiles, evicted least recently used first once they take up
+    more than `max_bytes`. Keys are (slide fingerprint, level, tile x, tile y),
+    so a slide that is moved or renamed keeps its tiles.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+        self.tiles: "OrderedDict[Hashable, numpy.ndarray]" = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[numpy.ndarray]:
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.tiles.move_to_end(key)
+            return tile
+
+    def put(self, key: Hashable, tile: numpy.ndarray) -> None:
+        tile.setflags(write=False)
+        with self.lock:
+            if key in self.tiles.keys():
+                return
+            self.tiles[key] = tile
+            self.nbytes += tile.nbytes
+
+            while self.nbytes > self.max_bytes and self.tiles:
+                _, evicted = self.tiles.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "tiles": len(self.tiles),
+                "bytes": self.nbytes,
+            }
+
+
+class SharedTileCache(TileCache):
+    """
+    A TileCache whose tiles live in named shared memory segments, so that
+    worker processes on one machine reuse each other's decodes. Each process
+    keeps its own segments under `max_bytes` and unlinks them on eviction;
+    segments of other processes are copied out when read.
+
+    Segments start with a header of the tile shape and a ready flag that is
+    set last, so a tile that is still being written reads as a miss. They are
+    unlinked at exit, by pool workers too; a process that is killed leaves its
+    segments behind.
+    """
+
+    header = struct.Struct("<IIIB")  # height, width, channels, ready
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, namespace: str = "antl"):
+        if shared_memory is None:
+            raise RuntimeError("Shared tile caches need python 3.8 or later!")
+        super().__init__(max_bytes)
+        self.namespace = namespace
+
+        # segments created by this process, least recently used first
+        self.segments: "OrderedDict[str, shared_memory.SharedMemory]" = OrderedDict()
+
+        # run at exit by multiprocessing, in the main process and in workers,
+        # which skip atexit; not in forked children, whose segments these are not
+        Finalize(self, self.clear, exitpriority=10)
+
+    def name(self, key: Hashable) -> str:
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=12).hexdigest()
+        return f"{self.namespace}_{digest}"
+
+    @staticmethod
+    def untrack(shm: "shared_memory.SharedMemory") -> "shared_memory.SharedMemory":
+        # the resource tracker unlinks segments at exit, including segments
+        # attached to rather than created, and is shared with child processes;
+        # segments are unlinked by their owner in clear() instead
+        if os.name == "posix":
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+    @staticmethod
+    def unlink(shm: "shared_memory.SharedMemory") -> None:
+        shm.close()
+        # unlink() unregisters the segment again
+        if os.name == "posix":
+            resource_tracker.register(shm._name, "shared_memory")
+        shm.unlink()
+
+    def get(self, key: Hashable) -> Optional[numpy.ndarray]:
+        name = self.name(key)
+        try:
+            shm = self.untrack(shared_memory.SharedMemory(name=name))
+        except FileNotFoundError:
+            tile = None
+        else:
+            try:
+                h, w, c, ready = self.header.unpack_from(shm.buf)
+                if ready:
+                    data = shm.buf[self.header.size : self.header.size + h * w * c]
+                    tile = numpy.frombuffer(data, dtype=numpy.uint8).reshape(h, w, c)
+                    tile = tile.copy()
+                    del data
+                else:
+                    tile = None
+            finally:
+                shm.close()
+
+        with self.lock:
+            if tile is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                if name in self.segments.keys():
+                    self.segments.move_to_end(name)
+        return tile
+
+    def put(self, key: Hashable, tile: numpy.ndarray) -> None:
+        name = self.name(key)
+        h, w, c = tile.shape
+        try:
+            shm = shared_memory.SharedMemory(
+                name=name, create=True, size=self.header.size + tile.nbytes
+            )
+        except FileExistsError:
+            return  # another process got there first
+        self.untrack(shm)
+
+        shm.buf[self.header.size : self.header.size + tile.nbytes] = tile.tobytes()
+        self.header.pack_into(shm.buf, 0, h, w, c, 1)
+
+        with self.lock:
+            self.segments[name] = shm
+            self.nbytes += tile.nbytes
+            while self.nbytes > self.max_bytes and self.segments:
+                _, evicted = self.segments.popitem(last=False)
+                self.nbytes -= evicted.size - self.header.size
+                self.unlink(evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats["tiles"] = len(self.segments)
+        return stats
+
+    def clear(self) -> None:
+        with self.lock:
+            for shm in self.segments.values():
+                self.unlink(shm)
+            self.segments.clear()
+            self.nbytes = 0
+
+
+_cache: Optional[TileCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_tile_cache() -> TileCache:
+    """
+    The process-wide tile cache, configured by the optional `tile_cache` key of
+    config.json, e.g. {"max_bytes": 536870912, "shared": true}.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            settings = dict(get_config().get("tile_cache", {}))
+            if settings.pop("shared", False):
+                _cache = SharedTileCache(**settings)
+            else:
+                _cache = TileCache(**settings)
+        return _cache
+
+
+def _reset_cache() -> None:
+    # a forked child must not share, or unlink, the parent's segments
+    global _cache
+    _cache = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_cache)
+
+
+tile_size = 512
+
+
+def read_tile(relpath: str, level: int, tx: int, ty: int) -> numpy.ndarray:
+    """
+    The tile at column tx and row ty of a pyramid level, as an RGB array.
+    Tiles on the right and bottom edges are cropped to the level.
+    """
+    info = get_slide_info(relpath)
+    key = (info["fingerprint"], level, tx, ty)
+
+    cache = get_tile_cache()
+    tile = cache.get(key)
+    if tile is not None:
+        return tile
+
+    lw, lh = info["level_dimensions"][level]
+    downsample = info["level_downsamples"][level]
+    x, y = tx * tile_size, ty * tile_size
+    size = min(tile_size, lw - x), min(tile_size, lh - y)
+    location = int(round(x * downsample)), int(round(y * downsample))
+
+    with open_slide(relpath) as obj:
+        image = obj.read_region(location, level, size)
+    tile = numpy.asarray(image.convert("RGB"))
+
+    cache.put(key, tile)
+    return tile
+
+
+def read_region(
+    relpath: str, location: Tuple[int, int], level: int, size: Tuple[int, int]
+) -> numpy.ndarray:
+    """
+    Like OpenSlide.read_region, but assembled from cached tiles and returned as
+    an RGB array. `location` is in level 0 pixels and `size` in pixels of
+    `level`; pixels outside the slide are black.
+    """
+    info = get_slide_info(relpath)
+    lw, lh = info["level_dimensions"][level]
+    downsample = info["level_downsamples"][level]
+
+    x = int(round(location[0] / downsample))
+    y = int(round(location[1] / downsample))
+    width, height = size
+    out = numpy.zeros((height, width, 3), dtype=numpy.uint8)
+
+    # the part of the window inside the level
+    left, top = max(x, 0), max(y, 0)
+    right, bottom = min(x + width, lw), min(y + height, lh)
+
+    for ty in range(top // tile_size, int(math.ceil(bottom / tile_size))):
+        for tx in range(left // tile_size, int(math.ceil(right / tile_size))):
+            tile = read_tile(relpath, level, tx, ty)
+            x0, y0 = tx * tile_size, ty * tile_size
+
+            t, b = max(top, y0), min(bottom, y0 + tile.shape[0])
+            l, r = max(left, x0), min(right, x0 + tile.shape[1])
+            out[t - y : b - y, l - x : r - x] = tile[t - y0 : b - y0, l - x0 : r - x0]
+
+    return out
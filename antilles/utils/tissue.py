@@ -0,0 +1,146 @@
+import math
+from functools import lru_cache
+from typing import Tuple, Sequence, List, Dict, Any
+
+import numpy
+from PIL import Image
+from scipy import ndimage
+from skimage.color import rgb2hsv
+from skimage.filters import threshold_otsu
+
+from antilles.utils.io import DAO
+from antilles.utils.math import init_arrow_coords
+from antilles.utils.slides import get_slide_info, get_best_level
+from antilles.utils.tiles import read_region
+
+
+@lru_cache(maxsize=32)
+def get_slide_thumbnail(
+    relpath: str, max_size: int = 1024
+) -> Tuple[numpy.ndarray, float]:
+    """
+    A slide downsampled to fit in `max_size` pixels, as an RGB array, and the
+    downsample factor from level 0. Read from the coarsest pyramid level that
+    still has enough pixels, through the tile cache.
+    """
+    info = get_slide_info(relpath)
+    w, h = info["dims"]
+    factor = max(w / max_size, h / max_size, 1.0)
+    dims = max(int(round(w / factor)), 1), max(int(round(h / factor)), 1)
+
+    if info["openslide"]:
+        level = get_best_level(info, factor)
+        image = read_region(relpath, (0, 0), level, info["level_dimensions"][level])
+        image = Image.fromarray(image)
+    else:
+        with Image.open(DAO.abs(relpath)) as obj:
+            image = obj.convert("RGB")
+            image.load()
+
+    thumbnail = numpy.asarray(image.resize(dims, Image.BILINEAR))
+    thumbnail.setflags(write=False)
+    return thumbnail, factor
+
+
+def tissue_mask(
+    image: numpy.ndarray,
+    min_saturation: float = 0.05,
+    min_size: int = 64,
+    fill_holes: bool = True,
+) -> numpy.ndarray:
+    """
+    Tissue in a low resolution RGB image of a slide: stained pixels are more
+    saturated than glass. The saturation threshold is found by Otsu's method,
+    but never below `min_saturation`, so that empty images stay empty. Holes
+    are filled, unless they are what is looked for, and specks under
+    `min_size` pixels are dropped.
+    """
+    saturation = rgb2hsv(image)[:, :, 1]
+    threshold = min_saturation
+    if saturation.max() > saturation.min():
+        threshold = max(threshold_otsu(saturation), min_saturation)
+
+    mask = ndimage.binary_closing(saturation > threshold, iterations=2)
+    if fill_holes:
+        mask = ndimage.binary_fill_holes(mask)
+
+    labels, _ = ndimage.label(mask)
+    sizes = numpy.bincount(labels.ravel())
+    sizes[0] = 0
+    return (sizes >= min_size)[labels]
+
+
+def wedge_fractions(
+    mask: numpy.ndarray,
+    factor: float,
+    center: Tuple[float, float],
+    angles: Sequence[float],
+    span: float,
+    radius_inner: float,
+    radius_outer: float,
+) -> numpy.ndarray:
+    """
+    The fraction of each wedge around `center` that is tissue, for wedges
+    pointing at each of `angles` in degrees. The center and radii are in level
+    0 pixels, and `mask` is downsampled from level 0 by `factor`. Wedges that
+    fall off the mask count what is off it as glass.
+    """
+    cx, cy = center[0] / factor, center[1] / factor
+    r0, r1 = radius_inner / factor, radius_outer / factor
+
+    # only the pixels of the annulus are compared with every wedge
+    h, w = mask.shape
+    x0, x1 = max(int(math.floor(cx - r1)), 0), min(int(math.ceil(cx + r1)) + 1, w)
+    y0, y1 = max(int(math.floor(cy - r1)), 0), min(int(math.ceil(cy + r1)) + 1, h)
+    yy, xx = numpy.mgrid[y0:y1, x0:x1]
+    dx, dy = xx - cx, yy - cy
+    rho = numpy.hypot(dx, dy)
+    annulus = (rho >= r0) & (rho <= r1)
+
+    theta = numpy.degrees(numpy.arctan2(dy[annulus], dx[annulus]))
+    tissue = mask[y0:y1, x0:x1][annulus]
+
+    angles = numpy.asarray(angles, dtype=numpy.float64)[:, numpy.newaxis]
+    inside = numpy.abs((theta - angles + 180) % 360 - 180) <= span / 2
+    n_tissue = (inside & tissue).sum(axis=1)
+
+    # the area of a wedge in thumbnail pixels, including any part off the mask
+    area = math.pi * (r1**2 - r0**2) * span / 360
+    return numpy.minimum(n_tissue / max(area, 1.0), 1.0)
+
+
+def find_sections(
+    mask: numpy.ndarray, n: int, label_side: str = "left"
+) -> List[Tuple[float, float]]:
+    """
+    Centroids (x, y) of the `n` largest tissue sections in a mask, as its
+    connected components, ordered away from the label of the slide, on its
+    `label_side`. Fewer are returned if there are fewer sections.
+    """
+    labels, n_labels = ndimage.label(mask)
+    if n_labels == 0 or n <= 0:
+        return []
+
+    sizes = numpy.bincount(labels.ravel())[1:]
+    largest = numpy.argsort(-sizes, kind="stable")[:n] + 1
+    centroids = ndimage.center_of_mass(mask, labels, largest)
+    sections = [(float(x), float(y)) for y, x in centroids]
+    return sorted(sections, key=lambda c: c[0], reverse=label_side == "right")
+
+
+def init_section_coords(
+    relpath: str, n: int, params: Dict[str, Any]
+) -> List[Tuple[int, int]]:
+    """
+    Arrow coordinates of `n` samples on a slide, in level 0 pixels, at the
+    centroids of its tissue sections in a thumbnail. Samples are assumed to be
+    sectioned in the order they are listed, starting next to the label. If
+    fewer sections than samples are found, arrows are put on the even grid.
+    """
+    image, factor = get_slide_thumbnail(relpath, params["max_size"])
+    mask = tissue_mask(image, params["min_saturation"], params["min_size"])
+    sections = find_sections(mask, n, params["label_side"])
+    if len(sections) < n:
+        return list(init_arrow_coords(get_slide_info(relpath)["dims"], n))
+
+    return [(int(round(x * factor)), int(round(y * factor))) for x, y in sections]
@@ -0,0 +1,79 @@
+"""
+Compares the csv and parquet annotation backends on a synthetic
+IMAGES_COORDS_BOW frame, timing a save and a typed load for each.
+"""
+
+import json
+import logging.config
+import tempfile
+import time
+
+import numpy
+import pandas
+
+from antilles.block import Field, cast, dtypes_bow
+from antilles.utils.store import backends
+
+logging.config.fileConfig("../logging.ini")
+log = logging.getLogger(__name__)
+
+
+def make_regions(n: int) -> pandas.DataFrame:
+    rng = numpy.random.default_rng(0)
+    n_samples = 24
+    samples = rng.integers(1, n_samples + 1, size=n)
+    df = pandas.DataFrame(
+        {
+            "relpath": [f"PROJ/BLK1/1_regions/region_{i}.tif" for i in range(n)],
+            "project": "PROJ",
+            "block": "BLK1",
+            "panel": rng.choice(["HE", "CC3", "KI67"], size=n),
+            "level": rng.integers(1, 4, size=n),
+            "sample": samples.astype(str),
+            "cohorts": json.dumps({"treatment": "A"}),
+            "drug": rng.choice(["DOX", "CIS", "VEH", "GEM"], size=n),
+            "origin_x": rng.integers(0, 100000, size=n),
+            "origin_y": rng.integers(0, 100000, size=n),
+            "center_x": rng.integers(0, 5000, size=n),
+            "center_y": rng.integers(0, 5000, size=n),
+            "well_x": rng.integers(0, 5000, size=n),
+            "well_y": rng.integers(0, 5000, size=n),
+            "mpp": 0.2527,
+            "metadata": json.dumps({"include": True}),
+        },
+        columns=list(dtypes_bow.keys()),
+    )
+    return cast(df, Field.IMAGES_COORDS_BOW)
+
+
+def bench(n: int, repeats: int = 5) -> None:
+    df = make_regions(n)
+    name = Field.IMAGES_COORDS_BOW.value
+
+    with tempfile.TemporaryDirectory() as dirpath:
+        for backend, store_class in backends.items():
+            store = store_class(dirpath)
+
+            t0 = time.perf_counter()
+            for _ in range(repeats):
+                store.write(df, name)
+            t_save = (time.perf_counter() - t0) / repeats
+
+            t0 = time.perf_counter()
+            for _ in range(repeats):
+                cast(store.read(name), Field.IMAGES_COORDS_BOW)
+            t_load = (time.perf_counter() - t0) / repeats
+
+            log.info(
+                f"{backend:>8} n={n:>8}: save {t_save * 1000:8.1f} ms, "
+                f"load {t_load * 1000:8.1f} ms"
+            )
+
+
+def main():
+    for n in [1_000, 10_000, 100_000, 1_000_000]:
+        bench(n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Times `upsert` on annotation-like frames of up to 10^6 rows, keyed on the
+composite key of REGIONS_COORDS_BOW, against the former column-by-column
+implementation.
+"""
+
+import logging.config
+import time
+from functools import reduce
+from typing import List
+
+import numpy
+import pandas
+
+from antilles.utils import upsert
+
+logging.config.fileConfig("../logging.ini")
+log = logging.getLogger(__name__)
+
+cols = ["project", "block", "panel", "level", "sample", "drug"]
+
+
+def upsert_columnwise(
+    update: pandas.DataFrame, using: pandas.DataFrame, cols: List[str]
+) -> pandas.DataFrame:
+    indices = map(lambda x: ~update[x].isin(using[x]), cols)
+    indices = reduce((lambda x, y: x | y), indices)
+
+    updated = pandas.concat([update[indices], using], ignore_index=True)
+    updated = updated.sort_values(by=cols)
+    updated.index = range(len(updated))
+
+    return updated
+
+
+def make_frame(n: int, seed: int) -> pandas.DataFrame:
+    rng = numpy.random.default_rng(seed)
+    ids = rng.permutation(n)
+    return pandas.DataFrame(
+        {
+            "project": "PROJ",
+            "block": "BLK" + pandas.Series(ids % 10).astype(str),
+            "panel": "PNL" + pandas.Series(ids // 10 % 10).astype(str),
+            "level": ids // 100 % 10,
+            "sample": "SMP" + pandas.Series(ids // 1000 % 100).astype(str),
+            "drug": "DRG" + pandas.Series(ids // 100000).astype(str),
+            "center_x": rng.integers(0, 5000, size=n),
+            "center_y": rng.integers(0, 5000, size=n),
+        }
+    )
+
+
+def bench(n: int) -> None:
+    update = make_frame(n, seed=0)
+    using = make_frame(n, seed=1).sample(frac=0.1, random_state=0)
+
+    for name, func, kwargs in [
+        ("columnwise", upsert_columnwise, {}),
+        ("hash", upsert, {}),
+        ("hash, unsorted", upsert, {"sort": False}),
+    ]:
+        t0 = time.perf_counter()
+        df = func(update, using, cols, **kwargs)
+        dt = time.perf_counter() - t0
+        log.info(f"{name:>15} n={n:>8}: {dt * 1000:8.1f} ms, {len(df)} rows")
+
+
+def main():
+    for n in [10_000, 100_000, 1_000_000]:
+        bench(n)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,12 @@ A script to analyze regions of drug diffusion in histological images.
 
 1. Specify the base project folder in `config.json`.
     In config.json is a value that must be set to the path containing the projects on 
-    that computer.
+    that computer. The file is read once per run; ANTILLES_CONFIG points to another
+    config.json, and ANTILLES_BASEPATH and ANTILLES_SAMPLE_PREFIX override its values.
+    The optional key `slide_pool` sets how many slides are kept open (max_handles) and
+    the size in bytes of OpenSlide's tile cache shared by them (cache_size), and
+    `tile_cache` the bytes of decoded tiles kept between reads (max_bytes), optionally
+    in shared memory for all processes on the computer (shared).
 
 2. Create a project folder with the following structure:
     {PROJECT}
@@ -26,6 +31,12 @@ A script to analyze regions of drug diffusion in histological images.
         devices
     Refer to the TEST project in the lab dropbox folder for an example.
 
+    Annotations are stored as csv files by default. Setting the optional key
+    `storage` to `parquet` stores them as typed parquet files instead, and
+    `sqlite` stores the annotations of all blocks in a single database,
+    `annotations.sqlite`, that several processes can update at once. The
+    CellProfiler input files are always written as csv.
+
 4. Within the script, set the project name, block name, and step.
     The step should be set to 0 initially.
     For the moment, I can't guarantee that changing things done in earlier steps will
@@ -39,6 +50,19 @@ A script to analyze regions of drug diffusion in histological images.
     from left to right (from slide label to away from the slide label), then only if
     samples are aligned vertically, from top to bottom.
 
+    Arrows start on an even grid. With "arrow_init": {"method": "tissue"} in the
+    project.json file, they start at the centroids of the tissue sections found in
+    each slide thumbnail instead, in the same order as the samples, starting next to
+    the label ("label_side"). Slides with fewer sections than samples keep the grid.
+
+    Slides of the same block at other levels and panels show nearly the same layout,
+    so only one of them needs its arrows placed by hand. With step == 7, Registrar
+    (antilles.pipeline.register) aligns the thumbnail of every other slide onto that
+    reference slide by phase correlation, saves the transforms as 'REGISTRATION', and
+    maps the arrows of the reference onto the other slides. Slides that align poorly,
+    or are turned further than 'max_rotation', are flagged and keep their arrows;
+    check those when running step 0 again.
+
     The arrow indicates the direction in which the fiducial points. This may be the
     notch or datum, or the highest well containing doxorubicin. The identity of the
     fiducial may not matter, as long as it remains consistently applied. Note that the
@@ -59,6 +83,26 @@ A script to analyze regions of drug diffusion in histological images.
     region of interest using the angle specified per drug in the project.json file.
     This results in a second folder for each block folder, called '1_regions'.
 
+    With the optional `tissue` parameters, tissue is first found in a thumbnail of
+    each slide, and wells whose wedges are less than `min_fraction` tissue are saved
+    with include=False in their metadata, or not extracted at all if `skip` is set.
+    Adjuster.run(skip_excluded=True) then leaves excluded regions out of step 2.
+
+    Setting the optional key `region_format` to `store` in project.json packs the
+    regions into a single chunked array store, '1_regions.store', instead of one tif
+    per region; `region_store` sets its chunk_size and compression. With `virtual`,
+    no pixels are copied: a manifest of where each region is in its slide is saved
+    as REGIONS_MANIFEST, and regions are read from the slides when needed. In both
+    cases, call extractor.export() to write the tifs for CellProfiler.
+
+    The optional key `stain_output` also separates the stains of each region while
+    it is in memory, e.g. {"stains": "hed", "dtype": "uint8", "od_max": 2.0}. With
+    the tif format, one tif per stain is written to '2_regions_hed'; with the store
+    format, the stains are packed into '2_regions_hed.store' under the region names.
+    uint8 densities are scaled so that `od_max` is 255. The regions themselves are
+    always written too, as fitting, adjusting, detection, profiling and histograms
+    all read them; `keep_rgb` set to false is rejected.
+
 7. The third step is fine-tuning the bow direction for each well.
     When run with step == 2, this script will display a window of the downsampled
     region in sequence. The window will also display a single bow, whose initial
@@ -71,12 +115,24 @@ A script to analyze regions of drug diffusion in histological images.
     On the right-hand side is a panel for specifying whether to include or exclude
     the well from analysis.
 
+    Before that, BowFitter (antilles.pipeline.fit) fits each bow from the region
+    itself: the center of the round hole the device left in the tissue, and the tip
+    of the notch of its well. Confident fits replace the initial bows, and each fit
+    records its confidence as 'bow_confidence' in the metadata. Adjuster.run(
+    max_confidence=...) then only shows the regions fit with less confidence. Bows
+    already fit are not refit on later runs, so adjustments made by hand are kept.
+
 8. The fourth step is a transformation of the pandas.DataFrame into a format that
     CellProfiler is able to understand, which is a file called 'CELLPROFILER_IMAGE_INPUT.csv'.
 
     This includes changing the column names and unpacking the metadata column from a
     json object into individual columns.
 
+    With step == 4, every block of the project is formatted in parallel, and the
+    results are merged into a single 'CELLPROFILER_IMAGE_INPUT.csv' in the project
+    folder, with one 'CELLPROFILER_IMAGE_INPUT_{PANEL}.csv' per panel. Images that
+    appear more than once are only kept the first time.
+
 9. Drag the entire 1_regions folder into the Images module in CellProfiler.
     If you are analyzing a particular panel, make sure to apply filters to the file
     list so that only the images stained with a particular panel are being analyzed.
@@ -88,15 +144,46 @@ A script to analyze regions of drug diffusion in histological images.
     This allows each image to be linked with its corresponding metadata. Ensure that
     each piece of metadata is typed properly (coordinates are integers, etc.).
 
-11.
+11. As an alternative to CellProfiler, step == 5 profiles each region in antilles.
+    The mean color, intensity and stain densities (hematoxylin, eosin and DAB) are
+    binned by distance from the well, in microns, and optionally by angle within the
+    span of the bow. Only the part of each region within `max_distance` of the well
+    is read, a tile at a time. The profiles of a block are saved as PROFILES.
+
+    Setting `polar` first resamples each region into a polar image centered on its
+    bow, with distance from the well down the rows and angle across the columns, so
+    that bins are runs of rows and columns. Unwarper(project, block).run() saves these
+    polar images to '2_regions_polar.store' for other analyses.
+
+    To try many bands and spans without reading regions each time, run
+    Histogrammer(project, block).run() once: it stores cumulative counts of pixels in
+    fine bins of distance, angle and intensity (or a stain) in
+    '2_regions_histogram.store'. Histogrammer(...).profile(edges, sectors) then
+    profiles every region from those counts, with edges snapped to the fine bins.
+
+12. Step == 6 detects nuclei in each region, in place of counting them in CellProfiler.
+    Regions are split into overlapping tiles that are segmented in worker processes;
+    a nucleus is kept by the tile its centroid is in, and tiles overlap by the largest
+    expected nucleus (`max_diameter`). The centroid, area and mean hematoxylin
+    density of each nucleus are saved as OBJECTS, keyed by region relpath.
+
+    block.object_index() then counts nuclei in bands of distance from the well, and
+    optionally in sectors of angle from the bow, for every region of the block at
+    once, e.g. block.object_index().to_frame([0, 100, 200, 500], [-45, 0, 45]). The
+    index is saved with the annotations and rebuilt when the nuclei or bows change.
 
 """
 
 import logging.config
 
 from antilles.pipeline.adjust import Adjuster
+from antilles.pipeline.detect import Detector
 from antilles.pipeline.extract import Extractor
-from antilles.pipeline.format import Formatter
+from antilles.pipeline.fit import BowFitter
+from antilles.block import Field
+from antilles.pipeline.format import Formatter, ProjectFormatter
+from antilles.pipeline.profile import Profiler
+from antilles.pipeline.register import Registrar
 from antilles.project import Project
 from antilles.utils import profile
 
@@ -126,22 +213,63 @@ def main():
                 "span": 120.0,  # degrees
                 "radius_inner": 400,  # microns
                 "radius_outer": 1200,  # microns
-            }
+            },
+            "tissue": {
+                "min_fraction": 0.25,  # of each wedge
+                "skip": False,  # exclude wells off the tissue rather than skip them
+            },
         }
         extractor.extract(params)
 
     # === FINE ADJUST ================================================================ #
     elif step == 2:
+        fitter = BowFitter(project, block)
+        fitter.run()
+
         adjuster = Adjuster(project, block)
-        adjuster.run()
+        adjuster.run(max_confidence=0.5)
 
     # === PRE-FORMAT ================================================================= #
     elif step == 3:
         formatter = Formatter(project, block)
         formatter.run()
 
+    elif step == 4:
+        formatter = ProjectFormatter(project)
+        formatter.run(Field.CELLPROFILER_IMAGE_INPUT)
+
+    # === PROFILE ==================================================================== #
+    elif step == 5:
+        params = {
+            "bin_width": 10.0,  # microns
+            "max_distance": 1000.0,  # microns
+            "angle_bins": 1,
+            "polar": False,
+        }
+        profiler = Profiler(project, block, params)
+        profiler.run()
+
+    # === DETECT ===================================================================== #
+    elif step == 6:
+        params = {
+            "threshold": 0.04,  # hematoxylin optical density
+            "min_area": 10.0,  # square microns
+            "max_diameter": 20.0,  # microns
+        }
+        detector = Detector(project, block, params)
+        detector.run()
+
+    # === REGISTER =================================================================== #
+    elif step == 7:
+        params = {
+            "reference": {"level": 1},  # the slide whose arrows were placed by hand
+            "min_quality": 0.5,
+        }
+        registrar = Registrar(project, block, params)
+        registrar.run()
+
     # === VISUALIZE ================================================================== #
-    # elif step == 4:
+    # elif step == 8:
     #     plotter = Plotter(project, block)
     #     plotter.run()
 
@@ -0,0 +1,120 @@
+import os
+import tempfile
+import unittest
+
+import numpy
+from PIL import Image
+
+from antilles.utils.arrays import RegionStore
+
+
+class TestRegionStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dirpath = os.path.join(self.tmpdir.name, "1_regions.store")
+
+        rng = numpy.random.default_rng(0)
+        self.regions = {
+            os.path.join(self.tmpdir.name, f"region_{i}.tif"): rng.integers(
+                0, 256, size=(h, w, 3), dtype=numpy.uint8
+            )
+            for i, (h, w) in enumerate([(100, 70), (33, 128), (64, 64)])
+        }
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, store: RegionStore, **kwargs):
+        with store.writer(**kwargs) as writer:
+            for name, array in self.regions.items():
+                writer.add(name, array)
+
+    def test_store_01(self):
+        for compression in ["none", "zlib"]:
+            store = RegionStore(
+                self.dirpath, chunk_size=(32, 32), compression=compression
+            )
+            self.write(store)
+            for name, array in self.regions.items():
+                numpy.testing.assert_array_equal(store.read(name), array)
+
+    def test_store_02(self):
+        store = RegionStore(self.dirpath, chunk_size=(32, 32))
+        self.write(store)
+
+        name, array = next(iter(self.regions.items()))
+        window = store.read(name, x=20, y=30, width=45, height=50)
+        numpy.testing.assert_array_equal(window, array[30:80, 20:65])
+
+        with self.assertRaises(ValueError):
+            store.read(name, x=60, width=20)
+
+    def test_store_03(self):
+        store = RegionStore(self.dirpath, chunk_size=(32, 32))
+        self.write(store)
+        self.write(store, append=True)
+        self.assertEqual(len(store.names()), 3)
+
+        extra = numpy.zeros((10, 10, 3), dtype=numpy.uint8)
+        with store.writer(append=True) as writer:
+            writer.add("extra", extra)
+        self.assertEqual(len(store.names()), 4)
+        for name, array in self.regions.items():
+            numpy.testing.assert_array_equal(store.read(name), array)
+
+    def test_store_04(self):
+        store = RegionStore(self.dirpath)
+        self.write(store)
+        store.export()
+
+        for name, array in self.regions.items():
+            with Image.open(name) as image:
+                numpy.testing.assert_array_equal(numpy.asarray(image), array)
+
+    def test_store_05(self):
+        # as shown for adjustment, without a tif
+        store = RegionStore(self.dirpath, chunk_size=(32, 32))
+        self.write(store)
+
+        name, array = next(iter(self.regions.items()))
+        self.assertIn(name, store)
+        thumbnail = store.thumbnail(name, (35, 50))
+        self.assertEqual(thumbnail.size, (35, 50))
+        expected = Image.fromarray(array).resize((35, 50), Image.LANCZOS)
+        numpy.testing.assert_array_equal(numpy.asarray(thumbnail), expected)
+        self.assertFalse(os.path.exists(name))
+
+    def test_store_06(self):
+        # a write that fails leaves the store as it was, whole
+        store = RegionStore(self.dirpath, chunk_size=(32, 32))
+        self.write(store)
+        for append in [False, True]:
+            with self.assertRaises(RuntimeError):
+                with store.writer(append=append) as writer:
+                    writer.add("extra", numpy.zeros((10, 10, 3), dtype=numpy.uint8))
+                    raise RuntimeError()
+
+            store = RegionStore(self.dirpath, chunk_size=(32, 32))
+            self.assertEqual(sorted(store.names()), sorted(self.regions.keys()))
+            for name, array in self.regions.items():
+                numpy.testing.assert_array_equal(store.read(name), array)
+
+        # files of all but the last two generations are removed
+        for _ in range(3):
+            self.write(store)
+        files = [f for f in os.listdir(self.dirpath) if not f.endswith(".lock")]
+        self.assertEqual(
+            sorted(files),
+            sorted(
+                [
+                    "store.json",
+                    *[f"data.{n}.bin" for n in (3, 4)],
+                    *[f"chunks.{n}.npy" for n in (3, 4)],
+                    *[f"regions.{n}.csv" for n in (3, 4)],
+                ]
+            ),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
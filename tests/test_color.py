@@ -0,0 +1,53 @@
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy
+
+from antilles.block import Block
+from antilles.utils.color import deconvolve, decode_stains, separate
+
+
+def make_image(height: int = 100, width: int = 60) -> numpy.ndarray:
+    rng = numpy.random.default_rng(0)
+    return rng.integers(0, 256, (height, width, 3), dtype=numpy.uint8)
+
+
+class TestColor(unittest.TestCase):
+    def test_color_01(self):
+        image = make_image()
+        expected = deconvolve(image, "hed")
+
+        # chunks, in a pool or not, give the same densities as one call
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            for chunk_rows in [7, 256]:
+                od = separate(image, "hed", "float16", chunk_rows=chunk_rows, pool=pool)
+                self.assertEqual((od.shape, od.dtype), ((100, 60, 3), numpy.float16))
+                numpy.testing.assert_allclose(od, expected, rtol=1e-3, atol=1e-3)
+        od = separate(image, "hed", "float16", chunk_rows=7)
+        numpy.testing.assert_allclose(od, expected, rtol=1e-3, atol=1e-3)
+
+    def test_color_02(self):
+        image = make_image()
+        expected = numpy.minimum(deconvolve(image, "hdx"), 1.0)
+
+        od = separate(image, "hdx", "uint8", od_max=1.0, chunk_rows=16)
+        self.assertEqual(od.dtype, numpy.uint8)
+        numpy.testing.assert_allclose(decode_stains(od, 1.0), expected, atol=0.5 / 255)
+
+    def test_color_03(self):
+        # later steps read the rgb regions, so stains cannot replace them
+        with tempfile.TemporaryDirectory() as dirpath:
+            block = {"name": "BLK1", "device": "DEV1", "samples": 1}
+            config = {"stain_output": {"stains": "hed"}}
+            project = SimpleNamespace(relpath=dirpath, config=config)
+            self.assertEqual(Block(block, project).stain_output["stains"], "hed")
+
+            config["stain_output"]["keep_rgb"] = False
+            with self.assertRaises(ValueError):
+                Block(block, project).stain_output
+
+
+if __name__ == "__main__":
+    unittest.main()
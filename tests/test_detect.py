@@ -0,0 +1,76 @@
+import unittest
+
+import numpy
+
+from antilles.pipeline import detect
+from antilles.pipeline.detect import get_tiles, detect_nuclei, detect_region, to_pixels
+
+
+class ArrayReader:
+    def __init__(self, image: numpy.ndarray):
+        self.image = image
+        self.relpaths = []
+
+    def read(self, relpath: str, x: int, y: int, width: int, height: int):
+        self.relpaths.append(relpath)
+        return self.image[y : y + height, x : x + width]
+
+
+def make_region(centers, size: int = 200, radius: int = 5) -> numpy.ndarray:
+    # purple nuclei on a white background
+    image = numpy.full((size, size, 3), 240, dtype=numpy.uint8)
+    yy, xx = numpy.mgrid[:size, :size]
+    for cx, cy in centers:
+        image[numpy.hypot(xx - cx, yy - cy) <= radius] = (80, 60, 140)
+    return image
+
+
+# some nuclei straddle the edges of 64 px tiles
+centers = [(20, 20), (64, 30), (100, 64), (128, 128), (63, 150), (170, 100)]
+params = to_pixels(detect.defaults, mpp=1.0)
+
+
+class TestDetect(unittest.TestCase):
+    def test_detect_01(self):
+        tiles = list(get_tiles((200, 150), 64, 10))
+        self.assertEqual(len(tiles), 4 * 3)
+
+        # cores cover the region once; windows stay within it
+        covered = numpy.zeros((150, 200), dtype=int)
+        for (x, y, w, h), (wx, wy, ww, wh) in tiles:
+            covered[y : y + h, x : x + w] += 1
+            self.assertTrue(wx <= x and wy <= y)
+            self.assertTrue(wx + ww <= 200 and wy + wh <= 150)
+        self.assertTrue((covered == 1).all())
+
+    def test_detect_02(self):
+        image = make_region(centers)
+        nuclei = detect_nuclei(image, params)
+        self.assertEqual(len(nuclei["x"]), len(centers))
+        found = sorted(zip(numpy.round(nuclei["x"]), numpy.round(nuclei["y"])))
+        self.assertEqual(found, sorted(centers))
+        self.assertTrue((nuclei["area"] > 70).all())
+
+    def test_detect_03(self):
+        reader = ArrayReader(make_region(centers))
+        detect._readers[("P", "B")] = reader
+        try:
+            tiles = detect_region(
+                "P", "B", "region.tif", (200, 200), {**params, "tile_size": 64}
+            )
+        finally:
+            del detect._readers[("P", "B")]
+
+        # the tiles of a region are read by the task that detects it
+        self.assertEqual(len(tiles), 4 * 4)
+        self.assertEqual(reader.relpaths, ["region.tif"] * 16)
+
+        # nuclei in the overlaps of tiles are only kept once
+        x = numpy.concatenate([tile["x"] for tile in tiles])
+        y = numpy.concatenate([tile["y"] for tile in tiles])
+        found = sorted(zip(numpy.round(x), numpy.round(y)))
+        self.assertEqual(found, sorted(centers))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import json
+import unittest
+
+import pandas
+
+from antilles.pipeline.extract import update_translate
+
+
+def make_regions(origin, center, metadata):
+    return pandas.DataFrame(
+        [
+            {
+                "project": "PRJ1",
+                "block": "BLK1",
+                "panel": "HE",
+                "level": 1,
+                "sample": "SMP1",
+                "drug": "DRG1",
+                "origin_x": origin[0],
+                "origin_y": origin[1],
+                "center_x": center[0],
+                "center_y": center[1],
+                "well_x": center[0] + 50,
+                "well_y": center[1],
+                "metadata": json.dumps(metadata),
+            }
+        ]
+    )
+
+
+class TestExtract(unittest.TestCase):
+    def test_extract_01(self):
+        # bows adjusted before extracting again follow the new origins
+        prev = make_regions((100, 200), (300, 300), {})
+        regions = make_regions((110, 180), (250, 250), {})
+
+        regions = update_translate(regions, using=prev)
+        row = regions.iloc[0]
+        self.assertEqual((row["center_x"], row["center_y"]), (290, 320))
+        self.assertEqual((row["well_x"], row["well_y"]), (340, 320))
+
+    def test_extract_02(self):
+        # metadata set since is kept, but tissue found anew takes precedence
+        prev = make_regions(
+            (100, 200),
+            (300, 300),
+            {"tissue_fraction": 0.9, "bow_confidence": 0.8, "stain_quality": 2},
+        )
+        regions = make_regions(
+            (100, 200), (250, 250), {"tissue_fraction": 0.1, "include": False}
+        )
+
+        regions = update_translate(regions, using=prev)
+        metadata = json.loads(regions.iloc[0]["metadata"])
+        self.assertEqual(
+            metadata,
+            {
+                "tissue_fraction": 0.1,
+                "include": False,
+                "bow_confidence": 0.8,
+                "stain_quality": 2,
+            },
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
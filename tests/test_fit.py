@@ -0,0 +1,69 @@
+import unittest
+
+import numpy
+
+from antilles.pipeline import fit
+from antilles.pipeline.fit import downsample, fit_bow
+
+
+def make_region(notch: bool = True, hole: bool = True) -> numpy.ndarray:
+    # pink tissue with the hole left by a device at (520, 480), 200 px across,
+    # and the notch of its well reaching 50 px further to the right
+    rng = numpy.random.default_rng(0)
+    image = numpy.empty((1000, 1000, 3), dtype=numpy.uint8)
+    image[...] = (200, 120, 170)
+    image += rng.integers(0, 10, image.shape, dtype=numpy.uint8)
+
+    yy, xx = numpy.mgrid[:1000, :1000]
+    glass = numpy.zeros((1000, 1000), dtype=bool)
+    if hole:
+        glass |= numpy.hypot(xx - 520, yy - 480) <= 200
+    if notch:
+        glass |= (xx >= 520) & (xx <= 770) & (numpy.abs(yy - 480) <= 20)
+    image[glass] = 240
+    return image
+
+
+# the bow as placed by extraction, off by a few tens of microns
+region = {
+    "relpath": "region.tif",
+    "center_x": 500,
+    "center_y": 500,
+    "well_x": 700,
+    "well_y": 500,
+    "mpp": 2.0,
+}
+
+
+class TestFit(unittest.TestCase):
+    def test_fit_01(self):
+        image = numpy.arange(5 * 7 * 3, dtype=numpy.uint8).reshape(5, 7, 3)
+        small = downsample(image, 2)
+        self.assertEqual(small.shape, (2, 3, 3))
+        self.assertEqual(small[0, 0, 0], image[:2, :2, 0].mean())
+
+    def test_fit_02(self):
+        bow = fit_bow(make_region(), region, fit.defaults)
+        self.assertLessEqual(abs(bow["center_x"] - 520), 4)
+        self.assertLessEqual(abs(bow["center_y"] - 480), 4)
+        self.assertLessEqual(abs(bow["well_x"] - 770), 6)
+        self.assertLessEqual(abs(bow["well_y"] - 480), 6)
+        self.assertGreater(bow["confidence"], 0.8)
+
+    def test_fit_03(self):
+        # a hole without a notch gives a bow, but not a confident one
+        bow = fit_bow(make_region(notch=False), region, fit.defaults)
+        self.assertLessEqual(abs(bow["center_x"] - 520), 4)
+        self.assertLess(bow["confidence"], fit.defaults["min_confidence"])
+
+        # without a hole, the initial bow is kept
+        bow = fit_bow(make_region(notch=False, hole=False), region, fit.defaults)
+        self.assertEqual(
+            [bow[key] for key in ["center_x", "center_y", "well_x", "well_y"]],
+            [500, 500, 700, 500],
+        )
+        self.assertEqual(bow["confidence"], 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
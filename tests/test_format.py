@@ -0,0 +1,134 @@
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import pandas
+
+from antilles.block import Field
+from antilles.pipeline.format import (
+    scan_metadata,
+    decode_metadata,
+    format_chunk,
+    columns_cellprofiler,
+    ProjectFormatter,
+)
+
+
+def make_regions(metadata):
+    df = pandas.DataFrame(
+        {
+            column: [0] * len(metadata)
+            for column in columns_cellprofiler.keys()
+            if column != "relpath"
+        }
+    )
+    df.insert(0, "relpath", [f"P/B/1_regions/r{i}.tif" for i in range(len(metadata))])
+    df["metadata"] = [json.dumps(m) for m in metadata]
+    return df
+
+
+class TestFormat(unittest.TestCase):
+    def setUp(self):
+        self.metadata = [
+            {"include": True, "score": 1, "note": "faint"},
+            {"include": False, "score": 2.5},
+            {"tags": ["a", "b"]},
+        ]
+        self.df = make_regions(self.metadata)
+
+    def test_format_01(self):
+        chunks = [self.df.iloc[:2], self.df.iloc[2:]]
+        dtypes = scan_metadata(chunks)
+        self.assertEqual(
+            dtypes,
+            {
+                "include": "boolean",
+                "score": "Float64",
+                "note": "string",
+                "tags": "string",
+            },
+        )
+
+    def test_format_02(self):
+        dtypes = scan_metadata([self.df])
+        df = decode_metadata(self.df["metadata"], dtypes)
+
+        self.assertEqual(list(df.columns), ["Include", "Score", "Note", "Tags"])
+        self.assertEqual(list(df["Include"]), [True, False, False])
+        self.assertTrue(pandas.isna(df["Score"].iloc[2]))
+        self.assertEqual(df["Tags"].iloc[2], '["a", "b"]')
+
+        # missing text is NA, not "nan" or "None", and written as empty cells
+        self.assertEqual(df["Note"].iloc[0], "faint")
+        self.assertTrue(df["Note"].iloc[1:].isna().all())
+        self.assertEqual(df.to_csv(index=False).splitlines()[2], "False,2.5,,")
+
+    def test_format_03(self):
+        dtypes = scan_metadata([self.df])
+        df = format_chunk(self.df, dtypes)
+
+        self.assertEqual(df.columns[0], "Filename")
+        self.assertEqual(list(df["Filename"]), ["r0.tif", "r1.tif", "r2.tif"])
+        self.assertEqual(len(df.columns), len(columns_cellprofiler) + 4)
+
+    def test_format_04(self):
+        # blocks with different metadata keys, and images in both
+        blocks = [
+            pandas.DataFrame(
+                {
+                    "Filename": ["a.tif", "b.tif", "a.tif", "c.tif"],
+                    "Panel": ["HE", "CD3", "HE", "HE"],
+                    "Include": [True, True, False, True],
+                }
+            ),
+            pandas.DataFrame(
+                {
+                    "Filename": ["c.tif", "d.tif", "e.tif"],
+                    "Panel": ["HE", "CD3", "CD3"],
+                    "Score": [1.0, 2.0, 3.0],
+                }
+            ),
+        ]
+
+        with tempfile.TemporaryDirectory() as dirpath:
+            paths = []
+            for i, df in enumerate(blocks):
+                paths.append(os.path.join(dirpath, f"BLK{i}.csv"))
+                df.to_csv(paths[-1], index=False)
+
+            project = SimpleNamespace(name="PRJ1", relpath=dirpath)
+            formatter = ProjectFormatter(project, chunksize=2)
+            field = Field.CELLPROFILER_IMAGE_INPUT
+            formatter.merge(field, paths)
+
+            # the first of each file name is kept, across chunks and blocks
+            merged = pandas.read_csv(formatter.path(field))
+            self.assertEqual(
+                list(merged.columns), ["Filename", "Panel", "Include", "Score"]
+            )
+            self.assertEqual(
+                list(merged["Filename"]), ["a.tif", "b.tif", "c.tif", "d.tif", "e.tif"]
+            )
+            self.assertEqual(list(merged["Include"].iloc[:3]), [True, True, True])
+            self.assertTrue(merged["Score"].iloc[:3].isna().all())
+
+            # and one file per panel, with the same columns
+            for panel, filenames in [
+                ("HE", ["a.tif", "c.tif"]),
+                ("CD3", ["b.tif", "d.tif", "e.tif"]),
+            ]:
+                df = pandas.read_csv(formatter.path(field, panel))
+                self.assertEqual(list(df.columns), list(merged.columns))
+                self.assertEqual(list(df["Filename"]), filenames)
+                self.assertTrue((df["Panel"] == panel).all())
+
+            self.assertEqual(
+                sorted(f for f in os.listdir(dirpath) if not f.startswith("BLK")),
+                sorted(f"{field.value}{suffix}.csv" for suffix in ["", "_HE", "_CD3"]),
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+
+import numpy
+
+from antilles.pipeline.histogram import (
+    RadialHistogram,
+    defaults,
+    histogram_tile,
+)
+from antilles.pipeline.profile import get_bow, get_tiles
+
+
+def make_region(size: int = 200) -> numpy.ndarray:
+    # brightness falls off with distance from the center of the image
+    yy, xx = numpy.mgrid[:size, :size]
+    rho = numpy.hypot(xx - size // 2, yy - size // 2)
+    values = numpy.clip(255 - rho, 0, 255).astype(numpy.uint8)
+    return numpy.repeat(values[:, :, numpy.newaxis], 3, axis=2)
+
+
+region = {
+    "relpath": "P/B/region.tif",
+    "center_x": 100,
+    "center_y": 100,
+    "well_x": 120,
+    "well_y": 100,
+    "mpp": 1.0,
+}
+params = {
+    **defaults,
+    "bin_width": 2.0,
+    "max_distance": 60.0,
+    "angle_bins": 36,
+    "value_bins": 32,
+}
+
+
+class TestHistogram(unittest.TestCase):
+    def setUp(self):
+        self.image = make_region()
+        self.bow = get_bow(region, {**params, "span": 360.0})
+        self.counts = histogram_tile(self.image, (0, 0), self.bow, params)
+        self.histogram = RadialHistogram(self.counts.astype(numpy.uint32), params)
+
+    def test_histogram_01(self):
+        self.assertEqual(self.counts.shape, (30, 36, 32))
+
+        # tiles add up to the whole region
+        tiled = numpy.zeros_like(self.counts)
+        for (x, y), (w, h) in get_tiles((200, 200), self.bow, 64):
+            tile = self.image[y : y + h, x : x + w]
+            tiled += histogram_tile(tile, (x, y), self.bow, params)
+        numpy.testing.assert_array_equal(tiled, self.counts)
+
+    def test_histogram_02(self):
+        # any band and sector on bin edges is the sum of its bins
+        counts = self.histogram.counts([0, 10, 30, 60], [-180, -40, 40, 180])
+        self.assertEqual(counts.shape, (3, 3, 32))
+        numpy.testing.assert_array_equal(
+            counts[1, 1], self.counts[5:15, 14:22].sum(axis=(0, 1))
+        )
+        self.assertEqual(counts.sum(), self.counts.sum())
+
+    def test_histogram_03(self):
+        df = self.histogram.profile([0, 10, 20, 30], [-45, 45])
+        self.assertEqual(len(df), 3)
+        self.assertEqual(list(df["distance_min"]), [0, 10, 20])
+
+        # binned means are within a bin of the exact means of the pixels
+        exact = []
+        yy, xx = numpy.mgrid[:200, :200]
+        rho = numpy.hypot(xx - 100, yy - 100)
+        theta = numpy.degrees(numpy.arctan2(yy - 100, xx - 100))
+        for d0 in [0, 10, 20]:
+            mask = (rho >= 20 + d0) & (rho < 30 + d0) & (numpy.abs(theta) < 45)
+            exact.append(self.image[mask].mean())
+        numpy.testing.assert_allclose(df["intensity"], exact, atol=256 / 32)
+        self.assertTrue((numpy.diff(df["intensity"].to_numpy()) < 0).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
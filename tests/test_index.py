@@ -0,0 +1,95 @@
+import os
+import re
+import tempfile
+import unittest
+
+from antilles.utils.index import FileIndex
+
+
+class TestFileIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dirpath = self.tmpdir.name
+        self.regex = re.compile(r"(?P<sample>SMP\d+)_(?P<drug>[A-Z]+)\.tif")
+
+        for sample in ["SMP1", "SMP2"]:
+            os.makedirs(os.path.join(self.dirpath, sample))
+            for drug in ["DOX", "VEH"]:
+                self.touch(sample, f"{sample}_{drug}.tif")
+        self.touch("SMP1", "notes.txt")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def touch(self, *parts):
+        with open(os.path.join(self.dirpath, *parts), "w"):
+            pass
+
+    def test_index_01(self):
+        index = FileIndex(self.dirpath, recursive=True)
+        self.assertEqual(len(index.files()), 5)
+        self.assertEqual(len(index.match(self.regex)), 4)
+
+    def test_index_02(self):
+        index = FileIndex(self.dirpath, recursive=False)
+        self.assertEqual(index.files(), [])
+
+    def test_index_03(self):
+        index = FileIndex(self.dirpath, recursive=True)
+        found = index.find(self.regex, sample="SMP2", drug="VEH")
+        self.assertEqual([e["file"]["name"] for e in found], ["SMP2_VEH.tif"])
+        self.assertEqual(index.find(self.regex, sample="SMP3"), [])
+
+    def test_index_04(self):
+        index = FileIndex(self.dirpath, recursive=True)
+        index.refresh()
+        version = index.version
+
+        index.refresh()
+        self.assertEqual(index.version, version)
+
+        self.touch("SMP2", "SMP2_GEM.tif")
+        self.assertEqual(len(index.find(self.regex, sample="SMP2")), 3)
+        self.assertGreater(index.version, version)
+
+    def test_index_05(self):
+        index = FileIndex(self.dirpath, recursive=True)
+        (entry,) = index.find(self.regex, sample="SMP1", drug="DOX")
+        self.assertEqual(entry["file"]["size"], 0)
+        version = index.version
+
+        # overwritten in place, leaving the directory as it was, so files are
+        # not stat'ed again on refresh
+        dirpath = os.path.join(self.dirpath, "SMP1")
+        stat = os.stat(dirpath)
+        with open(os.path.join(dirpath, "SMP1_DOX.tif"), "w") as file:
+            file.write("pixels")
+        os.utime(dirpath, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        (entry,) = index.find(self.regex, sample="SMP1", drug="DOX")
+        self.assertEqual(entry["file"]["size"], 0)
+        self.assertEqual(index.version, version)
+
+    def test_index_06(self):
+        index = FileIndex(self.dirpath, recursive=True)
+        entries = [e["file"] for e in index.find(self.regex, sample="SMP1")]
+        self.assertEqual(index.memoize(entries, "length", os.path.getsize), [0, 0])
+        entries[0]["other"] = "value"
+
+        dirpath = os.path.join(self.dirpath, "SMP1")
+        stat = os.stat(dirpath)
+        with open(os.path.join(dirpath, "SMP1_DOX.tif"), "w") as file:
+            file.write("pixels")
+        os.utime(dirpath, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        # values memoized for the old file are dropped when next used
+        self.assertEqual(index.memoize(entries, "length", os.path.getsize), [6, 0])
+        self.assertEqual(entries[0]["size"], 6)
+        self.assertNotIn("other", entries[0])
+
+        entry, _ = index.find(self.regex, sample="SMP1")
+        self.assertEqual(entry["file"]["size"], 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from os.path import join
+from unittest import mock
+
+from antilles.utils import io
+from antilles.utils.io import (
+    DAO,
+    configure,
+    get_basepath,
+    get_config,
+    get_sample_prefix,
+    init_worker,
+    load_config,
+)
+
+# the environment, without any settings of the user
+environ = {k: v for k, v in os.environ.items() if not k.startswith("ANTILLES_")}
+
+
+def write_config(dirpath: str, name: str, **settings) -> str:
+    path = join(dirpath, name)
+    with open(path, "w") as file:
+        json.dump(settings, file)
+    return path
+
+
+def get_settings():
+    return get_basepath(), get_sample_prefix()
+
+
+class TestIO(unittest.TestCase):
+    def test_io_01(self):
+        # the file is replaced only once the block exits without error
+        with tempfile.TemporaryDirectory() as dirpath:
+            path = join(dirpath, "data.txt")
+            with open(path, "w") as file:
+                file.write("old")
+
+            with DAO.atomic(path) as tmppath:
+                with open(tmppath, "w") as file:
+                    file.write("new")
+                with open(path) as file:
+                    self.assertEqual(file.read(), "old")
+            with open(path) as file:
+                self.assertEqual(file.read(), "new")
+
+            with self.assertRaises(ValueError):
+                with DAO.atomic(path) as tmppath:
+                    with open(tmppath, "w") as file:
+                        file.write("partial")
+                    raise ValueError()
+            with open(path) as file:
+                self.assertEqual(file.read(), "new")
+            self.assertEqual(os.listdir(dirpath), ["data.txt"])
+
+    def test_io_02(self):
+        # re-entrant within a thread, exclusive between threads
+        with tempfile.TemporaryDirectory() as dirpath:
+            path = join(dirpath, "data.txt")
+            errors = []
+
+            def take():
+                try:
+                    with DAO.lock(path, timeout=0.2):
+                        pass
+                except TimeoutError as error:
+                    errors.append(error)
+
+            with DAO.lock(path):
+                with DAO.lock(path):
+                    pass
+                thread = threading.Thread(target=take)
+                thread.start()
+                thread.join()
+            self.assertEqual(len(errors), 1)
+
+            # and free once released
+            thread = threading.Thread(target=take)
+            thread.start()
+            thread.join()
+            self.assertEqual(len(errors), 1)
+
+    def test_io_03(self):
+        # config.json is found next to the package, wherever this is run from
+        root = os.path.dirname(os.path.dirname(os.path.abspath(io.__file__)))
+        self.assertEqual(io.CONFIG, join(os.path.dirname(root), "config.json"))
+
+        # an explicit path, then $ANTILLES_CONFIG, then the default
+        with tempfile.TemporaryDirectory() as dirpath:
+            default = write_config(dirpath, "default.json", sample_prefix="DEF")
+            env = write_config(dirpath, "env.json", sample_prefix="ENV")
+            path = write_config(dirpath, "path.json", sample_prefix="PTH")
+
+            with mock.patch.object(io, "CONFIG", default):
+                with mock.patch.dict(os.environ, environ, clear=True):
+                    self.assertEqual(load_config().sample_prefix, "DEF")
+                    os.environ["ANTILLES_CONFIG"] = env
+                    self.assertEqual(load_config().sample_prefix, "ENV")
+                    self.assertEqual(load_config(path).sample_prefix, "PTH")
+
+                    # and the defaults without any
+                    os.environ["ANTILLES_CONFIG"] = join(dirpath, "missing.json")
+                    self.assertEqual(load_config().sample_prefix, "SMP")
+
+    def test_io_04(self):
+        # environment variables, then keywords, replace values in the file
+        with tempfile.TemporaryDirectory() as dirpath:
+            path = write_config(
+                dirpath, "config.json", basepath="/data", sample_prefix="CFG", x=1
+            )
+
+            with mock.patch.dict(os.environ, environ, clear=True):
+                config = load_config(path)
+                self.assertEqual(config.basepath, "/data")
+                self.assertEqual(config.get("x"), 1)
+
+                os.environ["ANTILLES_SAMPLE_PREFIX"] = "ENV"
+                self.assertEqual(load_config(path).sample_prefix, "ENV")
+
+                config = load_config(path, sample_prefix="KWD", basepath=None)
+                self.assertEqual(config.sample_prefix, "KWD")
+                self.assertEqual(config.basepath, "/data")
+
+    def test_io_05(self):
+        # settings of the parent reach pool workers, however they are started
+        with tempfile.TemporaryDirectory() as dirpath:
+            config = configure(basepath=dirpath, sample_prefix="WRK")
+            try:
+                for method in multiprocessing.get_all_start_methods():
+                    with ProcessPoolExecutor(
+                        max_workers=1,
+                        mp_context=multiprocessing.get_context(method),
+                        initializer=init_worker,
+                        initargs=(config.to_dict(),),
+                    ) as pool:
+                        settings = pool.submit(get_settings).result()
+                    self.assertEqual(settings, (dirpath, "WRK"), method)
+            finally:
+                configure()
+            self.assertIsNot(get_config(), config)
+
+
+if __name__ == "__main__":
+    unittest.main()
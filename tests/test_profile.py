@@ -0,0 +1,90 @@
+import unittest
+
+import numpy
+
+from antilles.pipeline.profile import get_bow, get_tiles, profile_tile, to_frame
+
+
+def make_region(size: int = 200) -> numpy.ndarray:
+    # brightness falls off with distance from the center of the image
+    yy, xx = numpy.mgrid[:size, :size]
+    rho = numpy.hypot(xx - size // 2, yy - size // 2)
+    values = numpy.clip(255 - rho, 0, 255).astype(numpy.uint8)
+    return numpy.repeat(values[:, :, numpy.newaxis], 3, axis=2)
+
+
+region = {
+    "relpath": "P/B/region.tif",
+    "project": "P",
+    "block": "B",
+    "panel": "HE",
+    "level": 0,
+    "sample": "S",
+    "drug": "D",
+    "center_x": 100,
+    "center_y": 100,
+    "well_x": 120,  # the well is 20 px right of the center
+    "well_y": 100,
+    "mpp": 1.0,
+}
+params = {
+    "bin_width": 10.0,
+    "max_distance": 50.0,
+    "span": 90.0,
+    "angle_bins": 2,
+    "stains": "hed",
+}
+
+
+class TestProfile(unittest.TestCase):
+    def test_profile_01(self):
+        bow = get_bow(region, params)
+        self.assertEqual(bow["angle"], 0.0)
+        self.assertEqual((bow["r_well"], bow["bin_width"]), (20.0, 10.0))
+        self.assertEqual((bow["n_distances"], bow["n_angles"]), (5, 2))
+
+        # the band is 20 to 70 px from the center, so tiles in the corners
+        # are skipped, and so is the tile within 20 px of the center
+        tiles = list(get_tiles((200, 200), bow, 25))
+        self.assertNotIn(((0, 0), (25, 25)), tiles)
+        self.assertIn(((125, 100), (25, 25)), tiles)
+        self.assertLess(len(tiles), 64)
+
+    def test_profile_02(self):
+        image = make_region()
+        bow = get_bow(region, params)
+
+        # binning tile by tile is the same as binning the whole region
+        counts, sums = profile_tile(image, (0, 0), bow, "hed")
+        tiled_counts, tiled_sums = numpy.zeros_like(counts), numpy.zeros_like(sums)
+        for (x, y), (w, h) in get_tiles((200, 200), bow, 64):
+            c, s = profile_tile(image[y : y + h, x : x + w], (x, y), bow, "hed")
+            tiled_counts += c
+            tiled_sums += s
+        numpy.testing.assert_array_equal(counts, tiled_counts)
+        numpy.testing.assert_allclose(sums, tiled_sums, rtol=1e-6)
+
+        df = to_frame(region, bow, counts, sums, params)
+        self.assertEqual(len(df), 10)
+        self.assertEqual(list(df["distance"].unique()), [5.0, 15.0, 25.0, 35.0, 45.0])
+        self.assertEqual(list(df["angle"].unique()), [-22.5, 22.5])
+        self.assertTrue((df["relpath"] == region["relpath"]).all())
+
+        # the bins are symmetric about the bow, but for the pixels on its axis,
+        # and darken away from the well
+        left, right = df[df["angle"] < 0], df[df["angle"] > 0]
+        n_left, n_right = left["n_pixels"].to_numpy(), right["n_pixels"].to_numpy()
+        numpy.testing.assert_array_equal(n_right - n_left, 10)
+        self.assertTrue((numpy.diff(left["intensity"].to_numpy()) < 0).all())
+        self.assertTrue((numpy.diff(left["hematoxylin"].to_numpy()) > 0).all())
+
+    def test_profile_03(self):
+        # a tile entirely outside the band adds nothing
+        bow = get_bow(region, params)
+        counts, sums = profile_tile(make_region()[:20, :20], (0, 0), bow, "hed")
+        self.assertEqual(counts.sum(), 0)
+        self.assertEqual(sums.shape, (10, 7))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas
+
+from antilles.block import Field
+from antilles.project import Project, compile_regex
+from antilles.utils.io import DAO, configure
+
+
+def make_config(samples: int) -> dict:
+    return {
+        "name": "PRJ1",
+        "image_regex": r"(?P<project>PRJ1)_(?P<block>BLK\d)_(?P<panel>\w+)\.tif",
+        "region_regex": r"(?P<sample>\w+)_(?P<drug>\w+)\.tif",
+        "output_order": ["project", "block", "sample", "drug"],
+        "blocks": [
+            {"name": "BLK1", "device": "DEV1", "samples": samples},
+            {"name": "BLK2", "device": "DEV1", "samples": 1},
+        ],
+        "devices": [],
+    }
+
+
+class TestProject(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        configure(basepath=self.tmpdir.name)
+
+        for name in ["BLK1", "BLK2"]:
+            os.makedirs(os.path.join(self.tmpdir.name, "PRJ1", name))
+        self.write(make_config(samples=2))
+
+    def tearDown(self):
+        configure()
+        self.tmpdir.cleanup()
+
+    def write(self, config: dict) -> None:
+        filepath = os.path.join(self.tmpdir.name, "PRJ1", Project.filename)
+        stat = os.stat(filepath) if os.path.exists(filepath) else None
+        with open(filepath, "w") as file:
+            json.dump(config, file)
+        if stat is not None:
+            # a later mtime, even on coarse file systems
+            mtime = stat.st_mtime_ns + 10**9
+            os.utime(filepath, ns=(mtime, mtime))
+
+    def test_project_01(self):
+        # parsed once, and again only when project.json changes
+        with mock.patch.object(DAO, "read_json", wraps=DAO.read_json) as read:
+            project = Project("PRJ1")
+            for _ in range(3):
+                self.assertEqual(len(project.config["blocks"]), 2)
+            self.assertEqual(read.call_count, 1)
+
+            self.write(make_config(samples=3))
+            self.assertEqual(project.config["blocks"][0]["samples"], 3)
+            project.config
+            self.assertEqual(read.call_count, 2)
+
+    def test_project_02(self):
+        # the parsed configuration cannot be changed through config
+        project = Project("PRJ1")
+        project.config["blocks"].clear()
+        project.config["image_regex"] = "other"
+        self.assertEqual(len(project.config["blocks"]), 2)
+        self.assertEqual(len(project.blocks), 2)
+
+        block = project.block("BLK1")
+        project.config["blocks"][0]["samples"] = 5
+        self.assertEqual(len(block.samples), 2)
+
+    def test_project_03(self):
+        # blocks are built on first access, and kept across changes
+        project = Project("PRJ1")
+        self.assertEqual(project._blocks, {})
+
+        block = project.block("BLK1")
+        self.assertEqual(list(project._blocks.keys()), ["BLK1"])
+        self.assertIs(project.block("BLK1"), block)
+        with self.assertRaises(ValueError):
+            project.block("BLK3")
+
+        block.snapshots[Field.IMAGES_COORDS] = pandas.DataFrame()
+        block.versions[Field.IMAGES_COORDS] = "v1"
+
+        self.write(make_config(samples=3))
+        self.assertIs(project.block("BLK1"), block)
+        self.assertEqual(len(block.samples), 3)
+        self.assertIn(Field.IMAGES_COORDS, block.snapshots)
+        self.assertEqual(block.versions[Field.IMAGES_COORDS], "v1")
+
+        # and dropped along with their configuration
+        config = make_config(samples=3)
+        del config["blocks"][0]
+        self.write(config)
+        with self.assertRaises(ValueError):
+            project.block("BLK1")
+
+    def test_project_04(self):
+        # regexes are compiled once
+        project = Project("PRJ1")
+        self.assertIs(project.image_regex, project.image_regex)
+        self.assertIs(
+            project.region_regex, compile_regex(project.config["region_regex"])
+        )
+
+        self.write(make_config(samples=3))
+        hits = compile_regex.cache_info().hits
+        project.image_regex
+        self.assertEqual(compile_regex.cache_info().hits, hits + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import tempfile
+import unittest
+
+import numpy
+import pandas
+import tifffile
+from PIL import Image
+
+from antilles.utils.io import configure
+from antilles.utils.regions import RegionReader
+from antilles.utils.slides import get_catalog
+
+src = os.path.join("PRJ1", "slide.tif")
+
+
+def make_manifest() -> pandas.DataFrame:
+    # a region inside the slide, and one running off its right edge
+    return pandas.DataFrame(
+        [
+            {
+                "relpath": os.path.join("PRJ1", "1_regions", "inside.tif"),
+                "src": src,
+                "level": 0,
+                "origin_x": 40,
+                "origin_y": 30,
+                "width": 100,
+                "height": 80,
+            },
+            {
+                "relpath": os.path.join("PRJ1", "1_regions", "edge.tif"),
+                "src": src,
+                "level": 0,
+                "origin_x": 250,
+                "origin_y": 100,
+                "width": 70,
+                "height": 50,
+            },
+        ]
+    )
+
+
+class TestRegionReader(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        configure(basepath=cls.tmpdir.name)
+
+        rng = numpy.random.default_rng(0)
+        cls.slide = rng.integers(0, 256, (200, 300, 3), dtype=numpy.uint8)
+        # a tiled tif, which OpenSlide reads as a generic slide
+        os.makedirs(os.path.join(cls.tmpdir.name, "PRJ1"))
+        tifffile.imwrite(
+            os.path.join(cls.tmpdir.name, src),
+            cls.slide,
+            tile=(64, 64),
+            photometric="rgb",
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        get_catalog(src).flush()
+        configure()
+        cls.tmpdir.cleanup()
+
+    def setUp(self):
+        self.reader = RegionReader(make_manifest())
+        self.inside, self.edge = self.reader.names()
+
+    def test_regions_01(self):
+        self.assertIn(self.inside, self.reader)
+        self.assertNotIn(src, self.reader)
+        self.assertEqual(self.reader.size(self.inside), (100, 80))
+        self.assertEqual(self.reader.size(self.edge), (70, 50))
+
+        region = self.reader.read(self.inside)
+        numpy.testing.assert_array_equal(region, self.slide[30:110, 40:140])
+
+        window = self.reader.read(self.inside, x=10, y=20, width=30, height=40)
+        numpy.testing.assert_array_equal(window, self.slide[50:90, 50:80])
+
+        with self.assertRaises(ValueError):
+            self.reader.read(self.inside, x=90, width=20)
+        with self.assertRaises(ValueError):
+            self.reader.read(self.inside, y=-1)
+
+    def test_regions_02(self):
+        # pixels off the slide are black
+        region = self.reader.read(self.edge)
+        numpy.testing.assert_array_equal(region[:, :50], self.slide[100:150, 250:])
+        self.assertFalse(region[:, 50:].any())
+
+        # tiles cover the region once, cropped at its edges
+        out = numpy.zeros_like(region)
+        for (x, y), tile in self.reader.tiles(self.edge, (32, 32)):
+            self.assertLessEqual(x + tile.shape[1], 70)
+            self.assertLessEqual(y + tile.shape[0], 50)
+            out[y : y + tile.shape[0], x : x + tile.shape[1]] = tile
+        numpy.testing.assert_array_equal(out, region)
+
+    def test_regions_03(self):
+        thumbnail = self.reader.thumbnail(self.inside, (50, 40))
+        self.assertEqual(thumbnail.size, (50, 40))
+        expected = Image.fromarray(self.slide[30:110, 40:140])
+        expected = expected.resize((50, 40), Image.LANCZOS)
+        numpy.testing.assert_array_equal(numpy.asarray(thumbnail), expected)
+
+    def test_regions_04(self):
+        # tifs are written where extraction would have put them
+        self.assertEqual(self.reader.export(), [self.inside, self.edge])
+        for relpath in self.reader.names():
+            with Image.open(os.path.join(self.tmpdir.name, relpath)) as image:
+                numpy.testing.assert_array_equal(
+                    numpy.asarray(image), self.reader.read(relpath)
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+import os
+import re
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import numpy
+import pandas
+from PIL import Image
+from scipy import ndimage
+
+from antilles.block import Block, Field
+from antilles.pipeline.register import (
+    Registrar,
+    get_reference,
+    propagate,
+    columns_matrix,
+)
+from antilles.utils.io import configure
+from antilles.utils.slides import get_catalog
+from antilles.utils.registration import (
+    estimate_transform,
+    rotation_about,
+    transform,
+    translation,
+)
+from antilles.wholeslideimage import WholeSlideImage
+
+
+def make_thumbnail() -> numpy.ndarray:
+    # sections of different shapes, and a strip of tissue between them
+    rng = numpy.random.default_rng(1)
+    image = numpy.zeros((200, 260))
+    yy, xx = numpy.mgrid[:200, :260]
+    for cx, cy, r in [(60, 70, 25), (150, 60, 18), (190, 140, 30), (90, 150, 12)]:
+        image[(numpy.abs(xx - cx) < r) & (numpy.abs(yy - cy) < r / 2)] = 0.6
+    image[40:160, 120:128] = 0.4
+    image += rng.normal(0, 0.02, image.shape)
+    return ndimage.gaussian_filter(image, 1)
+
+
+params = {"rotation": True, "upsample": 10}
+
+
+class TestRegister(unittest.TestCase):
+    def test_register_01(self):
+        reference = make_thumbnail()
+        points = numpy.array([[60, 70, 1.0], [190, 140, 1.0], [120, 100, 1.0]]).T
+
+        for angle, tx, ty in [(0.0, 5, -8), (12.0, 10, 4), (-20.0, -6, 3)]:
+            truth = translation(tx, ty) @ rotation_about(angle, (130, 100))
+            moving = transform(reference, numpy.linalg.inv(truth))
+
+            matrix, quality = estimate_transform(reference, moving, params)
+            numpy.testing.assert_allclose(matrix @ points, truth @ points, atol=2.0)
+            self.assertGreater(quality, 0.9)
+
+        # unrelated tissue aligns poorly
+        other = numpy.random.default_rng(2).random((200, 260))
+        _, quality = estimate_transform(reference, other, params)
+        self.assertLess(quality, 0.5)
+
+    def test_register_02(self):
+        coords = pandas.DataFrame(
+            {
+                "relpath": ["a.svs", "a.svs", "b.svs", "b.svs", "c.svs", "c.svs"],
+                "sample": ["S1", "S2", "S2", "S1", "S1", "S2"],
+                "center_x": [100, 300, 0, 0, 5, 5],
+                "center_y": [200, 400, 0, 0, 5, 5],
+            }
+        )
+        # b is a's turned a quarter clockwise, and shifted; c aligned poorly
+        matrix = {"b.svs": [0.0, -1.0, 1000.0, 1.0, 0.0, 10.0], "c.svs": [0.0] * 6}
+        registration = pandas.DataFrame(
+            [
+                {"relpath": r, **dict(zip(columns_matrix, m)), "flagged": r == "c.svs"}
+                for r, m in matrix.items()
+            ]
+        )
+
+        out = propagate(coords, registration, "a.svs")
+        self.assertEqual(out.loc[2:3, "center_x"].tolist(), [600, 800])
+        self.assertEqual(out.loc[2:3, "center_y"].tolist(), [310, 110])
+        self.assertEqual(out.loc[4:5, "center_x"].tolist(), [5, 5])
+        self.assertTrue(out.loc[:1].equals(coords.loc[:1]))
+
+    def test_register_03(self):
+        slides = [
+            WholeSlideImage("P", "B", "KI67", 2, "b.svs"),
+            WholeSlideImage("P", "B", "HE", 2, "c.svs"),
+            WholeSlideImage("P", "B", "KI67", 1, "a.svs"),
+        ]
+        self.assertEqual(get_reference(slides).relpath, "a.svs")
+        self.assertEqual(get_reference(slides, {"panel": "HE"}).relpath, "c.svs")
+        self.assertEqual(get_reference(slides, {"level": 2}).relpath, "c.svs")
+        with self.assertRaises(ValueError):
+            get_reference(slides, {"panel": "CD8"})
+
+    def test_register_04(self):
+        # only the slides asked for are mapped, and only samples the
+        # reference has
+        coords = pandas.DataFrame(
+            {
+                "relpath": ["a.svs", "b.svs", "b.svs", "c.svs"],
+                "sample": ["S1", "S1", "S2", "S1"],
+                "center_x": [100, 0, 7, 9],
+                "center_y": [200, 0, 7, 9],
+            }
+        )
+        registration = pandas.DataFrame(
+            [
+                {"relpath": r, **dict(zip(columns_matrix, m)), "flagged": False}
+                for r, m in [
+                    ("b.svs", [1.0, 0.0, 10.0, 0.0, 1.0, 20.0]),
+                    ("c.svs", [1.0, 0.0, 10.0, 0.0, 1.0, 20.0]),
+                ]
+            ]
+        )
+
+        out = propagate(coords, registration, "a.svs", relpaths={"b.svs"})
+        self.assertEqual(out["center_x"].tolist(), [100, 110, 7, 9])
+        self.assertEqual(out["center_y"].tolist(), [200, 220, 7, 9])
+
+    def test_register_05(self):
+        # arrows stored for a slide are kept, unless overwritten
+        with tempfile.TemporaryDirectory() as dirpath:
+            configure(basepath=dirpath)
+            images = os.path.join(dirpath, "PRJ1", "BLK1", "0_slides")
+            os.makedirs(images)
+            image = numpy.full((200, 260, 3), 240, dtype=numpy.uint8)
+            image[make_thumbnail() > 0.3] = (200, 120, 170)
+            for panel in ["HE", "CD3", "KI67"]:
+                Image.fromarray(image).save(
+                    os.path.join(images, f"PRJ1_BLK1_{panel}_1.tif")
+                )
+
+            regex = (
+                r"(?P<project>[^_]+)_(?P<block>[^_]+)_(?P<panel>[^_]+)_(?P<level>\d)"
+            )
+            project = SimpleNamespace(
+                name="PRJ1",
+                relpath="PRJ1",
+                config={},
+                image_regex=re.compile(regex + r"\.tif$"),
+            )
+            block = Block({"name": "BLK1", "device": "DEV1", "samples": 1}, project)
+            registrar = Registrar(project, block, {"reference": {"panel": "HE"}}, 1)
+            try:
+                coords = block.get(Field.IMAGES_COORDS)
+                ki67 = coords["panel"] == "KI67"
+                coords.loc[ki67, ["center_x", "center_y"]] = 5
+                block.save(coords[ki67], Field.IMAGES_COORDS)
+
+                registrar.run()
+                coords = block.get(Field.IMAGES_COORDS).set_index("panel")
+                he = coords.loc["HE", ["center_x", "center_y"]].tolist()
+                self.assertEqual(coords.loc["KI67", "center_x"], 5)
+                numpy.testing.assert_allclose(
+                    coords.loc["CD3", ["center_x", "center_y"]].tolist(), he, atol=1
+                )
+
+                registrar.run(overwrite=True)
+                coords = block.get(Field.IMAGES_COORDS).set_index("panel")
+                numpy.testing.assert_allclose(
+                    coords.loc["KI67", ["center_x", "center_y"]].tolist(), he, atol=1
+                )
+            finally:
+                get_catalog("PRJ1").flush()
+                configure()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import tempfile
+import threading
+import unittest
+from os.path import join
+
+import numpy
+from PIL import Image
+
+from antilles.utils.io import DAO
+from antilles.utils.slides import SlidePool, SlideCatalog
+
+
+class Handle:
+    def __init__(self, path: str):
+        self.path = path
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class Pool(SlidePool):
+    def open(self, path: str) -> Handle:
+        return Handle(path)
+
+
+class TestSlidePool(unittest.TestCase):
+    def test_pool_01(self):
+        pool = Pool(max_handles=2)
+        with pool.checkout("/a") as a:
+            pass
+        with pool.checkout("/a") as b:
+            self.assertIs(a, b)
+        self.assertEqual(pool.n_open, 1)
+
+    def test_pool_02(self):
+        pool = Pool(max_handles=1)
+        with pool.checkout("/a") as a:
+            with pool.checkout("/a") as b:
+                self.assertIsNot(a, b)
+            self.assertEqual(pool.n_open, 1)
+            self.assertTrue(b.closed)
+        self.assertFalse(a.closed)
+
+    def test_pool_03(self):
+        pool = Pool(max_handles=2)
+        handles = {}
+        for path in ["/a", "/b", "/a", "/c"]:
+            with pool.checkout(path) as obj:
+                handles[path] = obj
+
+        # /b was least recently used
+        self.assertTrue(handles["/b"].closed)
+        self.assertFalse(handles["/a"].closed)
+        self.assertEqual(set(pool.idle.keys()), {"/a", "/c"})
+
+    def test_pool_04(self):
+        pool = Pool(max_handles=4)
+        barrier = threading.Barrier(3)
+        seen = []
+
+        def work():
+            with pool.checkout("/a") as obj:
+                seen.append(obj)
+                barrier.wait()
+
+        threads = [threading.Thread(target=work) for _ in range(3)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+
+        # each thread had its own handle
+        self.assertEqual(len(set(map(id, seen))), 3)
+        pool.clear()
+        self.assertEqual(pool.n_open, 0)
+
+
+class TestSlideCatalog(unittest.TestCase):
+    def test_catalog_01(self):
+        with tempfile.TemporaryDirectory() as project:
+            paths = []
+            for name, size in [("a.png", (30, 20)), ("b.png", (40, 10))]:
+                paths.append(join(project, name))
+                Image.fromarray(numpy.zeros(size[::-1], dtype=numpy.uint8)).save(
+                    paths[-1]
+                )
+
+            # two processes, each with its own view of the catalog
+            catalog_a, catalog_b = SlideCatalog(project), SlideCatalog(project)
+            self.assertEqual(catalog_a.get(paths[0])["dims"], [30, 20])
+            self.assertEqual(catalog_b.get(paths[1])["dims"], [40, 10])
+
+            # entries are only written when flushed, and merged on write
+            self.assertFalse(DAO.is_file(catalog_a.path))
+            catalog_a.flush()
+            catalog_b.flush()
+            stored = DAO.read_json(catalog_a.path)
+            self.assertEqual(set(stored.keys()), set(paths))
+
+            # nothing new to write
+            catalog_b.flush()
+            self.assertEqual(catalog_b.pending, {})
+            self.assertEqual(SlideCatalog(project).get(paths[0])["dims"], [30, 20])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import tempfile
+import unittest
+
+import numpy
+import pandas
+
+from antilles.utils.spatial import ObjectIndex, to_bow_coords
+
+
+def make_objects(n: int, seed: int):
+    # objects scattered around a bow pointing right from (0, 0) to (100, 0)
+    rng = numpy.random.default_rng(seed)
+    r = rng.uniform(0, 600, n)
+    a = rng.uniform(-180, 180, n)
+    x = r * numpy.cos(numpy.radians(a))
+    y = r * numpy.sin(numpy.radians(a))
+    return x, y
+
+
+class TestSpatial(unittest.TestCase):
+    def setUp(self):
+        relpaths = [f"P/B/region_{i}.tif" for i in range(5)]
+        self.regions = pandas.DataFrame(
+            {
+                "relpath": relpaths,
+                "center_x": 0.0,
+                "center_y": 0.0,
+                "well_x": 100.0,
+                "well_y": 0.0,
+                "mpp": 0.5,
+            }
+        )
+        objects = []
+        for i, relpath in enumerate(relpaths[:-1]):  # the last region is empty
+            x, y = make_objects(200 * (i + 1), seed=i)
+            objects.append(pandas.DataFrame({"relpath": relpath, "x": x, "y": y}))
+        self.objects = pandas.concat(objects, ignore_index=True)
+        self.coords = to_bow_coords(self.objects, self.regions)
+
+    def expected(self, edges, sectors=None):
+        counts = numpy.zeros(
+            (5, len(edges) - 1, 1 if sectors is None else len(sectors) - 1), dtype=int
+        )
+        for i, relpath in enumerate(self.regions["relpath"]):
+            df = self.coords[self.coords["relpath"] == relpath]
+            for b in range(len(edges) - 1):
+                band = (df["distance"] >= edges[b]) & (df["distance"] < edges[b + 1])
+                if sectors is None:
+                    counts[i, b, 0] = band.sum()
+                    continue
+                for s in range(len(sectors) - 1):
+                    sector = (df["angle"] >= sectors[s]) & (
+                        df["angle"] < sectors[s + 1]
+                    )
+                    counts[i, b, s] = (band & sector).sum()
+        return counts if sectors is not None else counts[:, :, 0]
+
+    def test_spatial_01(self):
+        # distances are in microns from the well, 100 px = 50 microns out
+        coords = to_bow_coords(
+            pandas.DataFrame(
+                {"relpath": ["P/B/region_0.tif"], "x": [0.0], "y": [300.0]}
+            ),
+            self.regions,
+        )
+        self.assertAlmostEqual(coords["distance"][0], 100.0)
+        self.assertAlmostEqual(coords["angle"][0], 90.0)
+
+    def test_spatial_02(self):
+        index = ObjectIndex.build(self.objects, self.regions)
+        self.assertEqual(len(index), len(self.objects))
+
+        edges = [-1000.0, 0.0, 25.0, 100.0, 250.0, 1000.0]
+        numpy.testing.assert_array_equal(index.counts(edges), self.expected(edges))
+
+        sectors = [-45.0, 0.0, 45.0]
+        numpy.testing.assert_array_equal(
+            index.counts(edges, sectors), self.expected(edges, sectors)
+        )
+
+        df = index.to_frame(edges, sectors)
+        self.assertEqual(len(df), 5 * 5 * 2)
+        self.assertEqual(df["count"].sum(), self.expected(edges, sectors).sum())
+
+    def test_spatial_03(self):
+        index = ObjectIndex.build(self.objects, self.regions, version="v1")
+        with tempfile.TemporaryDirectory() as dirpath:
+            path = os.path.join(dirpath, "OBJECTS.index.npz")
+            index.save(path)
+            loaded = ObjectIndex.load(path)
+
+        self.assertEqual(loaded.version, "v1")
+        self.assertEqual(loaded.relpaths, index.relpaths)
+        edges = [0.0, 50.0, 100.0]
+        numpy.testing.assert_array_equal(loaded.counts(edges), index.counts(edges))
+
+        both = ObjectIndex.concat([index, loaded])
+        numpy.testing.assert_array_equal(
+            both.counts(edges), numpy.concatenate([index.counts(edges)] * 2)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
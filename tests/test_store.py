@@ -0,0 +1,108 @@
+import tempfile
+import unittest
+from types import SimpleNamespace
+from os.path import join
+
+import pandas
+
+from antilles.block import Block, Field, MergeConflict, cast, merge_changes
+from antilles.utils.store import CsvStore
+
+
+class TestStore(unittest.TestCase):
+    def test_store_01(self):
+        # the frame passed in keeps its own dtypes
+        df = pandas.DataFrame({"sample": [1, 2], "angle": [0, 90]})
+        out = cast(df, Field.ANGLES_COARSE)
+        self.assertIsInstance(out["sample"].dtype, pandas.CategoricalDtype)
+        self.assertEqual(out["angle"].dtype, "float64")
+        self.assertEqual(df["sample"].dtype, "int64")
+        self.assertEqual(df["angle"].dtype, "int64")
+
+    def test_store_02(self):
+        # samples named with digits only are read back from csv as integers
+        with tempfile.TemporaryDirectory() as dirpath:
+            store = CsvStore(join(dirpath, "annotations"))
+            df = pandas.DataFrame({"sample": ["1", "2"], "angle": [0.0, 90.0]})
+            store.write(cast(df, Field.ANGLES_COARSE), "ANGLES_COARSE")
+
+            update = pandas.DataFrame({"sample": ["2", "3"], "angle": [45.0, 180.0]})
+            store.upsert(cast(update, Field.ANGLES_COARSE), "ANGLES_COARSE", ["sample"])
+
+            stored = store.read("ANGLES_COARSE")
+            self.assertEqual(stored["sample"].astype(str).tolist(), ["1", "2", "3"])
+            self.assertEqual(stored["angle"].tolist(), [0.0, 45.0, 180.0])
+
+    def test_store_03(self):
+        # only rows changed by this session are merged into those of another
+        snapshot = pandas.DataFrame({"sample": ["1", "2", "3"], "angle": [0, 0, 0]})
+        df = snapshot.copy()
+        df.loc[0, "angle"] = 90
+        stored = snapshot.copy()
+        stored.loc[1, "angle"] = 45
+        stored.loc[3] = ["4", 180]
+
+        rows = merge_changes(df, snapshot, stored, ["sample"])
+        self.assertEqual(rows["sample"].tolist(), ["1"])
+        self.assertEqual(rows["angle"].tolist(), [90])
+
+    def test_store_04(self):
+        # rows changed differently by both sessions are not overwritten
+        snapshot = pandas.DataFrame({"sample": ["1", "2"], "angle": [0, 0]})
+        df = snapshot.copy()
+        df.loc[1, "angle"] = 90
+        stored = snapshot.copy()
+        stored.loc[1, "angle"] = 45
+
+        with self.assertRaises(MergeConflict) as context:
+            merge_changes(df, snapshot, stored, ["sample"])
+        self.assertEqual(context.exception.keys, [("2",)])
+
+        # the same change made by both is not a conflict
+        stored.loc[1, "angle"] = 90
+        rows = merge_changes(df, snapshot, stored, ["sample"])
+        self.assertEqual(rows["sample"].tolist(), ["2"])
+
+    def test_store_05(self):
+        # rows added by this session are merged; dtypes do not count as changes
+        snapshot = pandas.DataFrame({"sample": ["1"], "angle": [0.0]})
+        df = cast(
+            pandas.DataFrame({"sample": ["1", "2"], "angle": [0, 30]}),
+            Field.ANGLES_COARSE,
+        )
+        stored = pandas.DataFrame({"sample": ["1"], "angle": [0.0]})
+
+        rows = merge_changes(df, snapshot, stored, ["sample"])
+        self.assertEqual(rows["sample"].astype(str).tolist(), ["2"])
+
+    def test_store_06(self):
+        # two sessions of the same block save angles of different samples
+        with tempfile.TemporaryDirectory() as dirpath:
+            project = SimpleNamespace(relpath=dirpath, config={})
+            block = {"name": "BLK1", "device": "DEV1", "samples": 3}
+            a, b = Block(block, project), Block(block, project)
+
+            df_a = a.get(Field.ANGLES_COARSE)
+            df_b = b.get(Field.ANGLES_COARSE)
+            df_a.loc[0, "angle"] = 0.0
+            df_b.loc[1, "angle"] = 90.0
+            a.save(df_a, Field.ANGLES_COARSE, merge=True)
+            b.save(df_b, Field.ANGLES_COARSE, merge=True)
+
+            stored = a.read(Field.ANGLES_COARSE)
+            self.assertEqual(stored["angle"].tolist(), [0.0, 90.0, -90.0])
+
+            # and then the same sample, differently
+            df_a = a.get(Field.ANGLES_COARSE)
+            df_a.loc[2, "angle"] = 180.0
+            df_b.loc[2, "angle"] = 45.0
+            a.save(df_a, Field.ANGLES_COARSE, merge=True)
+            with self.assertRaises(MergeConflict):
+                b.save(df_b, Field.ANGLES_COARSE, merge=True)
+
+            stored = a.read(Field.ANGLES_COARSE)
+            self.assertEqual(stored["angle"].tolist(), [0.0, 90.0, 180.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import io
+import struct
+import tempfile
+import unittest
+import warnings
+from os.path import join
+
+import numpy
+from PIL import Image, UnidentifiedImageError
+
+from antilles.utils.slides import read_tiff_size, get_image_size
+
+# tag types: 3 = SHORT, 4 = LONG, 16 = LONG8
+formats = {3: "H", 4: "I", 16: "Q"}
+
+
+def make_tiff(order: str, big: bool, types, size) -> bytes:
+    # the header and first IFD of a (Big)TIFF, with only width and height
+    fmt = {"II": "<", "MM": ">"}[order]
+    if big:
+        header = order.encode() + struct.pack(fmt + "HHHQ", 43, 8, 0, 16)
+        count, entry, value_size = struct.pack(fmt + "Q", 2), fmt + "HHQ", 8
+    else:
+        header = order.encode() + struct.pack(fmt + "HI", 42, 8)
+        count, entry, value_size = struct.pack(fmt + "H", 2), fmt + "HHI", 4
+
+    tags = b""
+    for tag, type_, value in zip([256, 257], types, size):
+        # values are left justified in their field, whatever the byte order
+        value = struct.pack(fmt + formats[type_], value).ljust(value_size, b"\0")
+        tags += struct.pack(entry, tag, type_, 1) + value
+    return header + count + tags + bytes(value_size)
+
+
+class TestTiff(unittest.TestCase):
+    def test_tiff_01(self):
+        for order in ["II", "MM"]:
+            for types in [(3, 3), (4, 4), (3, 4)]:
+                data = make_tiff(order, False, types, (1200, 900))
+                self.assertEqual(read_tiff_size(io.BytesIO(data)), (1200, 900))
+
+    def test_tiff_02(self):
+        for order in ["II", "MM"]:
+            for types in [(3, 3), (4, 4), (16, 16), (3, 16)]:
+                data = make_tiff(order, True, types, (60000, 40000))
+                self.assertEqual(read_tiff_size(io.BytesIO(data)), (60000, 40000))
+
+    def test_tiff_03(self):
+        # not a TIFF, or a TIFF without its size
+        self.assertIsNone(read_tiff_size(io.BytesIO(b"\x89PNG\r\n\x1a\n" + bytes(8))))
+        self.assertIsNone(read_tiff_size(io.BytesIO(b"II" + struct.pack("<H", 41))))
+
+        data = bytearray(make_tiff("II", False, (3, 3), (10, 20)))
+        data[10:12] = struct.pack("<H", 258)  # the width tag is something else
+        self.assertIsNone(read_tiff_size(io.BytesIO(bytes(data))))
+
+    def test_tiff_04(self):
+        image = Image.fromarray(numpy.zeros((20, 30, 3), dtype=numpy.uint8))
+        with tempfile.TemporaryDirectory() as dirpath:
+            for name in ["region.tif", "region.png"]:
+                image.save(join(dirpath, name))
+                self.assertEqual(get_image_size(join(dirpath, name)), (30, 20))
+
+            # truncated headers fall back to PIL, which gives up too
+            with open(join(dirpath, "broken.tif"), "wb") as file:
+                file.write(make_tiff("II", False, (3, 3), (10, 20))[:12])
+            with self.assertRaises(UnidentifiedImageError), warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                get_image_size(join(dirpath, "broken.tif"))
+
+
+if __name__ == "__main__":
+    unittest.main()
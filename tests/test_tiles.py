@@ -0,0 +1,93 @@
+import multiprocessing
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+from antilles.utils.io import init_worker
+from antilles.utils.tiles import TileCache, SharedTileCache, get_tile_cache
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # python < 3.8
+    shared_memory = None
+
+
+def make_tile(value: int) -> numpy.ndarray:
+    return numpy.full((16, 16, 3), value, dtype=numpy.uint8)
+
+
+def put_tile(value: int) -> str:
+    # runs in a worker process, whose cache is shared
+    cache = get_tile_cache()
+    key = ("fingerprint", 0, value, 0)
+    cache.put(key, make_tile(value))
+    return cache.name(key)
+
+
+def exists(name: str) -> bool:
+    try:
+        shared_memory.SharedMemory(name=name).close()
+    except FileNotFoundError:
+        return False
+    return True
+
+
+class TestTileCache(unittest.TestCase):
+    def test_cache_01(self):
+        cache = TileCache(max_bytes=2 * make_tile(0).nbytes)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", make_tile(1))
+        cache.put("b", make_tile(2))
+        self.assertEqual(cache.get("a")[0, 0, 0], 1)
+
+        # "b" was least recently used
+        cache.put("c", make_tile(3))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 2))
+        self.assertEqual(stats["tiles"], 2)
+        self.assertEqual(stats["bytes"], 2 * make_tile(0).nbytes)
+
+    def test_cache_02(self):
+        cache = SharedTileCache(namespace="antl_test")
+        try:
+            key = ("fingerprint", 0, 1, 2)
+            self.assertIsNone(cache.get(key))
+            cache.put(key, make_tile(7))
+
+            other = SharedTileCache(namespace="antl_test")
+            tile = other.get(key)
+            numpy.testing.assert_array_equal(tile, make_tile(7))
+            self.assertEqual(other.stats()["hits"], 1)
+        finally:
+            cache.clear()
+        self.assertIsNone(cache.get(key))
+
+    def test_cache_03(self):
+        # workers unlink their segments when the pool exits, and forked ones
+        # leave those of the parent alone
+        settings = {"tile_cache": {"shared": True, "namespace": "antl_pool"}}
+        parent = SharedTileCache(namespace="antl_pool")
+        parent.put(("parent",), make_tile(1))
+        try:
+            for method in multiprocessing.get_all_start_methods():
+                with ProcessPoolExecutor(
+                    max_workers=2,
+                    mp_context=multiprocessing.get_context(method),
+                    initializer=init_worker,
+                    initargs=(settings,),
+                ) as pool:
+                    names = list(pool.map(put_tile, range(4)))
+                    self.assertTrue(any(exists(name) for name in names))
+
+                self.assertFalse(any(exists(name) for name in names), method)
+                self.assertTrue(exists(parent.name(("parent",))), method)
+        finally:
+            parent.clear()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import tempfile
+import unittest
+
+import numpy
+from PIL import Image
+
+from antilles.block import arrow_init_defaults, init_coords_grid, init_coords_slides
+from antilles.utils.io import configure
+from antilles.utils.slides import get_catalog
+from antilles.utils.tissue import tissue_mask, wedge_fractions, find_sections
+from antilles.wholeslideimage import WholeSlideImage
+
+
+def make_thumbnail() -> numpy.ndarray:
+    # a pink section on the left half of a glass slide, with some dust
+    rng = numpy.random.default_rng(0)
+    image = numpy.full((200, 300, 3), 235, dtype=numpy.uint8)
+    image += rng.integers(0, 10, image.shape, dtype=numpy.uint8)
+    yy, xx = numpy.mgrid[:200, :300]
+    section = numpy.hypot(xx - 100, yy - 100) < 80
+    image[section] = (200, 120, 170)
+    image[10:12, 280:282] = (120, 120, 120)
+    return image
+
+
+class TestTissue(unittest.TestCase):
+    def test_tissue_01(self):
+        mask = tissue_mask(make_thumbnail())
+        yy, xx = numpy.mgrid[:200, :300]
+        section = numpy.hypot(xx - 100, yy - 100) < 80
+        self.assertGreater((mask == section).mean(), 0.99)
+
+        # glass alone has no tissue
+        glass = numpy.full((50, 50, 3), 240, dtype=numpy.uint8)
+        self.assertFalse(tissue_mask(glass).any())
+
+    def test_tissue_02(self):
+        mask = tissue_mask(make_thumbnail())
+
+        # thumbnail downsampled 10x from level 0; a device at the edge of the
+        # section, with wells pointing into the section, along it and off it
+        fractions = wedge_fractions(
+            mask,
+            factor=10.0,
+            center=(1800, 1000),
+            angles=[180.0, 90.0, 0.0],
+            span=60.0,
+            radius_inner=100.0,
+            radius_outer=500.0,
+        )
+        self.assertGreater(fractions[0], 0.95)
+        self.assertTrue(0.2 < fractions[1] < 0.8)
+        self.assertLess(fractions[2], 0.05)
+
+    def test_tissue_03(self):
+        # three sections of different sizes, and a speck, in a row
+        mask = numpy.zeros((100, 400), dtype=bool)
+        mask[40:60, 300:340] = True
+        mask[30:70, 20:80] = True
+        mask[45:55, 170:190] = True
+        mask[5:7, 5:7] = True
+
+        sections = find_sections(mask, 3)
+        numpy.testing.assert_allclose(
+            sections, [(49.5, 49.5), (179.5, 49.5), (319.5, 49.5)]
+        )
+
+        # ordered away from a label on the right, and only the largest kept
+        sections = find_sections(mask, 2, label_side="right")
+        numpy.testing.assert_allclose(sections, [(319.5, 49.5), (49.5, 49.5)])
+
+        self.assertEqual(find_sections(mask, 5)[-1], (319.5, 49.5))
+        self.assertEqual(len(find_sections(mask, 5)), 4)
+        self.assertEqual(find_sections(numpy.zeros((10, 10), dtype=bool), 2), [])
+
+    def test_tissue_04(self):
+        # slides whose arrows are placed already are not segmented again
+        with tempfile.TemporaryDirectory() as dirpath:
+            configure(basepath=dirpath)
+            os.makedirs(os.path.join(dirpath, "PRJ1"))
+            slides = []
+            for panel in ["HE", "CD3"]:
+                relpath = os.path.join("PRJ1", f"{panel}.tif")
+                Image.fromarray(make_thumbnail()).save(os.path.join(dirpath, relpath))
+                slides.append(WholeSlideImage("PRJ1", "BLK1", panel, 1, relpath))
+
+            samples = [{"name": "SMP1", "cohorts": {}}]
+            params = {**arrow_init_defaults, "method": "tissue", "max_workers": 1}
+            try:
+                df = init_coords_slides(
+                    slides, samples, params, placed={slides[0].relpath}
+                )
+                grid = init_coords_grid(slides[:1], samples)[0][0]
+                get_catalog(slides[0].relpath).flush()
+            finally:
+                configure()
+
+            coords = df.set_index("panel")[["center_x", "center_y"]]
+            self.assertEqual(tuple(coords.loc["HE"]), tuple(grid))
+            self.assertEqual(tuple(coords.loc["CD3"]), (100, 100))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,16 +1,19 @@
 import json
+import os
 import unittest
 
 from antilles.block import unpack
 
+assets = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+
 
 class TestBlockUnpack(unittest.TestCase):
     def setUp(self):
-        with open("./assets/project1.json") as file:
+        with open(os.path.join(assets, "project1.json")) as file:
             self.project1 = json.load(file)
-        with open("./assets/project2.json") as file:
+        with open(os.path.join(assets, "project2.json")) as file:
             self.project2 = json.load(file)
-        with open("./assets/project3.json") as file:
+        with open(os.path.join(assets, "project3.json")) as file:
             self.project3 = json.load(file)
 
     def test_unpack_01(self):
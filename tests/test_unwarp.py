@@ -0,0 +1,151 @@
+import unittest
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import numpy
+import pandas
+
+from antilles.pipeline.profile import (
+    columns_region,
+    get_bow,
+    profile_tile,
+    profile_polar,
+    to_frame,
+)
+from antilles.pipeline.unwarp import Unwarper, get_remap_grid, get_grid, unwarp
+
+
+class ArrayReader:
+    def __init__(self, image: numpy.ndarray):
+        self.image = image
+        self.n_reads = 0
+
+    def size(self, relpath: str):
+        return self.image.shape[1], self.image.shape[0]
+
+    def read(self, relpath: str, x: int, y: int, width: int, height: int):
+        self.n_reads += 1
+        return self.image[y : y + height, x : x + width]
+
+
+class ListWriter:
+    def __init__(self, reader: ArrayReader):
+        self.reader = reader
+        self.names = []
+        self.n_reads = []
+
+    def add(self, name: str, array: numpy.ndarray) -> None:
+        self.names.append(name)
+        self.n_reads.append(self.reader.n_reads)
+
+
+def make_region(size: int = 200) -> numpy.ndarray:
+    # brightness falls off with distance from the center of the image
+    yy, xx = numpy.mgrid[:size, :size]
+    rho = numpy.hypot(xx - size // 2, yy - size // 2)
+    values = numpy.clip(255 - rho, 0, 255).astype(numpy.uint8)
+    return numpy.repeat(values[:, :, numpy.newaxis], 3, axis=2)
+
+
+def make_bow(angle: float) -> dict:
+    well = numpy.radians(angle)
+    return {
+        "relpath": "P/B/region.tif",
+        "center_x": 100,
+        "center_y": 100,
+        "well_x": 100 + 20 * numpy.cos(well),
+        "well_y": 100 + 20 * numpy.sin(well),
+        "mpp": 2.0,
+    }
+
+
+params = {
+    "radius_range": (0.0, 100.0),
+    "resolution": None,
+    "span": 90.0,
+    "n_angles": 30,
+}
+
+
+class TestUnwarp(unittest.TestCase):
+    def test_unwarp_01(self):
+        get_remap_grid.cache_clear()
+        reader = ArrayReader(make_region())
+
+        for angle in [0.0, 90.0, -135.0]:
+            image = unwarp(reader, make_bow(angle), params)
+            self.assertEqual(image.shape, (50, 30, 4))
+            self.assertTrue((image[:, :, 3] == 255).all())
+
+            # rows are 2 microns (1 px) apart, from the well 20 px out
+            expected = 255 - (20.5 + numpy.arange(50))
+            numpy.testing.assert_allclose(image[:, :, 0].mean(axis=1), expected, atol=1)
+
+        # regions of the same geometry share one grid
+        info = get_remap_grid.cache_info()
+        self.assertEqual((info.hits, info.misses), (2, 1))
+
+    def test_unwarp_02(self):
+        # the bow leaves the region to the right
+        region = make_bow(0.0)
+        region["center_x"], region["well_x"] = 150, 170
+        image = unwarp(ArrayReader(make_region()), region, params)
+        self.assertTrue((image[:10, :, 3] == 255).all())
+        self.assertTrue((image[-10:, 10:20, 3] == 0).all())
+
+    def test_unwarp_03(self):
+        # profiles of the polar image are close to those of the region
+        image = make_region()
+        region = make_bow(30.0)
+        settings = {
+            "bin_width": 20.0,
+            "max_distance": 100.0,
+            "angle_bins": 1,
+            "stains": "hed",
+            **params,
+        }
+        bow = get_bow(region, settings)
+
+        counts, sums = profile_tile(image, (0, 0), bow, "hed")
+        polar = unwarp(ArrayReader(image), region, params)
+        radii, _, _ = get_grid(2.0, params)
+        polar_counts, polar_sums = profile_polar(polar, radii, bow, "hed")
+
+        # 50 x 30 samples, each weighted by the area of the region it covers
+        numpy.testing.assert_allclose(polar_counts, counts, rtol=0.05)
+        means = sums[:, 3] / counts
+        polar_means = polar_sums[:, 3] / polar_counts
+        numpy.testing.assert_allclose(means, polar_means, atol=1.5)
+
+        fields = {c: "" for c in columns_region}
+        df = to_frame({**fields, **region}, bow, polar_counts, polar_sums, settings)
+        self.assertEqual(df["n_pixels"].dtype, numpy.int64)
+        numpy.testing.assert_allclose(df["n_pixels"], counts, rtol=0.05)
+
+    def test_unwarp_04(self):
+        # polar images are written as they complete, a few regions ahead
+        reader = ArrayReader(make_region())
+        writer = ListWriter(reader)
+        regions = [
+            {**make_bow(angle), "relpath": f"P/B/region{i}.tif"}
+            for i, angle in enumerate(range(0, 360, 30))
+        ]
+
+        @contextmanager
+        def open_writer():
+            yield writer
+
+        block = SimpleNamespace(
+            get=lambda field: pandas.DataFrame(regions),
+            open_regions=lambda: reader,
+            polar_store=SimpleNamespace(writer=open_writer),
+        )
+        Unwarper(None, block, params, max_workers=1).run()
+
+        self.assertEqual(sorted(writer.names), sorted(r["relpath"] for r in regions))
+        for i, n_reads in enumerate(writer.n_reads):
+            self.assertLessEqual(n_reads, i + 1 + 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -86,6 +86,59 @@ class TestUpsert(unittest.TestCase):
         self.assertTrue(
             df3.equals(upsert(df1, df2, ['value1', 'value2'])))
 
+    def test_upsert_04(self):
+        # keys are matched as tuples, not column by column
+        df1 = pandas.DataFrame([
+            {"value1": 1, "value2": "A", "value3": "str1"},
+            {"value1": 1, "value2": "B", "value3": "str2"},
+            {"value1": 2, "value2": "A", "value3": "str3"},
+        ])
+
+        df2 = pandas.DataFrame([
+            {"value1": 1, "value2": "A", "value3": "str11"},
+            {"value1": 2, "value2": "B", "value3": "str14"},
+        ])
+
+        df3 = pandas.DataFrame([
+            {"value1": 1, "value2": "A", "value3": "str11"},
+            {"value1": 1, "value2": "B", "value3": "str2"},
+            {"value1": 2, "value2": "A", "value3": "str3"},
+            {"value1": 2, "value2": "B", "value3": "str14"},
+        ])
+
+        self.assertTrue(df3.equals(upsert(df1, df2, ['value1', 'value2'])))
+
+    def test_upsert_05(self):
+        df1 = pandas.DataFrame([
+            {"value1": 2, "value2": "A", "value3": "str1"},
+            {"value1": 1, "value2": "A", "value3": "str2"},
+        ])
+
+        df2 = pandas.DataFrame([
+            {"value1": 3, "value2": "A", "value3": "str3"},
+            {"value1": 1, "value2": "A", "value3": "str12"},
+        ])
+
+        df3 = pandas.DataFrame([
+            {"value1": 2, "value2": "A", "value3": "str1"},
+            {"value1": 3, "value2": "A", "value3": "str3"},
+            {"value1": 1, "value2": "A", "value3": "str12"},
+        ])
+
+        self.assertTrue(
+            df3.equals(upsert(df1, df2, ['value1', 'value2'], sort=False)))
+
+    def test_upsert_06(self):
+        df1 = pandas.DataFrame([
+            {"value1": 1, "value2": "A", "value3": "str1"},
+        ])
+
+        df2 = pandas.DataFrame([
+            {"value1": 2, "value2": "B", "value3": "str2"},
+        ])
+
+        self.assertTrue(df2.equals(upsert(df1, df2, [])))
+
 
 if __name__ == '__main__':
     unittest.main()